@@ -0,0 +1,331 @@
+"""
+PDF 引擎与接口的性能基准。
+
+对 corpus.py 生成的每类文档分别计时：
+- PDFEngine 各阶段：extract_page_data、_enrich_targets、_edit_stream_data、render_to_page、reconstruct、save
+- FastAPI 接口 (TestClient，需要 httpx)：上传、pdf-info、scan-detect、analyze、detect-watermarks、preview、reconstruct
+
+每项报告耗时 (引擎各阶段取 --repeat 次中的最小值)、测量期间的峰值 RSS 与每秒处理页数，结果输出为 JSON。
+指定 --baseline 时与之前保存的结果对比，耗时或峰值 RSS 超出容差即视为性能回退，以退出码 1 结束。
+
+用法:
+    python benchmarks/bench_engine.py --output bench.json                  # 完整运行并保存结果
+    python benchmarks/bench_engine.py --scale 0.2 --baseline bench.json    # 快速运行并与基线对比
+    python benchmarks/bench_engine.py --cases text_heavy long --skip-api
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import fitz
+import corpus
+from utils import PDFEngine, save_document
+
+# 与基线对比时的默认容差：耗时 +25%，峰值 RSS +25%；低于噪声下限的差异不计为回退
+DEFAULT_TIME_TOLERANCE = 0.25
+DEFAULT_RSS_TOLERANCE = 0.25
+MIN_SECONDS_DELTA = 0.1
+MIN_RSS_DELTA_MB = 16
+RSS_POLL_INTERVAL = 0.005
+
+
+def _current_rss():
+    """当前常驻内存 (字节)；没有 /proc 的平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss():
+    """进程生命周期内的峰值常驻内存 (字节)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakRss:
+    """测量期间后台线程轮询 RSS 记录峰值；无法读取当前 RSS 时退化为进程峰值"""
+
+    def __enter__(self):
+        self.peak = _current_rss()
+        if self.peak is None:
+            return self
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self):
+        while not self._stop.wait(RSS_POLL_INTERVAL):
+            self.peak = max(self.peak, _current_rss() or 0)
+
+    def __exit__(self, *exc):
+        if self.peak is None:
+            self.peak = _max_rss()
+            return False
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss() or 0)
+        return False
+
+
+def measure(fn, pages, repeat=1, quiet=True):
+    """执行 fn (每次执行前由 fn 自行准备状态)，返回耗时最短一次的指标"""
+    best = None
+    for _ in range(repeat):
+        out = io.StringIO()
+        with PeakRss() as rss:
+            t0 = time.perf_counter()
+            # 引擎与接口会打印处理日志，计时时屏蔽
+            with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext():
+                fn()
+            elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": round(elapsed, 4), "peak_rss_mb": round(rss.peak / 1024 / 1024, 1)}
+    best["pages"] = pages
+    best["pages_per_second"] = round(pages / best["seconds"], 2) if best["seconds"] > 0 else None
+    return best
+
+
+# --- PDFEngine 各阶段 ---
+
+def _id_targets(pdf):
+    """每页第一个文本片段与矢量图形的 ID 目标 (不带 bbox，需要 _enrich_targets 补全)"""
+    engine = PDFEngine(pdf)
+    try:
+        targets = {"text": [], "drawings": []}
+        for i in range(len(engine.src_doc)):
+            index = engine.get_page_index(i)
+            if index.text_elements:
+                targets["text"].append({"id": index.text_elements[0]["id"]})
+            if index.drawing_elements:
+                targets["drawings"].append({"id": index.drawing_elements[0]["id"]})
+            engine.invalidate_page_index(i)
+        return targets
+    finally:
+        engine.close()
+
+
+def bench_engine(doc, repeat):
+    pdf = doc.pdf
+    pages = doc.page_count
+    results = {}
+
+    def extract():
+        engine = PDFEngine(pdf)
+        try:
+            for i in range(pages):
+                engine.extract_page_data(engine.src_doc[i], page_index=i)
+        finally:
+            engine.close()
+    results["extract_page_data"] = measure(extract, pages, repeat)
+
+    id_targets = _id_targets(pdf)
+
+    def enrich():
+        engine = PDFEngine(pdf)
+        try:
+            engine._enrich_targets(json.loads(json.dumps(id_targets)))
+        finally:
+            engine.close()
+    results["enrich_targets"] = measure(enrich, pages, repeat)
+
+    # 内容流编辑：删除计划与流数据在计时前准备好，只计 _edit_stream_data 本身
+    engine = PDFEngine(pdf)
+    try:
+        jobs = []
+        for i in range(pages):
+            page = engine.src_doc[i]
+            page.clean_contents()
+            plan = engine._plan_stream_removal(doc.remove_targets, page, i)
+            for xref in page.get_contents():
+                jobs.append((engine.src_doc.xref_stream(xref).decode("latin-1"), page, i, plan))
+
+        def edit():
+            for stream, page, i, plan in jobs:
+                engine._edit_stream_data(stream, doc.remove_targets, None, page, i, plan=plan)
+        results["edit_stream_data"] = measure(edit, pages, repeat)
+    finally:
+        engine.close()
+
+    def render():
+        engine = PDFEngine(pdf)
+        try:
+            targets = json.loads(json.dumps(doc.remove_targets))
+            engine._enrich_targets(targets)
+            for i in range(pages):
+                engine.render_to_page(engine.src_doc[i], None, targets, None, page_index=i)
+        finally:
+            engine.close()
+    results["render_to_page"] = measure(render, pages, repeat)
+
+    def reconstruct():
+        engine = PDFEngine(pdf)
+        try:
+            engine.reconstruct(json.loads(json.dumps(doc.remove_targets)))
+        finally:
+            engine.close()
+    results["reconstruct"] = measure(reconstruct, pages, repeat)
+
+    def reconstruct_and_save():
+        engine = PDFEngine(pdf)
+        try:
+            out = engine.reconstruct(json.loads(json.dumps(doc.remove_targets)))
+            save_document(out, io.BytesIO())
+        finally:
+            engine.close()
+    results["reconstruct_save"] = measure(reconstruct_and_save, pages, repeat)
+    return results
+
+
+# --- FastAPI 接口 ---
+
+def bench_api(client, doc):
+    """每个接口只计首次 (冷缓存) 请求"""
+    pages = doc.page_count
+    results = {}
+    targets = json.dumps(doc.remove_targets, ensure_ascii=False)
+    modifiers = json.dumps({"*": [{"type": "text", "text": "BENCH", "x": 300, "y": 400, "fontsize": 40, "angle": 45}]})
+    doc_id = None
+
+    def call(name, method, url, expected_pages=pages, **kwargs):
+        nonlocal doc_id
+        holder = {}
+
+        def run():
+            holder["response"] = getattr(client, method)(url, **kwargs)
+        metrics = measure(run, expected_pages)
+        response = holder["response"]
+        metrics["status"] = response.status_code
+        if response.status_code != 200:
+            metrics["error"] = response.text[:200]
+        results[name] = metrics
+        return response
+
+    response = call("upload", "post", "/api/documents", files={"file": (f"{doc.name}.pdf", doc.pdf, "application/pdf")})
+    doc_id = response.json().get("doc_id")
+    form = {"doc_id": doc_id}
+    call("pdf_info", "post", "/api/pdf-info", data=form)
+    call("scan_detect", "post", "/api/scan-detect", data=form)
+    call("analyze", "post", "/api/analyze?page_index=0", expected_pages=1, data=form)
+    call("analyze_all", "post", "/api/analyze?page_index=0&analyze_all=true", data=form)
+    call("detect_watermarks", "post", "/api/detect-watermarks?max_pages=0", data=form)
+    call("preview", "post", "/api/preview?page_index=0", expected_pages=1,
+         data={"doc_id": doc_id, "remove_targets_json": targets, "page_modifiers_json": modifiers})
+    call("reconstruct", "post", "/api/reconstruct",
+         data={"doc_id": doc_id, "remove_targets_json": targets, "page_modifiers_json": modifiers})
+    return results
+
+
+def run_api_cases(docs):
+    """在独立的临时结果缓存目录中启动应用，避免命中之前运行留下的缓存"""
+    cache_dir = tempfile.mkdtemp(prefix="hajihan-bench-")
+    os.environ["RESULT_CACHE_DIR"] = cache_dir
+    try:
+        from fastapi.testclient import TestClient
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main
+        with TestClient(main.app) as client:
+            return {doc.name: bench_api(client, doc) for doc in docs}
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+# --- 基线对比 ---
+
+def compare(results, baseline, time_tolerance, rss_tolerance):
+    """返回回退列表 [(语料, 分组, 指标, 说明)]；基线中不存在的项目不参与对比"""
+    regressions = []
+    for case, groups in results["results"].items():
+        for group, metrics in groups.items():
+            for name, current in metrics.items():
+                base = baseline.get("results", {}).get(case, {}).get(group, {}).get(name)
+                if not base:
+                    continue
+                if current.get("status", 200) != 200:
+                    regressions.append((case, group, name, f"status {current['status']}"))
+                    continue
+                delta = current["seconds"] - base["seconds"]
+                if delta > MIN_SECONDS_DELTA and current["seconds"] > base["seconds"] * (1 + time_tolerance):
+                    regressions.append((case, group, name, f"time {base['seconds']}s -> {current['seconds']}s"))
+                delta = current["peak_rss_mb"] - base["peak_rss_mb"]
+                if delta > MIN_RSS_DELTA_MB and current["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_tolerance):
+                    regressions.append((case, group, name,
+                                        f"peak RSS {base['peak_rss_mb']}MB -> {current['peak_rss_mb']}MB"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="*", default=list(corpus.BUILDERS), help="语料名称 (默认全部)")
+    parser.add_argument("--scale", type=float, default=1.0, help="语料规模系数")
+    parser.add_argument("--repeat", type=int, default=3, help="引擎各阶段的重复次数 (取最小值)")
+    parser.add_argument("--skip-api", action="store_true", help="不测接口")
+    parser.add_argument("--output", help="结果 JSON 的保存路径 (默认输出到标准输出)")
+    parser.add_argument("--baseline", help="用于对比的基线结果 JSON")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument("--rss-tolerance", type=float, default=DEFAULT_RSS_TOLERANCE)
+    args = parser.parse_args()
+
+    docs = []
+    for name in args.cases:
+        print(f"Generating {name} (scale {args.scale})...", file=sys.stderr)
+        docs.append(corpus.build(name, args.scale))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pymupdf": fitz.VersionBind,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+        },
+        "corpus": {doc.name: {"pages": doc.page_count, "bytes": len(doc.pdf), "description": doc.description}
+                   for doc in docs},
+        "results": {doc.name: {} for doc in docs},
+    }
+    for doc in docs:
+        print(f"Benchmarking engine on {doc.name}...", file=sys.stderr)
+        results["results"][doc.name]["engine"] = bench_engine(doc, args.repeat)
+    if not args.skip_api:
+        print("Benchmarking API endpoints...", file=sys.stderr)
+        for name, metrics in run_api_cases(docs).items():
+            results["results"][name]["api"] = metrics
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("scale") != args.scale:
+            print(f"Warning: baseline was recorded with scale {baseline.get('meta', {}).get('scale')}", file=sys.stderr)
+        regressions = compare(results, baseline, args.time_tolerance, args.rss_tolerance)
+        for case, group, name, detail in regressions:
+            print(f"REGRESSION {case}/{group}/{name}: {detail}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
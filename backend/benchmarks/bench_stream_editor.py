@@ -0,0 +1,109 @@
+"""
+内容流编辑基准：对比 tokenizer 与旧版 regex 实现的 _edit_stream_data。
+
+在本地用 fitz 生成两类大页面：
+- cad:     大量矢量路径 + 大量文本标注 (类似 CAD 导出)
+- scanned: 大尺寸内联图片 + 不可见 OCR 文本层 (类似扫描件)
+
+用法:
+    python benchmarks/bench_stream_editor.py --labels 3000 --targets 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+from utils import PDFEngine
+
+
+def _page_with_font():
+    doc = fitz.open()
+    page = doc.new_page(width=2384, height=1684)  # A1 横向
+    page.insert_text((10, 10), " ", fontname="helv")  # 注册 /helv 字体资源
+    return doc, page
+
+
+def make_cad_pdf(labels, paths_per_label=20):
+    doc, page = _page_with_font()
+    rnd = random.Random(1)
+    parts = []
+    for i in range(labels):
+        x, y = rnd.uniform(20, 2300), rnd.uniform(20, 1650)
+        for _ in range(paths_per_label):
+            parts.append(f"{x:.2f} {y:.2f} m {x + rnd.uniform(-40, 40):.2f} {y + rnd.uniform(-40, 40):.2f} l S")
+        # TJ 中带字距调整，覆盖被分割的字符串
+        parts.append(f"BT /helv 6 Tf {x:.2f} {y:.2f} Td [(LBL-) -20 ({i:05d})] TJ ET")
+    parts.append("BT /helv 40 Tf 600 800 Td (CONFIDENTIAL DRAFT) Tj ET")
+    doc.update_stream(page.get_contents()[0], "\n".join(parts).encode("latin-1"))
+    return doc.tobytes()
+
+
+def make_scanned_pdf(labels, image_bytes=2_000_000):
+    doc, page = _page_with_font()
+    rnd = random.Random(2)
+    # 不含空白字符的图像数据，避免与 EI 结束标记混淆
+    data = bytes(rnd.randrange(0x21, 0x7F) for _ in range(image_bytes))
+    width = 2000
+    height = image_bytes // width
+    parts = [f"q 2384 0 0 1684 0 0 cm BI /W {width} /H {height} /CS /G /BPC 8 ID\n".encode("latin-1") + data + b"\nEI Q"]
+    words = ["scan", "invoice", "total", "amount", "date", "signature"]
+    for i in range(labels):
+        x, y = rnd.uniform(20, 2300), rnd.uniform(20, 1650)
+        word = f"{rnd.choice(words)}{i}"
+        parts.append(f"BT 3 Tr /helv 9 Tf {x:.2f} {y:.2f} Td ({word}) Tj ET".encode("latin-1"))
+    doc.update_stream(page.get_contents()[0], b"\n".join(parts))
+    return doc.tobytes()
+
+
+def run_case(name, pdf_bytes, n_targets, repeat):
+    engine = PDFEngine(pdf_bytes)
+    try:
+        page = engine.src_doc[0]
+        page.clean_contents()
+        spans = engine.get_page_index(0).text_elements
+        rnd = random.Random(3)
+        chosen = rnd.sample(spans, min(n_targets, len(spans)))
+        remove_targets = {"text": chosen}
+        plan = engine._plan_stream_removal(remove_targets, page, 0)
+        stream = engine.src_doc.xref_stream(page.get_contents()[0]).decode("latin-1")
+
+        result = {"case": name, "stream_bytes": len(stream), "targets": len(chosen)}
+        outputs = {}
+        for editor in ("tokenizer", "regex"):
+            engine.stream_editor = editor
+            best = None
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                new_data, modified = engine._edit_stream_data(stream, remove_targets, None, page, 0, plan=plan)
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            outputs[editor] = new_data
+            result[f"{editor}_seconds"] = round(best, 4)
+        result["speedup"] = round(result["regex_seconds"] / max(result["tokenizer_seconds"], 1e-9), 2)
+        result["identical_output"] = outputs["tokenizer"] == outputs["regex"]
+        return result
+    finally:
+        engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", type=int, default=3000, help="每页文本标注数量")
+    parser.add_argument("--targets", type=int, default=200, help="删除目标数量")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [
+        run_case("cad", make_cad_pdf(args.labels), args.targets, args.repeat),
+        run_case("scanned", make_scanned_pdf(args.labels), args.targets, args.repeat),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
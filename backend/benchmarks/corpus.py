@@ -0,0 +1,218 @@
+"""
+基准测试用的合成 PDF 语料，全部在本地用 fitz 生成 (不需要下载样本文件)。
+
+每个文档附带一组典型的删除目标 (remove_targets)，用于计时删除流程：
+- text_heavy:     每页数十行正文 + 页脚水印文本
+- cjk:            中文正文 (内置 CJK 字体) + 旋转的中文水印
+- scanned:        整页灰度图片 + 不可见的 OCR 文本层 + 每页相同的印章图片
+- vector_heavy:   每页数千条矢量路径 (类似 CAD 导出) + 矢量印章
+- form_watermark: 水印位于所有页面共享的 (嵌套) Form XObject 中
+- long:           1000+ 页的轻量文档 + 页脚水印
+
+用法:
+    python benchmarks/corpus.py --out /tmp/corpus            # 生成全部文档
+    python benchmarks/corpus.py --out /tmp/corpus --scale 0.2 cjk scanned
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+from utils import drawing_fingerprint, image_fingerprint
+
+FOOTER = "CONFIDENTIAL - INTERNAL USE ONLY"
+CJK_WATERMARK = "内部资料请勿外传"
+FORM_WATERMARK = "SHARED WATERMARK"
+STAMP_COLOR = (0.85, 0.1, 0.1)
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+          "et dolore magna aliqua enim minim veniam quis nostrud exercitation ullamco laboris").split()
+_CJK = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+
+
+class CorpusDoc:
+    """name: 语料名称；pdf: 文档字节；remove_targets: 典型的删除目标"""
+
+    def __init__(self, name, pdf, remove_targets, description=""):
+        self.name = name
+        self.pdf = pdf
+        self.remove_targets = remove_targets
+        self.description = description
+
+    @property
+    def page_count(self):
+        doc = fitz.open(stream=self.pdf, filetype="pdf")
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+
+
+def _sentence(rnd, words=12):
+    return " ".join(rnd.choice(_WORDS) for _ in range(words))
+
+
+def make_text_heavy(pages=50, lines=60):
+    rnd = random.Random(1)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for j in range(lines):
+            page.insert_text((50, 50 + j * 12), _sentence(rnd), fontsize=9)
+        page.insert_text((180, 820), FOOTER, fontsize=9, color=(0.5, 0.5, 0.5))
+        page.insert_text((520, 820), str(i + 1), fontsize=9)
+    return CorpusDoc("text_heavy", doc.tobytes(garbage=3, deflate=True), {"text": [{"content": FOOTER}]},
+                     f"{pages} pages x {lines} lines of Latin text with a footer watermark")
+
+
+def make_cjk(pages=30, lines=40):
+    rnd = random.Random(2)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        for j in range(lines):
+            text = "".join(rnd.choice(_CJK) for _ in range(30))
+            page.insert_text((50, 60 + j * 18), text, fontsize=14, fontname="china-s")
+        center = fitz.Point(300, 420)
+        page.insert_text((140, 420), CJK_WATERMARK, fontsize=48, fontname="china-s", color=(0.8, 0.8, 0.8),
+                         morph=(center, fitz.Matrix(30)))
+    return CorpusDoc("cjk", doc.tobytes(garbage=3, deflate=True), {"text": [{"content": CJK_WATERMARK}]},
+                     f"{pages} pages of CJK text (built-in font) with a rotated watermark")
+
+
+def _noise_image(width, height, seed):
+    rnd = random.Random(seed)
+    # 随机行循环移位拼成整页，生成速度快且压缩率接近真实扫描件
+    row = bytes(rnd.randrange(180, 256) for _ in range(width))
+    samples = b"".join(row[k:] + row[:k] for k in (rnd.randrange(width) for _ in range(height)))
+    pix = fitz.Pixmap(fitz.csGRAY, width, height, samples, False)
+    return pix.tobytes("png")
+
+
+def make_scanned(pages=20):
+    rnd = random.Random(3)
+    stamp = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 120, 60), False)
+    stamp.set_rect(stamp.irect, (200, 30, 30))
+    stamp_png = stamp.tobytes("png")
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=_noise_image(1240, 1754, i))
+        # 不可见的 OCR 文本层
+        for j in range(50):
+            page.insert_text((50, 60 + j * 15), _sentence(rnd, 8), fontsize=9, render_mode=3)
+        page.insert_image(fitz.Rect(440, 760, 560, 820), stream=stamp_png)
+    pdf = doc.tobytes(garbage=3, deflate=True)
+    # 印章图片的内容签名 (与 /api/detect-watermarks 返回的 match 相同)
+    doc = fitz.open(stream=pdf, filetype="pdf")
+    try:
+        info = [im for im in doc[0].get_image_info(xrefs=True) if im["width"] == 120][0]
+        digest = image_fingerprint(doc, info)
+    finally:
+        doc.close()
+    return CorpusDoc("scanned", pdf, {"xobjects": [{"digest": digest}]},
+                     f"{pages} pages of full-page grayscale scans with an invisible OCR layer and a stamp image")
+
+
+def make_vector_heavy(pages=5, paths=5000):
+    rnd = random.Random(4)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=1684, height=1190)  # A2 横向
+        shape = page.new_shape()
+        for k in range(paths):
+            x, y = rnd.uniform(20, 1640), rnd.uniform(20, 1150)
+            if k % 2:
+                shape.draw_line((x, y), (x + rnd.uniform(-40, 40), y + rnd.uniform(-40, 40)))
+            else:
+                shape.draw_rect(fitz.Rect(x, y, x + rnd.uniform(2, 30), y + rnd.uniform(2, 30)))
+            shape.finish(color=(0, 0, 0), width=0.3)
+        # 矢量印章：一个粗边框圆
+        shape.draw_circle((1500, 1050), 60)
+        shape.finish(color=STAMP_COLOR, width=4)
+        shape.commit()
+    pdf = doc.tobytes(garbage=3, deflate=True)
+    doc = fitz.open(stream=pdf, filetype="pdf")
+    try:
+        stamp = [d for d in doc[0].get_drawings() if d.get("color") and tuple(round(c, 2) for c in d["color"]) == STAMP_COLOR]
+        path_hash = drawing_fingerprint(stamp[0])
+    finally:
+        doc.close()
+    return CorpusDoc("vector_heavy", pdf, {"drawings": [{"path_hash": path_hash}]},
+                     f"{pages} pages x {paths} vector paths with a vector stamp")
+
+
+def make_form_watermark(pages=200):
+    source = fitz.open()
+    src_page = source.new_page()
+    src_page.insert_text((120, 420), FORM_WATERMARK, fontsize=40, color=(0.7, 0.7, 0.7))
+    # 嵌套一层 Form XObject
+    inner = fitz.open()
+    inner.new_page().insert_text((100, 760), FOOTER, fontsize=10)
+    src_page.show_pdf_page(src_page.rect, inner, 0)
+    rnd = random.Random(5)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        for j in range(30):
+            page.insert_text((50, 60 + j * 20), _sentence(rnd), fontsize=10)
+        page.show_pdf_page(page.rect, source, 0)
+    return CorpusDoc("form_watermark", doc.tobytes(garbage=3, deflate=True),
+                     {"text": [{"content": FORM_WATERMARK}, {"content": FOOTER}]},
+                     f"{pages} pages sharing a nested Form XObject watermark")
+
+
+def make_long(pages=1200):
+    rnd = random.Random(6)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for j in range(8):
+            page.insert_text((50, 80 + j * 14), _sentence(rnd), fontsize=10)
+        page.insert_text((180, 820), FOOTER, fontsize=9, color=(0.5, 0.5, 0.5))
+    return CorpusDoc("long", doc.tobytes(garbage=3, deflate=True), {"text": [{"content": FOOTER}]},
+                     f"{pages} light pages with a footer watermark")
+
+
+# 语料名称 -> (生成函数, 决定规模的参数名, 默认规模)
+BUILDERS = {
+    "text_heavy": (make_text_heavy, "pages", 50),
+    "cjk": (make_cjk, "pages", 30),
+    "scanned": (make_scanned, "pages", 20),
+    "vector_heavy": (make_vector_heavy, "paths", 5000),
+    "form_watermark": (make_form_watermark, "pages", 200),
+    "long": (make_long, "pages", 1200),
+}
+
+
+def build(name, scale=1.0):
+    """按名称生成语料，scale 缩放其规模 (页数或路径数)"""
+    builder, param, default = BUILDERS[name]
+    return builder(**{param: max(1, int(default * scale))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help=f"语料名称 (默认全部): {', '.join(BUILDERS)}")
+    parser.add_argument("--out", required=True, help="输出目录")
+    parser.add_argument("--scale", type=float, default=1.0, help="规模系数")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest = {}
+    for name in args.names or BUILDERS:
+        doc = build(name, args.scale)
+        path = os.path.join(args.out, f"{name}.pdf")
+        with open(path, "wb") as f:
+            f.write(doc.pdf)
+        manifest[name] = {"path": path, "pages": doc.page_count, "bytes": len(doc.pdf),
+                          "description": doc.description, "remove_targets": doc.remove_targets}
+    print(json.dumps(manifest, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+"""
+PDF 内容流的轻量级词法分析与编辑。
+
+只解析源码编辑需要的部分：文本显示操作符 (Tj / TJ / ' / ") 的字符串操作数，
+以及内联图片 (BI ... ID ... EI)。其余操作数和操作符按原样跳过，
+编辑结果只替换被修改的片段，未修改的源码逐字节保留。
+数据均为 latin-1 解码后的 str，与 PDFEngine 中的流处理保持一致。
+"""
+import re
+
+TEXT_SHOW_OPS = {"Tj", "TJ", "'", '"'}
+# 路径构造、裁剪与绘制操作符
+PATH_CONSTRUCT_OPS = {"m", "l", "c", "v", "y", "h", "re"}
+PATH_CLIP_OPS = {"W", "W*"}
+PATH_PAINT_OPS = {"S", "s", "f", "F", "f*", "B", "B*", "b", "b*", "n"}
+
+_REGULAR = r"[^\x00\t\n\x0c\r ()<>\[\]{}/%]"
+_NUMBER = r"[+-]?(?:\d+\.?\d*|\.\d+)(?!" + _REGULAR + r")"
+
+# 顶层扫描：空白、注释、数字、名称对文本编辑无意义，整段一次性跳过
+_TOP_RE = re.compile(
+    r"(?P<skip>(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*|/" + _REGULAR + r"*|" + _NUMBER + r")+)"
+    r"|(?P<op>" + _REGULAR + r"+)"
+    r"|(?P<dict><<|>>)"
+    r"|(?P<hex><[^<>]*>)"
+    r"|(?P<lit>\()"
+    r"|(?P<arr>\[)"
+    r"|(?P<other>.)",
+    re.S,
+)
+
+# 数组内部扫描：需要逐个保留数字 (TJ 中的字距调整)
+_ARRAY_RE = re.compile(
+    r"(?P<ws>(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)+)"
+    r"|(?P<num>" + _NUMBER + r")"
+    r"|(?P<hex><[^<>]*>)"
+    r"|(?P<lit>\()"
+    r"|(?P<arr>\[)"
+    r"|(?P<end>\])"
+    r"|(?P<word>/?" + _REGULAR + r"+)"
+    r"|(?P<other>.)",
+    re.S,
+)
+
+# 从 skip 片段中取出数字与名称操作数 (注释不产出分组)
+_OPERAND_RE = re.compile(r"%[^\r\n]*|(/" + _REGULAR + r"*|" + _NUMBER + r")")
+
+_LIT_SPECIAL_RE = re.compile(r"[()\\]")
+_LIT_ESCAPE_RE = re.compile(r"\\([0-7]{1,3}|\r\n|[\s\S])")
+_LIT_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f", "\r\n": "", "\r": "", "\n": ""}
+_HEX_WS_RE = re.compile(r"[\x00\t\n\x0c\r ]+")
+# ID 前可以是空白或数组/字符串/字典的结束符 (如 /D[0 1]ID)
+_INLINE_ID_RE = re.compile(r"(?<=[\x00\t\n\x0c\r \])>])ID(?=[\x00\t\n\x0c\r ])")
+_INLINE_EI_RE = re.compile(r"[\x00\t\n\x0c\r ]EI(?=[\x00\t\n\x0c\r ]|$)")
+
+
+class PdfString:
+    """字符串操作数。value 为解码后的原始字节 (latin-1 str)，start/end 为源码位置"""
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind  # "hex" 或 "lit"
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def serialize(self, value):
+        if self.kind == "hex":
+            return "<" + value.encode("latin-1").hex().upper() + ">"
+        escaped = value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "\\r")
+        return "(" + escaped + ")"
+
+
+class PdfArray:
+    """数组操作数 (TJ)。items 中为 PdfString 或 (raw, start, end) 形式的其他元素"""
+    __slots__ = ("items", "start", "end")
+
+    def __init__(self, items, start, end):
+        self.items = items
+        self.start = start
+        self.end = end
+
+
+class TextShowOp:
+    __slots__ = ("name", "operand", "end")
+
+    def __init__(self, name, operand, end):
+        self.name = name
+        self.operand = operand  # PdfString / PdfArray / None
+        self.end = end
+
+    @property
+    def strings(self):
+        if isinstance(self.operand, PdfString):
+            return [self.operand]
+        if isinstance(self.operand, PdfArray):
+            return [item for item in self.operand.items if isinstance(item, PdfString)]
+        return []
+
+
+class InlineImage:
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+def _decode_literal(raw):
+    def repl(m):
+        esc = m.group(1)
+        if esc[0] in "01234567":
+            return chr(int(esc, 8) & 0xFF)
+        return _LIT_ESCAPES.get(esc, esc)
+    return _LIT_ESCAPE_RE.sub(repl, raw)
+
+
+def _read_literal(data, start):
+    """读取从 start 处 '(' 开始的字面量字符串，返回 (PdfString, end)"""
+    depth = 1
+    pos = start + 1
+    while depth:
+        m = _LIT_SPECIAL_RE.search(data, pos)
+        if m is None:
+            pos = len(data)
+            break
+        ch = m.group()
+        if ch == "\\":
+            pos = m.end() + 1
+            continue
+        depth += 1 if ch == "(" else -1
+        pos = m.end()
+    end = pos
+    return PdfString("lit", _decode_literal(data[start + 1:end - 1]), start, end), end
+
+
+def _read_hex(text, start, end):
+    digits = _HEX_WS_RE.sub("", text[1:-1])
+    if len(digits) % 2:
+        digits += "0"
+    try:
+        value = bytes.fromhex(digits).decode("latin-1")
+    except ValueError:
+        value = ""
+    return PdfString("hex", value, start, end)
+
+
+def _read_array(data, start):
+    """读取从 start 处 '[' 开始的数组，返回 (PdfArray, end)"""
+    items = []
+    pos = start + 1
+    n = len(data)
+    while pos < n:
+        m = _ARRAY_RE.match(data, pos)
+        kind = m.lastgroup
+        if kind == "end":
+            pos = m.end()
+            return PdfArray(items, start, pos), pos
+        if kind == "hex":
+            items.append(_read_hex(m.group(), m.start(), m.end()))
+            pos = m.end()
+        elif kind == "lit":
+            item, pos = _read_literal(data, m.start())
+            items.append(item)
+        elif kind == "arr":
+            item, pos = _read_array(data, m.start())
+            items.append((data[item.start:item.end], item.start, item.end))
+        elif kind in ("num", "word"):
+            items.append((m.group(), m.start(), m.end()))
+            pos = m.end()
+        else:
+            pos = m.end()
+    return PdfArray(items, start, n), n
+
+
+def _skip_inline_image(data, pos):
+    """从 BI 之后的位置开始，返回内联图片 EI 结束处的位置"""
+    m = _INLINE_ID_RE.search(data, pos)
+    if m is None:
+        return len(data)
+    # ID 之后紧跟一个空白字符，随后是图像数据
+    m = _INLINE_EI_RE.search(data, m.end())
+    return m.end() if m else len(data)
+
+
+def iter_ops(data):
+    """线性扫描内容流，依次产出 TextShowOp 与 InlineImage"""
+    pos = 0
+    n = len(data)
+    stack = []
+    while pos < n:
+        m = _TOP_RE.match(data, pos)
+        kind = m.lastgroup
+        if kind == "skip":
+            pos = m.end()
+        elif kind == "op":
+            word = m.group()
+            pos = m.end()
+            if word in TEXT_SHOW_OPS:
+                yield TextShowOp(word, stack[-1] if stack else None, pos)
+            elif word == "BI":
+                end = _skip_inline_image(data, pos)
+                yield InlineImage(m.start(), end)
+                pos = end
+            stack = []
+        elif kind == "hex":
+            stack.append(_read_hex(m.group(), m.start(), m.end()))
+            pos = m.end()
+        elif kind == "lit":
+            item, pos = _read_literal(data, m.start())
+            stack.append(item)
+        elif kind == "arr":
+            item, pos = _read_array(data, m.start())
+            stack.append(item)
+        else:
+            pos = m.end()
+
+
+def iter_operators(data):
+    """
+    线性扫描内容流，依次产出 (操作符, 操作数列表)。
+    数字与名称操作数保留原文，字符串、数组操作数以 None 占位；内联图片整体作为一个 BI 操作符产出
+    """
+    pos = 0
+    n = len(data)
+    operands = []
+    while pos < n:
+        m = _TOP_RE.match(data, pos)
+        kind = m.lastgroup
+        if kind == "skip":
+            operands.extend(tok for tok in _OPERAND_RE.findall(m.group()) if tok)
+            pos = m.end()
+        elif kind == "op":
+            word = m.group()
+            pos = m.end()
+            if word == "BI":
+                pos = _skip_inline_image(data, pos)
+            yield word, operands
+            operands = []
+        elif kind == "lit":
+            _, pos = _read_literal(data, m.start())
+            operands.append(None)
+        elif kind == "arr":
+            _, pos = _read_array(data, m.start())
+            operands.append(None)
+        elif kind == "hex":
+            operands.append(None)
+            pos = m.end()
+        else:
+            pos = m.end()
+
+
+class PathOp:
+    """一条完整的路径：start/end 为从第一个构造操作数到绘制操作符的源码范围"""
+    __slots__ = ("start", "end", "paint", "clip")
+
+    def __init__(self, start, end, paint, clip):
+        self.start = start
+        self.end = end
+        self.paint = paint  # 绘制操作符，"n" 表示不绘制 (通常用于裁剪)
+        self.clip = clip    # 路径同时设置了裁剪区域 (W / W*)
+
+
+def iter_paths(data):
+    """线性扫描内容流，依次产出每条路径 (构造操作符 ... 绘制操作符) 的 PathOp"""
+    pos = 0
+    n = len(data)
+    operand_start = None  # 当前操作符第一个操作数的位置
+    path_start = None
+    clip = False
+    while pos < n:
+        m = _TOP_RE.match(data, pos)
+        kind = m.lastgroup
+        if kind == "op":
+            word = m.group()
+            pos = m.end()
+            if word in PATH_CONSTRUCT_OPS:
+                if path_start is None:
+                    path_start = m.start() if operand_start is None else operand_start
+            elif word in PATH_CLIP_OPS:
+                clip = path_start is not None
+            elif word in PATH_PAINT_OPS:
+                if path_start is not None:
+                    yield PathOp(path_start, pos, word, clip)
+                path_start = None
+                clip = False
+            else:
+                if word == "BI":
+                    pos = _skip_inline_image(data, pos)
+                path_start = None
+                clip = False
+            operand_start = None
+            continue
+        if operand_start is None:
+            operand_start = m.start()
+        if kind == "lit":
+            _, pos = _read_literal(data, m.start())
+        elif kind == "arr":
+            _, pos = _read_array(data, m.start())
+        else:
+            pos = m.end()
+
+
+def remove_ranges(data, ranges):
+    """删除 [(start, end)] 范围 (按位置排列、互不重叠) 的源码，各处以换行代替以保持操作符分隔"""
+    out = []
+    pos = 0
+    for start, end in ranges:
+        out.append(data[pos:start])
+        out.append("\n")
+        pos = end
+    out.append(data[pos:])
+    return "".join(out)
+
+
+class _SignatureMatcher:
+    """
+    在文本显示操作的字符串序列中查找签名。
+    签名必须由完整的字符串操作数组成 (TJ 中可以跨越字距调整连续多个字符串)，
+    每个签名独立计数 (第几次出现)，出现序号在 ranks 中的才删除；
+    候选只在字符串边界处通过签名前缀的哈希表查找，整体为线性扫描。
+    """
+
+    def __init__(self, signatures):
+        self.signatures = {sig: ranks for sig, ranks in signatures.items() if sig}
+        self.counts = {}
+        self.prefix_len = min(len(sig) for sig in self.signatures) if self.signatures else 1
+        self.by_prefix = {}
+        for sig in self.signatures:
+            self.by_prefix.setdefault(sig[:self.prefix_len], []).append(sig)
+
+    def scan(self, values):
+        """values 为同类字符串的值列表，返回需要删除的 (起始字符串序号, 结束字符串序号) 区间"""
+        if not self.signatures:
+            return []
+        seq = "".join(values)
+        ends = {}
+        offsets = []
+        offset = 0
+        for i, value in enumerate(values):
+            offsets.append(offset)
+            offset += len(value)
+            ends[offset] = i
+        ranges = []
+        next_free = {}
+        k = self.prefix_len
+        for i, pos in enumerate(offsets):
+            candidates = self.by_prefix.get(seq[pos:pos + k])
+            if not candidates:
+                continue
+            for sig in candidates:
+                end = pos + len(sig)
+                if end not in ends or next_free.get(sig, 0) > pos or not seq.startswith(sig, pos):
+                    continue
+                next_free[sig] = end
+                count = self.counts[sig] = self.counts.get(sig, 0) + 1
+                if count in self.signatures[sig]:
+                    ranges.append((i, ends[end]))
+        return ranges
+
+
+def _removal_edits(op, removed):
+    """
+    removed 为需要删除的 PdfString (id) 集合，返回源码替换列表 [(start, end, text)]。
+    TJ 中连续被删除的字符串 (含其间的字距调整) 替换为一个空字符串，其余源码保持原样。
+    """
+    operand = op.operand
+    if isinstance(operand, PdfString):
+        return [(operand.start, operand.end, operand.serialize(""))]
+
+    edits = []
+    run = None  # [first, last] 当前连续删除的字符串
+    for item in operand.items:
+        if isinstance(item, PdfString):
+            if id(item) in removed:
+                if run is None:
+                    run = [item, item]
+                else:
+                    run[1] = item
+                continue
+        elif run is not None and _is_number(item[0]):
+            continue
+        if run is not None:
+            edits.append((run[0].start, run[1].end, run[0].serialize("")))
+            run = None
+    if run is not None:
+        edits.append((run[0].start, run[1].end, run[0].serialize("")))
+    return edits
+
+
+def _is_number(raw):
+    try:
+        float(raw)
+        return True
+    except ValueError:
+        return False
+
+
+class StreamSummary:
+    """
+    内容流中可被删除的内容概要：文本显示操作的字符串值 (十六进制/字面量分别拼接) 与内联图片数量。
+    用于在不重新解析流的情况下判断删除计划是否可能命中该流 (只会误判为可能命中，不会漏判)
+    """
+
+    def __init__(self, hex_text, lit_text, inline_images):
+        self.hex_text = hex_text
+        self.lit_text = lit_text
+        self.inline_images = inline_images
+
+    def may_match(self, hex_targets=None, str_targets=None, inline_images=0):
+        if inline_images and self.inline_images:
+            return True
+        if any(bytes.fromhex(sig).decode("latin-1") in self.hex_text for sig in (hex_targets or {}) if sig):
+            return True
+        return any(sig in self.lit_text for sig in (str_targets or {}) if sig)
+
+
+def summarize(data):
+    """线性扫描内容流，返回 StreamSummary"""
+    hex_parts = []
+    lit_parts = []
+    inline_images = 0
+    for op in iter_ops(data):
+        if isinstance(op, InlineImage):
+            inline_images += 1
+            continue
+        for s in op.strings:
+            (hex_parts if s.kind == "hex" else lit_parts).append(s.value)
+    return StreamSummary("".join(hex_parts), "".join(lit_parts), inline_images)
+
+
+def remove_content(data, hex_targets=None, str_targets=None, inline_images=0):
+    """
+    单次线性扫描完成删除：
+    - hex_targets: {glyph 十六进制签名: set(rank)}，匹配 <...> 十六进制字符串
+    - str_targets: {文本签名: set(rank)}，匹配 (...) 字面量字符串
+    - inline_images: 删除流中前 N 个内联图片
+    返回 (new_data, modified)
+    """
+    hex_matcher = _SignatureMatcher({
+        bytes.fromhex(sig).decode("latin-1"): ranks for sig, ranks in (hex_targets or {}).items()
+    })
+    # 超出单字节范围的字符不可能出现在字面量字符串中
+    str_matcher = _SignatureMatcher({
+        sig: ranks for sig, ranks in (str_targets or {}).items() if all(ord(c) < 256 for c in sig)
+    })
+    if not hex_matcher.signatures and not str_matcher.signatures and not inline_images:
+        return data, False
+
+    edits = []
+    images_removed = 0
+    for op in iter_ops(data):
+        if isinstance(op, InlineImage):
+            if images_removed < inline_images:
+                edits.append((op.start, op.end, ""))
+                images_removed += 1
+            continue
+        strings = op.strings
+        if not strings:
+            continue
+        removed = set()
+        for kind, matcher in (("hex", hex_matcher), ("lit", str_matcher)):
+            if not matcher.signatures:
+                continue
+            parts = [s for s in strings if s.kind == kind]
+            for first, last in matcher.scan([s.value for s in parts]):
+                removed.update(id(s) for s in parts[first:last + 1])
+        if removed:
+            edits.extend(_removal_edits(op, removed))
+
+    if not edits:
+        return data, False
+    out = []
+    pos = 0
+    for start, end, text in edits:
+        out.append(data[pos:start])
+        out.append(text)
+        pos = end
+    out.append(data[pos:])
+    return "".join(out), True
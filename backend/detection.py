@@ -0,0 +1,166 @@
+"""
+整份文档的水印检测：逐页 (或分层抽样) 提取文本行、图片与矢量路径的指纹，
+连同归一化的位置与旋转角度聚类，跨页在同一位置反复出现的元素即为水印候选 (含页眉页脚等)。
+
+聚类计数使用 lossy counting：每处理 BUCKET_PAGES 页清理一次只出现在极少数页面上的条目，
+内存占用与页数无关，可以处理数千页的文档。
+"""
+import fitz
+from utils import sample_pages, text_runs, direction_angle, drawing_fingerprint, image_fingerprint
+
+# 默认最多检查的页数，超过时均匀抽样；0 表示检查所有页面
+DEFAULT_MAX_PAGES = 200
+# 候选至少出现的页数与覆盖率
+MIN_PAGES = 2
+MIN_COVERAGE = 0.2
+# 位置按页面尺寸归一化后的网格大小 (角度的量化步长见 utils.ANGLE_STEP)
+POSITION_GRID = 0.01
+# lossy counting 的桶大小：出现页面比例低于 1 / BUCKET_PAGES 的条目可能被清理
+BUCKET_PAGES = 25
+# 单页每类元素最多处理的数量 (防止极端页面拖慢检测)
+MAX_ITEMS_PER_PAGE = 2000
+MAX_SAMPLE_PAGES = 5
+
+# 提取文本时不需要图片数据
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+# 候选类别 -> remove_targets 中的分类名
+_CATEGORIES = {"text": "text", "image": "xobjects", "drawing": "drawings"}
+
+
+class _Item:
+    """页面上的一个元素：kind 为 text / image / drawing，signature 为与位置无关的指纹"""
+    __slots__ = ("kind", "signature", "content", "match", "bbox", "angle")
+
+    def __init__(self, kind, signature, content, match, bbox, angle):
+        self.kind = kind
+        self.signature = signature
+        self.content = content
+        self.match = match
+        self.bbox = bbox
+        self.angle = angle
+
+
+class _Cluster:
+    __slots__ = ("item", "count", "delta", "pages")
+
+    def __init__(self, item, delta):
+        self.item = item
+        self.count = 0
+        self.delta = delta
+        self.pages = []
+
+
+def _text_items(page):
+    count = 0
+    for text, size, angle, bbox in text_runs(page.get_text("dict", flags=TEXT_FLAGS).get("blocks", [])):
+        if not angle:
+            if len(text) < 2:
+                continue
+            count += 1
+            if count > MAX_ITEMS_PER_PAGE:
+                continue
+        yield _Item("text", ("text", text, size), text, {"content": text}, bbox, angle)
+
+
+def _image_items(doc, page, digests):
+    for info in page.get_image_info(xrefs=True)[:MAX_ITEMS_PER_PAGE]:
+        bbox = fitz.Rect(info.get("bbox"))
+        if bbox.is_empty:
+            continue
+        transform = info.get("transform") or (1, 0, 0, 1, 0, 0)
+        digest = image_fingerprint(doc, info, digests)
+        match = {"digest": digest}
+        if info.get("xref"):
+            match["xref"] = info["xref"]
+        yield _Item("image", ("image", digest), f"Image {info.get('xref', 0)}", match, bbox,
+                    direction_angle(transform[0], transform[1]))
+
+
+def _drawing_items(page):
+    for drawing in page.get_drawings()[:MAX_ITEMS_PER_PAGE]:
+        bbox = drawing.get("rect")
+        # 与 PageIndex.drawing_elements 一致，忽略面积过小的路径
+        if not bbox or bbox.width * bbox.height <= 1:
+            continue
+        path_hash = drawing_fingerprint(drawing)
+        yield _Item("drawing", ("drawing", path_hash), f"Drawing ({len(drawing.get('items', []))} items)",
+                    {"path_hash": path_hash}, bbox, 0)
+
+
+def page_items(doc, page, digests):
+    """页面上所有可聚类的元素"""
+    yield from _text_items(page)
+    yield from _image_items(doc, page, digests)
+    yield from _drawing_items(page)
+
+
+def detect_watermarks(doc, max_pages=DEFAULT_MAX_PAGES, min_coverage=MIN_COVERAGE, limit=50):
+    """
+    检测跨页重复出现的元素，返回：
+    page_count / pages_examined / sampled / candidates (按覆盖率降序)。
+    每个候选包含 kind、content、match (可直接作为按指纹删除的目标)、首次出现的 bbox 与页码、
+    rotation、pages (出现页数，抽样时为样本内的页数)、coverage 与 sample_pages
+    """
+    page_count = len(doc)
+    pages = sample_pages(page_count, max_pages) if max_pages else list(range(page_count))
+    clusters = {}
+    digests = {}
+    bucket = 0
+
+    for n, page_no in enumerate(pages, start=1):
+        page = doc[page_no]
+        rect = page.rect
+        width, height = rect.width or 1, rect.height or 1
+        seen = set()
+        for item in page_items(doc, page, digests):
+            cx = (item.bbox.x0 + item.bbox.x1) / 2 - rect.x0
+            cy = (item.bbox.y0 + item.bbox.y1) / 2 - rect.y0
+            key = (item.signature, round(cx / width / POSITION_GRID), round(cy / height / POSITION_GRID), item.angle)
+            # 同一页上重复的元素只计一次
+            if key in seen:
+                continue
+            seen.add(key)
+            cluster = clusters.get(key)
+            if cluster is None:
+                cluster = clusters[key] = _Cluster(item, bucket)
+                item.bbox = [round(v, 2) for v in item.bbox]
+            cluster.count += 1
+            if len(cluster.pages) < MAX_SAMPLE_PAGES:
+                cluster.pages.append(page_no)
+
+        if n % BUCKET_PAGES == 0:
+            # lossy counting：清理 count + delta 不超过当前桶号的条目
+            bucket += 1
+            for key in [k for k, c in clusters.items() if c.count + c.delta <= bucket]:
+                del clusters[key]
+
+    examined = len(pages)
+    candidates = []
+    for cluster in clusters.values():
+        coverage = cluster.count / examined if examined else 0.0
+        if cluster.count < MIN_PAGES or coverage < min_coverage:
+            continue
+        item = cluster.item
+        candidates.append({
+            "kind": item.kind,
+            "content": item.content,
+            "match": dict(item.match, category=_CATEGORIES[item.kind]),
+            "bbox": item.bbox,
+            "page": cluster.pages[0],
+            "rotation": item.angle,
+            "pages": cluster.count,
+            "coverage": round(coverage, 4),
+            "sample_pages": cluster.pages,
+        })
+    # 覆盖率相同时面积大的优先 (水印通常比页眉页脚大)
+    candidates.sort(key=lambda c: (-c["coverage"], -_area(c["bbox"])))
+    return {
+        "page_count": page_count,
+        "pages_examined": examined,
+        "sampled": examined < page_count,
+        "candidates": candidates[:limit],
+    }
+
+
+def _area(bbox):
+    return max(0, bbox[2] - bbox[0]) * max(0, bbox[3] - bbox[1])
@@ -0,0 +1,207 @@
+"""
+上传文档仓库与通用的 LRU 缓存。
+仓库保存的是原始 PDF 文件 (以内容 SHA-256 命名，存放在磁盘目录中)，而不是已解析的 fitz.Document：
+预览与重构会修改打开的文档，且 PyMuPDF 文档对象不能跨线程/进程共享，
+因此每个请求从仓库取出一份私有文件 (硬链接) 后自行 fitz.open。
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# 默认缓存预算：2GB 磁盘空间，30 分钟未访问即过期
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_TTL = 30 * 60
+
+
+class LRUCache:
+    """带内存预算和 TTL 过期的线程安全 LRU 缓存"""
+
+    def __init__(self, max_bytes, ttl=None, on_evict=None, lock=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._entries = OrderedDict()  # key -> [value, size, last_access]
+        self._total_bytes = 0
+        # 允许与外部对象共用一把锁，避免淘汰回调中出现锁顺序反转
+        self._lock = lock or threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            entry[2] = time.monotonic()
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # 单个条目超过预算时不缓存
+            if size > self.max_bytes:
+                return False
+            self._entries[key] = [value, size, time.monotonic()]
+            self._total_bytes += size
+            self._expire(time.monotonic())
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+            return key in self._entries
+
+    def pop(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            return self._remove(key)
+
+    def pop_where(self, predicate):
+        """移除所有 key 满足 predicate 的条目，返回移除数量"""
+        with self._lock:
+            keys = [k for k in self._entries if predicate(k)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(time.monotonic())
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _remove(self, key):
+        value, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        if self._on_evict:
+            try:
+                self._on_evict(key, value)
+            except Exception as e:
+                print(f"Cache evict callback failed for {key}: {e}")
+        return value
+
+    def _expire(self, now):
+        if not self.ttl:
+            return
+        # OrderedDict 按访问时间排序，从最旧的开始检查即可
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[2] <= self.ttl:
+                break
+            self._remove(key)
+
+
+class DocumentStore:
+    """
+    上传一次、多次引用的文档仓库。
+    文档以内容 SHA-256 作为 ID，文件保存在磁盘目录中 (不占用 Python 堆内存)，
+    相同文件重复上传不会占用额外空间；
+    同一文档可以属于多个会话，只有当所有会话都失效后才会被移除。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, on_evict=None, directory=None):
+        self._on_evict = on_evict
+        self._directory = directory
+        self._lock = threading.RLock()
+        self._cache = LRUCache(max_bytes, ttl, on_evict=self._forget, lock=self._lock)
+        self._sessions = {}  # session_id -> set(doc_id)
+
+    def _get_directory(self):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="hajihan-docs-")
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def put_file(self, path, doc_id, session_id=None):
+        """
+        将已落盘的文件移入仓库 (调用方需已计算其 SHA-256 作为 doc_id)。
+        文件被移走或因重复而删除，调用方之后不应再使用 path
+        """
+        size = os.path.getsize(path)
+        with self._lock:
+            # 已存在时 get 会刷新其 LRU 位置
+            if self._cache.get(doc_id) is None:
+                if size > self._cache.max_bytes:
+                    raise ValueError("Document exceeds document cache capacity")
+                stored = os.path.join(self._get_directory(), doc_id + ".pdf")
+                shutil.move(path, stored)
+                self._cache.put(doc_id, stored, size)
+            else:
+                os.remove(path)
+            if session_id:
+                self._sessions.setdefault(session_id, set()).add(doc_id)
+        return doc_id
+
+    def get(self, doc_id):
+        """返回文档在仓库中的文件路径。文件可能随时被淘汰，长时间使用前应先 checkout"""
+        return self._cache.get(doc_id)
+
+    def checkout(self, doc_id, dest):
+        """
+        为一次请求取出文档：在 dest 处创建指向仓库文件的硬链接 (失败时复制)，
+        之后即使文档被淘汰，请求仍可继续读取。文档不存在时返回 False
+        """
+        with self._lock:
+            stored = self._cache.get(doc_id)
+            if stored is None:
+                return False
+            try:
+                os.link(stored, dest)
+            except OSError:
+                shutil.copyfile(stored, dest)
+        return True
+
+    def invalidate(self, doc_id):
+        """立即移除某个文档 (不论属于哪个会话)"""
+        return self._cache.pop(doc_id) is not None
+
+    def invalidate_session(self, session_id):
+        """结束会话：移除仅被该会话引用的文档，返回移除数量"""
+        with self._lock:
+            doc_ids = self._sessions.pop(session_id, set())
+            still_used = set()
+            for ids in self._sessions.values():
+                still_used |= ids
+            removed = 0
+            for doc_id in doc_ids - still_used:
+                if self.invalidate(doc_id):
+                    removed += 1
+            return removed
+
+    def stats(self):
+        return {
+            "documents": len(self._cache),
+            "total_bytes": self._cache.total_bytes,
+            "max_bytes": self._cache.max_bytes,
+            "sessions": len(self._sessions),
+        }
+
+    def _forget(self, doc_id, path):
+        # 文档被淘汰或过期后，删除文件并同步清理会话中的引用及派生缓存
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Failed to remove stored document {path}: {e}")
+        if self._on_evict:
+            self._on_evict(doc_id, path)
+        with self._lock:
+            for session_id in list(self._sessions):
+                ids = self._sessions[session_id]
+                ids.discard(doc_id)
+                if not ids:
+                    del self._sessions[session_id]
@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ExecutorBusy(Exception):
+    """队列已满，调用方应返回 503 让客户端稍后重试"""
+    def __init__(self, lane):
+        super().__init__(f"Server busy: too many pending {lane} tasks")
+        self.lane = lane
+
+
+class Lane:
+    """
+    一条执行通道：在线程池/进程池中运行同步的 PyMuPDF 任务，避免阻塞事件循环。
+    max_workers 为同时执行的任务数，max_pending 为执行中 + 排队中的任务上限，超出时直接拒绝。
+    """
+
+    def __init__(self, name, max_workers, max_pending, processes=False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.processes = processes
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        # 惰性创建，spawn 子进程只在第一次使用时启动
+        if self._executor is None:
+            if self.processes:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务并立即返回 concurrent.futures.Future；队列已满时抛出 ExecutorBusy"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExecutorBusy(self.name)
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            future = executor.submit(_call, fn, args, kwargs) if kwargs else executor.submit(fn, *args)
+        except Exception:
+            self._release(executor)
+            raise
+        future.add_done_callback(lambda f: self._release(executor, f))
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self, executor, future=None):
+        with self._lock:
+            self._pending -= 1
+            # 子进程异常退出 (如内存不足被杀) 后进程池不可再用，丢弃以便下次提交时重建
+            if (future is not None and not future.cancelled()
+                    and isinstance(future.exception(), BrokenProcessPool) and self._executor is executor):
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {"max_workers": self.max_workers, "max_pending": self.max_pending, "pending": self._pending}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _call(fn, args, kwargs):
+    return fn(*args, **kwargs)
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+# 交互通道：预览、分析、文档信息等短任务。
+# PyMuPDF 不支持多线程并发，默认单线程执行；预览底图缓存在本进程内，因此使用线程而非进程
+interactive = Lane(
+    "interactive",
+    max_workers=_env_int("INTERACTIVE_WORKERS", 1),
+    max_pending=_env_int("INTERACTIVE_MAX_PENDING", 32),
+)
+
+# 批量通道：整份文档重构等长任务，在独立进程中运行，不与交互通道争用解释器和 MuPDF
+bulk = Lane(
+    "bulk",
+    max_workers=_env_int("BULK_WORKERS", 2),
+    max_pending=_env_int("BULK_MAX_PENDING", 8),
+    processes=True,
+)
@@ -0,0 +1,93 @@
+"""
+文本水印字体的进程级注册表。
+字体文件 (尤其是数 MB 的 CJK .ttc) 每个进程只读取和解析一次：
+缓存 fitz.Font 用于计算文本宽度，缓存文件内容用于嵌入文档 (insert_font 按内容去重，同一文档只嵌入一份)。
+"""
+import os
+import threading
+import fitz
+
+# 前端字体名 -> 字体文件路径 (以 / 开头) 或 MuPDF 内置字体名
+FONT_MAP = {
+    "song": "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "kai": "/usr/share/fonts/truetype/arphic/ukai.ttc",
+    "xingkai": "/usr/share/fonts/truetype/arphic/ukai.ttc", # 暂用楷体代替行楷
+    "yahei": "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "times-roman": "tiro",
+}
+FALLBACK_FONT = "helv"
+
+
+class ResolvedFont:
+    """
+    name:   绘制时使用的字体名 (内置字体名，或嵌入字体在 PDF 中的资源名)
+    font:   用于 text_length 计算的 fitz.Font
+    buffer: 需要嵌入的字体文件内容，内置字体为 None
+    """
+
+    def __init__(self, name, font, buffer=None):
+        self.name = name
+        self.font = font
+        self.buffer = buffer
+
+    def register(self, page):
+        """在页面上注册字体 (内置字体无需注册)"""
+        if self.buffer is not None:
+            page.insert_font(fontname=self.name, fontbuffer=self.buffer)
+
+
+_resolved = {}
+_files = {}
+_lock = threading.Lock()
+
+
+def _load_file(path):
+    """读取字体文件，同一路径 (如 kai 与 xingkai) 只读取一次"""
+    entry = _files.get(path)
+    if entry is None:
+        with open(path, "rb") as f:
+            buffer = f.read()
+        entry = (buffer, fitz.Font(fontbuffer=buffer))
+        _files[path] = entry
+    return entry
+
+
+def _load(fontname):
+    target = FONT_MAP.get(fontname, fontname)
+    if target.startswith("/"):
+        # 自定义字体：使用 fontname 作为 PDF 内部的资源名，必须确保整个文档一致
+        buffer, font = _load_file(target)
+        return ResolvedFont(fontname, font, buffer)
+    # 内置字体 (如果不是 helv 等标准名，可能会失败)
+    return ResolvedFont(target, fitz.Font(target))
+
+
+def resolve(fontname):
+    """取得字体 (加载失败时回退到 Helvetica，每个字体名只提示一次)"""
+    fontname = fontname or FALLBACK_FONT
+    resolved = _resolved.get(fontname)
+    if resolved is not None:
+        return resolved
+    with _lock:
+        resolved = _resolved.get(fontname)
+        if resolved is None:
+            try:
+                resolved = _load(fontname)
+            except Exception as e:
+                print(f"Font loading failed for {fontname}: {e}, falling back to {FALLBACK_FONT}")
+                resolved = ResolvedFont(FALLBACK_FONT, fitz.Font(FALLBACK_FONT))
+            _resolved[fontname] = resolved
+    return resolved
+
+
+def check_fonts():
+    """检查字体映射表中的字体文件是否存在 (启动时调用)，返回 {字体名: 是否可用}"""
+    status = {}
+    for name, target in FONT_MAP.items():
+        if target.startswith("/"):
+            status[name] = os.path.isfile(target)
+            if not status[name]:
+                print(f"Warning: font file for '{name}' not found: {target}, text will fall back to {FALLBACK_FONT}")
+        else:
+            status[name] = True
+    return status
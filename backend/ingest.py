@@ -0,0 +1,125 @@
+"""
+上传文件的落盘与取用。
+上传内容按块写入临时文件并同时计算 SHA-256，不在 Python 堆上保留整份文件；
+之后各任务按路径打开文档，由 MuPDF 按需从磁盘读取。
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class PdfSource:
+    """一次请求使用的 PDF 文件。文件归该请求所有，用完后调用 release() 删除"""
+
+    def __init__(self, path, doc_id, size):
+        self.path = path
+        self.doc_id = doc_id  # 内容 SHA-256
+        self.size = size
+
+    def release(self):
+        if not self.path:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to remove spooled file {self.path}: {e}")
+        self.path = None
+
+    def detach(self):
+        """文件已移交他处 (如文档仓库)，release() 不再删除"""
+        path, self.path = self.path, None
+        return path
+
+
+def _temp_path():
+    fd, path = tempfile.mkstemp(prefix="hajihan-upload-", suffix=".pdf")
+    os.close(fd)
+    return path
+
+
+async def spool_upload(file):
+    """将 UploadFile 分块写入临时文件，返回 PdfSource"""
+    path = _temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        await file.seek(0)
+        with open(path, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return PdfSource(path, digest.hexdigest(), size)
+
+
+def checkout(doc_store, doc_id):
+    """从文档仓库取出一份请求私有的文件 (硬链接)，文档不存在或已过期时返回 None"""
+    path = _temp_path()
+    # mkstemp 创建的空文件需先删除，硬链接不能覆盖已有文件
+    os.remove(path)
+    try:
+        found = doc_store.checkout(doc_id, path)
+    except FileNotFoundError:
+        found = False
+    if not found:
+        return None
+    return PdfSource(path, doc_id, os.path.getsize(path))
+
+
+def extract_zip(path, max_files, max_bytes):
+    """
+    将 ZIP 中的 PDF 逐个解压为临时文件 (同时计算 SHA-256)，返回 [(文件名, PdfSource)]。
+    只读取 .pdf 结尾的条目；超过 max_files 个或解压后总大小超过 max_bytes 时抛出 ValueError。
+    条目头中声明的大小可能是伪造的，解压过程中按实际写入的字节数再检查一次
+    """
+    sources = []
+    try:
+        with zipfile.ZipFile(path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(".pdf")
+                and not os.path.basename(info.filename).startswith(".")
+            ]
+            if len(members) > max_files:
+                raise ValueError(f"Too many files in archive: {len(members)} > {max_files}")
+            declared = sum(info.file_size for info in members)
+            if declared > max_bytes:
+                raise ValueError(f"Archive too large when extracted: {declared} > {max_bytes} bytes")
+            total = 0
+            for info in members:
+                out_path = _temp_path()
+                digest = hashlib.sha256()
+                size = 0
+                try:
+                    with archive.open(info) as src, open(out_path, "wb") as out:
+                        while True:
+                            chunk = src.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            size += len(chunk)
+                            if total + size > max_bytes:
+                                raise ValueError(f"Archive too large when extracted: > {max_bytes} bytes")
+                            digest.update(chunk)
+                            out.write(chunk)
+                except BaseException:
+                    os.remove(out_path)
+                    raise
+                total += size
+                sources.append((info.filename, PdfSource(out_path, digest.hexdigest(), size)))
+    except BaseException:
+        for _, source in sources:
+            source.release()
+        raise
+    return sources
@@ -0,0 +1,277 @@
+"""
+进程内的异步任务管理：提交重构任务后立即返回 job_id，
+客户端通过状态接口或 SSE 获取进度，完成后下载结果文件。
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+# 结束 (完成/失败/取消) 的任务保留 30 分钟后连同结果文件一起清理
+DEFAULT_TTL = 30 * 60
+# 后台线程从共享字典刷新进度的间隔 (秒)
+POLL_INTERVAL = 0.25
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = {DONE, FAILED, CANCELLED}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ProgressReporter:
+    """
+    传给子进程的进度回调，通过 Manager 共享字典与主进程交换进度和取消标记。
+    可以 pickle，作为 reconstruct 的 progress 参数使用
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+
+    def __call__(self, done, total):
+        # done 为 0 表示任务开始
+        if self.shared.get("cancelled"):
+            raise JobCancelled()
+        self.shared.update(done=done, total=total)
+
+
+class Job:
+    def __init__(self, job_id, kind, result_path, shared):
+        self.id = job_id
+        self.kind = kind
+        self.status = QUEUED
+        self.error = None
+        self.result_path = result_path
+        self.shared = shared
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # 最近一次从共享字典读取的进度，状态查询只读取这里，不做进程间通信
+        self.done = 0
+        self.total = 0
+
+    def progress(self):
+        return self.done, self.total
+
+    def refresh(self):
+        """从共享字典读取子进程报告的进度 (经 Manager 进程间通信，不应在事件循环中调用)"""
+        try:
+            snapshot = self.shared.copy()
+        except Exception:
+            # Manager 已关闭
+            return
+        self.done, self.total = snapshot.get("done", 0), snapshot.get("total", 0)
+
+    def to_dict(self):
+        done, total = self.progress()
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "done": done,
+            "total": total,
+            "progress": round(done / total, 4) if total else (1.0 if self.status == DONE else 0.0),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    在执行通道中运行任务并跟踪其状态。
+    任务函数需接受 output_path 与 progress 两个关键字参数，将结果写入 output_path。
+    """
+
+    def __init__(self, lane, ttl=DEFAULT_TTL, result_dir=None):
+        self.lane = lane
+        self.ttl = ttl
+        self._result_dir = result_dir
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._manager = None
+        self._poller = None
+        self._stop = None
+
+    def start(self):
+        """启动 Manager 进程与进度轮询线程。启动 Manager 需要等待子进程就绪，应在事件循环之外调用"""
+        with self._lock:
+            self._get_manager()
+
+    def _get_manager(self):
+        # 调用方需持有 self._lock
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+            self._stop = threading.Event()
+            self._poller = threading.Thread(target=self._poll, args=(self._stop,), name="job-progress", daemon=True)
+            self._poller.start()
+        return self._manager
+
+    def _poll(self, stop):
+        """定期刷新未结束任务的进度；进程池会预先把任务放入调用队列，以子进程首次报告进度作为开始运行"""
+        while not stop.wait(POLL_INTERVAL):
+            with self._lock:
+                active = [job for job in self._jobs.values() if job.status not in FINISHED_STATES]
+            for job in active:
+                job.refresh()
+                with self._lock:
+                    if job.status == QUEUED and job.total:
+                        job.status = RUNNING
+
+    def _get_result_dir(self):
+        if self._result_dir is None:
+            self._result_dir = tempfile.mkdtemp(prefix="hajihan-jobs-")
+        os.makedirs(self._result_dir, exist_ok=True)
+        return self._result_dir
+
+    def submit(self, kind, fn, *args, suffix=".pdf", **kwargs):
+        """提交任务，队列已满时抛出 ExecutorBusy。首次提交会启动 Manager 进程，应在事件循环之外调用"""
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            shared = self._get_manager().dict(done=0, total=0, cancelled=False)
+        job = Job(job_id, kind, os.path.join(self._get_result_dir(), job_id + suffix), shared)
+
+        future = self.lane.submit(
+            fn, *args, output_path=job.result_path, progress=ProgressReporter(shared), **kwargs
+        )
+        job.future = future
+        with self._lock:
+            self._jobs[job_id] = job
+        # 注意：回调在执行通道的内部线程中调用
+        future.add_done_callback(lambda f: self._on_done(job, f))
+        return job
+
+    def _on_done(self, job, future):
+        job.refresh()
+        if future.cancelled():
+            status, error = CANCELLED, None
+        else:
+            error = future.exception()
+            if error is None:
+                status = DONE
+            elif isinstance(error, JobCancelled):
+                status, error = CANCELLED, None
+            else:
+                status = FAILED
+                print(f"Job {job.id} failed: {error}")
+        # 与轮询线程的状态更新互斥，避免已结束的任务被改回 running
+        with self._lock:
+            job.finished_at = time.time()
+            job.status = status
+            job.error = str(error) if error is not None else None
+        if job.status != DONE:
+            self._remove_file(job.result_path)
+
+    def get(self, job_id):
+        self.cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def checkout_result(self, job_id, dest):
+        """
+        在 dest 处创建已完成任务结果文件的硬链接 (失败时复制)，任务不存在或未完成时返回 False。
+        下载从链接读取，之后任务过期被清理也不影响正在进行的下载
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != DONE:
+                return False
+            try:
+                os.link(job.result_path, dest)
+            except OSError:
+                shutil.copyfile(job.result_path, dest)
+            return True
+
+    def cancel(self, job_id):
+        """
+        取消任务：排队中的直接取消，运行中的在下一页处理完后中止；已结束的任务则删除其结果。
+        设置取消标记需要与 Manager 通信，应在事件循环之外调用
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status in FINISHED_STATES:
+            self._discard(job)
+            return job
+        if not job.future.cancel():
+            job.shared["cancelled"] = True
+        return job
+
+    async def events(self, job_id, interval=0.5):
+        """SSE 事件流：状态或进度变化时推送，任务结束后关闭"""
+        last = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Job not found\"}\n\n"
+                return
+            data = job.to_dict()
+            if data != last:
+                last = data
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+            if job.status in FINISHED_STATES:
+                return
+            await asyncio.sleep(interval)
+
+    def cleanup(self):
+        """清理超过 TTL 的已结束任务及其结果文件"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.status in FINISHED_STATES and job.finished_at and now - job.finished_at > self.ttl
+            ]
+        for job in expired:
+            self._discard(job)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status not in FINISHED_STATES:
+                self.cancel(job.id)
+        with self._lock:
+            manager, self._manager = self._manager, None
+            stop, poller, self._stop, self._poller = self._stop, self._poller, None, None
+        if stop is not None:
+            stop.set()
+            poller.join()
+        if manager is not None:
+            manager.shutdown()
+        if self._result_dir:
+            shutil.rmtree(self._result_dir, ignore_errors=True)
+
+    def _discard(self, job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        self._remove_file(job.result_path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to remove job artifact {path}: {e}")
+
@@ -1,367 +1,748 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import io
+import os
 import json
-import base64
-from utils import PDFEngine, hex_to_rgb
-import fitz
-from PIL import Image
+import asyncio
+import hashlib
+import tempfile
+import time
+import zipfile
+from contextlib import asynccontextmanager
+from doc_store import DocumentStore, LRUCache
+from preview import PreviewCache, DEFAULT_TILE_SIZE, DEFAULT_QUALITY, PREVIEW_FORMATS
+from executor import interactive, bulk, ExecutorBusy
+from tasks import APIError
+from ingest import spool_upload, checkout, extract_zip
+from pdf_info import pdf_info, MODES as INFO_MODES, DEFAULT_SAMPLE_SIZE
+from result_cache import ResultCache
+from scan_detect import DEFAULT_MAX_PAGES as SCAN_MAX_PAGES
+from detection import DEFAULT_MAX_PAGES as DETECT_MAX_PAGES
+from jobs import JobManager, DONE
+from fonts import check_fonts
+from modifiers import loads, asset_refs, load_image
+import tasks
 
-app = FastAPI(title="Hajihan PDF API")
+# 水印字体文件的可用情况 (启动时检查)
+font_status = {}
+
+@asynccontextmanager
+async def lifespan(app):
+    # 启动时检查一次字体映射表，缺失的字体在日志中提示，而不是在每个元素绘制时才失败
+    font_status.update(check_fonts())
+    # 任务进度通过 Manager 子进程共享，启动时预先创建，避免首次提交任务时在请求中等待
+    await asyncio.to_thread(job_manager.start)
+    yield
+    # 关闭时取消未完成的任务并停止执行通道，不把进程池留给解释器退出钩子处理
+    job_manager.shutdown()
+    interactive.shutdown()
+    bulk.shutdown()
+
+app = FastAPI(title="Hajihan PDF API", lifespan=lifespan)
+
+# 单个重构任务使用的工作进程数，设为 1 即关闭并行重构；默认由批量通道的各任务平分 CPU
+RECONSTRUCT_WORKERS = int(os.environ.get("RECONSTRUCT_WORKERS", max(1, (os.cpu_count() or 1) // bulk.max_workers)))
+
+# 批量重构一次最多处理的文件数
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 500))
+# 批量重构一次最多处理的文件总大小 (ZIP 按解压后计算)
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+# 批量通道被占满时单个文件等待空位的最长时间 (秒)，超时记为失败
+BATCH_BUSY_TIMEOUT = float(os.environ.get("BATCH_BUSY_TIMEOUT", 300))
+
+# 预览底图缓存 (已执行去除操作的页面)
+preview_cache = PreviewCache()
+# 已上传文档的缓存仓库 (按内容哈希去重)，文档失效时同步清理其预览底图
+doc_store = DocumentStore(on_evict=preview_cache.invalidate_document)
+# 异步重构任务，在批量通道中执行
+job_manager = JobManager(bulk)
+# 按输入内容与参数缓存的处理结果 (磁盘持久化)
+result_cache = ResultCache(
+    directory=os.environ.get("RESULT_CACHE_DIR"),
+    max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+)
+
+# 通过 /api/assets 上传的二进制素材 (水印图片等)，按内容 SHA-256 引用
+asset_store = LRUCache(
+    max_bytes=int(os.environ.get("ASSET_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+    ttl=int(os.environ.get("ASSET_STORE_TTL", 60 * 60))
+)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # 分块预览通过响应头返回页面与瓦片信息
+    expose_headers=["X-Page-Width", "X-Page-Height", "X-Zoom", "X-Clip", "X-Tile-Size", "X-Tile-Cols", "X-Tile-Rows"],
 )
 
-@app.post("/api/pdf-info")
-async def get_pdf_info(file: UploadFile = File(...)):
-    """获取 PDF 元数据和页面信息"""
+async def run_in_lane(lane, fn, *args, **kwargs):
+    """在执行通道中运行同步任务，队列已满时返回 503"""
+    try:
+        return await lane.run(fn, *args, **kwargs)
+    except ExecutorBusy as e:
+        raise APIError(503, str(e))
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def parse_json_fields(remove_targets_json, page_modifiers_json):
+    try:
+        return loads(remove_targets_json), loads(page_modifiers_json)
+    except ValueError as je:
+        print(f"JSON parse error: {je}")
+        raise APIError(400, f"Invalid JSON: {je}")
+
+def parse_numbers(value, count, name):
+    """解析逗号分隔的数字参数 (如 clip=x0,y0,x1,y1)"""
     try:
-        await file.seek(0)
-        content = await file.read()
-        doc = fitz.open(stream=content, filetype="pdf")
+        numbers = [float(v) for v in value.split(",")]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise APIError(400, f"Invalid {name}: expected {count} comma-separated numbers")
+    return numbers
+
+# format 参数与 Accept 中可用的别名
+FORMAT_ALIASES = {"png": "png", "jpeg": "jpeg", "jpg": "jpeg", "webp": "webp"}
+
+def negotiate_format(fmt, accept):
+    """
+    预览图片格式：优先使用 format 参数，否则按 Accept 头中 q 值最高的受支持类型；
+    未指定或只接受通配类型 (*/*、image/*) 时为 PNG
+    """
+    if fmt:
+        if fmt.lower() not in FORMAT_ALIASES:
+            raise APIError(400, f"Unsupported format: {fmt}")
+        return FORMAT_ALIASES[fmt.lower()]
+    candidates = []
+    for order, item in enumerate((accept or "").split(",")):
+        media, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        subtype = media.strip().lower().partition("image/")[2]
+        if subtype in FORMAT_ALIASES and q > 0:
+            candidates.append((-q, order, FORMAT_ALIASES[subtype]))
+    return min(candidates)[2] if candidates else "png"
+
+async def resolve_assets(page_modifiers_raw, parts):
+    """
+    取得 page_modifiers 引用的二进制素材：先找本次请求的 assets 文件部分 (按文件名)，再找素材仓库 (按 asset_id)。
+    返回 ({引用: 字节}, {引用: 内容 SHA-256})，后者用于结果缓存键
+    """
+    refs = asset_refs(page_modifiers_raw)
+    if not refs:
+        return None, {}
+    uploaded = {}
+    for part in parts or []:
+        if part.filename in refs:
+            uploaded[part.filename] = await part.read()
+    assets, hashes = {}, {}
+    for ref in refs:
+        if ref in uploaded:
+            data = uploaded[ref]
+            hashes[ref] = hashlib.sha256(data).hexdigest()
+        else:
+            data = asset_store.get(ref)
+            if data is None:
+                raise APIError(404, f"Asset not found or expired: {ref}")
+            hashes[ref] = ref
+        assets[ref] = data
+    return assets, hashes
+
+def reconstruct_key(doc_id, remove_targets, page_modifiers_raw, watermark_img_data, asset_hashes):
+    """重构结果的缓存键；须在 prepare_page_modifiers 修改原始参数之前计算"""
+    watermark_hash = hashlib.sha256(watermark_img_data).hexdigest() if watermark_img_data else None
+    parts = [doc_id, remove_targets, page_modifiers_raw, watermark_hash]
+    # 未引用素材时与之前的键保持一致，已有缓存仍可命中
+    if asset_hashes:
+        parts.append(asset_hashes)
+    return result_cache.key("reconstruct", *parts)
+
+async def open_pdf_source(file, doc_id):
+    """
+    取得本次请求使用的 PDF 文件 (PdfSource)：优先使用已上传文档的 doc_id，否则将本次上传的文件落盘。
+    用完后需调用 release()
+    """
+    if doc_id:
+        source = checkout(doc_store, doc_id)
+        if source is None:
+            raise APIError(404, f"Document not found or expired: {doc_id}")
+        return source
+    if file is None:
+        raise APIError(400, "Either file or doc_id is required")
+    return await spool_upload(file)
+
+@app.post("/api/documents")
+async def upload_document(file: UploadFile = File(...), session_id: str = Form(None)):
+    """上传一次 PDF，返回内容哈希作为文档 ID，后续接口通过 doc_id 引用，无需重复上传"""
+    source = None
+    try:
+        source = await spool_upload(file)
+        # 上传时校验一次，确保缓存中的都是可解析的 PDF
+        page_count = await run_in_lane(interactive, tasks.validate_pdf, source.path)
         try:
-            # 统计信息
-            total_images = 0
-            total_annots = 0
-            total_links = 0
-            fonts = set()
-            has_text = False
-            
-            for page in doc:
-                total_images += len(page.get_images())
-                total_annots += len(list(page.annots()))
-                total_links += len(list(page.get_links()))
-                if not has_text and page.get_text().strip():
-                    has_text = True
-                for f in page.get_fonts():
-                    fonts.add(f[3]) # font name
-
-            # 权限解析
-            perm_flags = doc.permissions
-            permissions = {
-                "print": bool(perm_flags & fitz.PDF_PERM_PRINT),
-                "modify": bool(perm_flags & fitz.PDF_PERM_MODIFY),
-                "copy": bool(perm_flags & fitz.PDF_PERM_COPY),
-                "annotate": bool(perm_flags & fitz.PDF_PERM_ANNOTATE),
-                "form": bool(perm_flags & fitz.PDF_PERM_FORM),
-            }
-
-            # 签名检测：遍历页面寻找签名表单域
-            has_signatures = False
-            for page in doc:
-                for field in page.widgets():
-                    if field.field_type == fitz.PDF_WIDGET_TYPE_SIGNATURE:
-                        has_signatures = True
-                        break
-                if has_signatures: break
-
-            info = {
-                "page_count": len(doc),
-                "metadata": {
-                    "title": doc.metadata.get("title") or "",
-                    "author": doc.metadata.get("author") or "",
-                    "subject": doc.metadata.get("subject") or "",
-                    "keywords": doc.metadata.get("keywords") or "",
-                    "creator": doc.metadata.get("creator") or "",
-                    "producer": doc.metadata.get("producer") or "",
-                    "creationDate": doc.metadata.get("creationDate") or "",
-                    "modDate": doc.metadata.get("modDate") or "",
-                },
-                "file_size": len(content),
-                "version": doc.pdf_get_metadata().get("encryption") if doc.is_encrypted else "Standard",
-                "is_encrypted": doc.is_encrypted,
-                "permissions": permissions,
-                "total_images": total_images,
-                "total_fonts": len(fonts),
-                "total_annots": total_annots,
-                "total_links": total_links,
-                "has_ocg": doc.get_ocgs() is not None and len(doc.get_ocgs()) > 0,
-                "has_forms": doc.is_form_pdf,
-                "has_signatures": has_signatures,
-                "is_scanned": not has_text and total_images > 0,
-                "pages": []
-            }
-            for i in range(len(doc)):
-                page = doc[i]
-                info["pages"].append({
-                    "index": i,
-                    "width": page.rect.width,
-                    "height": page.rect.height
-                })
-            return info
-        finally:
-            doc.close()
+            doc_id = doc_store.put_file(source.path, source.doc_id, session_id=session_id)
+        except ValueError as e:
+            raise APIError(413, str(e))
+        source.detach()
+        return {"doc_id": doc_id, "page_count": page_count, "file_size": source.size}
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
     except Exception as e:
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
+
+@app.delete("/api/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """主动使某个文档缓存失效"""
+    return {"removed": doc_store.invalidate(doc_id)}
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """结束会话，释放仅被该会话引用的文档"""
+    return {"removed": doc_store.invalidate_session(session_id)}
+
+@app.get("/api/status")
+async def get_status():
+    """执行通道与文档缓存的负载情况"""
+    return {
+        "interactive": interactive.stats(),
+        "bulk": bulk.stats(),
+        "documents": doc_store.stats(),
+        "jobs": job_manager.stats(),
+        "results": result_cache.stats(),
+        "assets": {"entries": len(asset_store), "total_bytes": asset_store.total_bytes, "max_bytes": asset_store.max_bytes},
+        "fonts": font_status,
+    }
+
+@app.post("/api/assets")
+async def upload_asset(file: UploadFile = File(...)):
+    """
+    上传一次二进制素材 (水印图片)，返回 asset_id。
+    page_modifiers 中的图片元素用 {"asset": asset_id} 引用，无需在 JSON 中携带 base64 数据
+    """
+    try:
+        data = await file.read()
+        try:
+            image = await asyncio.to_thread(load_image, data)
+        except Exception as e:
+            raise APIError(400, f"Invalid image: {e}")
+        asset_id = hashlib.sha256(data).hexdigest()
+        if not asset_store.put(asset_id, data, len(data)):
+            raise APIError(413, f"Asset too large: {len(data)} bytes")
+        return {"asset_id": asset_id, "size": len(data), "width": image.width, "height": image.height}
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/api/pdf-info")
+async def get_pdf_info(
+    file: UploadFile = File(None),
+    doc_id: str = Form(None),
+    mode: str = "full",
+    sample_size: int = DEFAULT_SAMPLE_SIZE
+):
+    """
+    获取 PDF 元数据和页面信息。
+    mode: fast (仅文档级信息，不解析页面内容) / full (逐页统计) / sampled (抽样 sample_size 页统计并外推)
+    """
+    source = None
+    try:
+        if mode not in INFO_MODES:
+            raise APIError(400, f"Invalid mode: {mode}, expected one of {', '.join(INFO_MODES)}")
+        source = await open_pdf_source(file, doc_id)
+        key = result_cache.key("pdf-info", source.doc_id, mode, sample_size)
+        info = await asyncio.to_thread(result_cache.get_json, key)
+        if info is None:
+            info = await run_in_lane(interactive, pdf_info, source.path, mode, sample_size)
+            await asyncio.to_thread(result_cache.put_json, key, info)
+        return info
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
+
+@app.post("/api/scan-detect")
+async def detect_scanned(file: UploadFile = File(None), doc_id: str = Form(None), max_pages: int = SCAN_MAX_PAGES):
+    """识别扫描件：抽样最多 max_pages 页，返回逐页分类与置信度"""
+    source = None
+    try:
+        source = await open_pdf_source(file, doc_id)
+        key = result_cache.key("scan-detect", source.doc_id, max_pages)
+        result = await asyncio.to_thread(result_cache.get_json, key)
+        if result is None:
+            result = await run_in_lane(interactive, tasks.detect_scanned, source.path, max_pages)
+            await asyncio.to_thread(result_cache.put_json, key, result)
+        return result
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
 
 @app.post("/api/analyze")
-async def analyze_page(file: UploadFile = File(...), page_index: int = 0, analyze_all: bool = False):
+async def analyze_page(file: UploadFile = File(None), doc_id: str = Form(None), page_index: int = 0, analyze_all: bool = False):
     """分析页面内容。如果 analyze_all 为 True，则分析所有页面并寻找共同模式"""
+    source = None
     try:
-        await file.seek(0)
-        content = await file.read()
-        engine = PDFEngine(content)
-        try:
-            if page_index < 0 or page_index >= len(engine.src_doc):
-                return JSONResponse(status_code=400, content={"error": f"Invalid page index: {page_index}"})
-            
-            suggested_watermarks = []
-            if analyze_all:
-                # 分析前 10 页寻找重复出现的文本 (疑似水印)
-                common_texts = {}
-                max_pages = min(len(engine.src_doc), 10)
-                for i in range(max_pages):
-                    p = engine.src_doc[i]
-                    p_texts = set()
-                    for block in p.get_text("blocks"):
-                        if block[6] == 0:
-                            text = block[4].strip()
-                            if len(text) > 1: p_texts.add(text)
-                    for t in p_texts:
-                        common_texts[t] = common_texts.get(t, 0) + 1
-                suggested_watermarks = [t for t, count in common_texts.items() if count > 1]
-
-            # 提取当前页的所有交互式元素 (用于点击去除)
-            src_page = engine.src_doc[page_index]
-            page_data = engine.extract_page_data(src_page, page_index=page_index)
-            interactive_elements = page_data["interactive_elements"]
-            
-            # 提取文本供侧边栏使用
-            sidebar_texts = set()
-            for el in interactive_elements:
-                if el["type"] == "text":
-                    sidebar_texts.add(el["content"])
-
-            # 汇总旧版兼容数据
-            image_ids = list(set(el["id"] for el in interactive_elements if el["type"] == "image"))
-            drawing_ids = [el["id"] for el in interactive_elements if el["type"] == "drawing"]
-
-            return {
-                "texts": sorted(list(sidebar_texts), key=len)[:300],
-                "suggested_watermarks": sorted(suggested_watermarks, key=len)[:100],
-                "image_ids": image_ids[:100],
-                "drawing_ids": drawing_ids[:100],
-                "interactive_elements": interactive_elements[:1000], # 限制数量防止响应过大
-                "page_width": src_page.rect.width,
-                "page_height": src_page.rect.height,
-                "page_rect": [src_page.rect.x0, src_page.rect.y0, src_page.rect.x1, src_page.rect.y1]
-            }
-        finally:
-            engine.close()
+        source = await open_pdf_source(file, doc_id)
+        key = result_cache.key("analyze", source.doc_id, page_index, analyze_all)
+        result = await asyncio.to_thread(result_cache.get_json, key)
+        if result is None:
+            # 全文档分析需要遍历大量页面，放到批量通道，不阻塞交互请求
+            lane = bulk if analyze_all else interactive
+            result = await run_in_lane(lane, tasks.analyze_page, source.path, page_index, analyze_all)
+            await asyncio.to_thread(result_cache.put_json, key, result)
+        return result
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
+
+@app.post("/api/detect-watermarks")
+async def detect_watermarks(file: UploadFile = File(None), doc_id: str = Form(None), max_pages: int = DETECT_MAX_PAGES):
+    """检测整份文档中重复出现的元素 (水印、页眉页脚)：max_pages 为 0 时检查全部页面，否则均匀抽样"""
+    source = None
+    try:
+        source = await open_pdf_source(file, doc_id)
+        if max_pages < 0:
+            raise APIError(400, "max_pages must be >= 0")
+        key = result_cache.key("detect-watermarks", source.doc_id, max_pages)
+        result = await asyncio.to_thread(result_cache.get_json, key)
+        if result is None:
+            result = await run_in_lane(bulk, tasks.detect_watermarks, source.path, max_pages)
+            await asyncio.to_thread(result_cache.put_json, key, result)
+        return result
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
     except Exception as e:
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
 
 @app.post("/api/preview")
 async def get_preview(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    doc_id: str = Form(None),
     watermark_image: UploadFile = File(None),
     page_index: int = 0,
     remove_targets_json: str = Form("{}"),
-    page_modifiers_json: str = Form("{}")
+    page_modifiers_json: str = Form("{}"),
+    assets: list[UploadFile] = File(None),
+    zoom: float = None,
+    clip: str = None,
+    tile: str = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    format: str = None,
+    quality: int = DEFAULT_QUALITY,
+    first_paint: bool = False,
+    accept: str = Header(None)
 ):
+    """
+    渲染单页预览图片。未指定 zoom / clip / tile 时为整页预览；
+    否则只渲染页面的一块区域 (clip=x0,y0,x1,y1 页面坐标，或 tile=列,行 按 tile_size 像素的网格)，
+    页面尺寸、缩放倍数与瓦片网格通过 X-Page-* / X-Zoom / X-Clip / X-Tile-* 响应头返回。
+    图片格式由 format 参数 (png / jpeg / webp) 或 Accept 头决定，默认 PNG；quality 用于有损格式。
+    first_paint=true 时返回缩小的渐进式 JPEG，用于完整预览返回前的首屏显示
+    """
+    source = None
     try:
         print(f"Preview request: page={page_index}")
-        await file.seek(0)
-        content = await file.read()
+        source = await open_pdf_source(file, doc_id)
         
         watermark_img_data = None
         if watermark_image:
             watermark_img_data = await watermark_image.read()
         
-        try:
-            remove_targets = json.loads(remove_targets_json)
-            page_modifiers_raw = json.loads(page_modifiers_json)
-        except Exception as je:
-            print(f"JSON parse error: {je}")
-            return JSONResponse(status_code=400, content={"error": f"Invalid JSON: {je}"})
-        
-        # 预处理 page_modifiers
-        page_modifiers = {}
-        for page_idx_str, elements in page_modifiers_raw.items():
-            processed_elements = []
-            for el in elements:
-                try:
-                    if el["type"] == "text":
-                        el["point"] = fitz.Point(el["x"], el["y"])
-                        el["fontsize"] = el.get("fontsize", 12)
-                        el["rotate"] = el.get("angle", 0)
-                        el["opacity"] = el.get("opacity", 1.0)
-                        el["fontname"] = el.get("fontname", "helv")
-                        
-                        # 处理颜色，从十六进制转换为 RGB 元组
-                        if "color" in el and isinstance(el["color"], str):
-                            el["color"] = hex_to_rgb(el["color"])
-                        processed_elements.append(el)
-                    elif el["type"] == "image":
-                        img_data = None
-                        if "base64" in el:
-                            # 移除 base64 头部
-                            b64_data = el["base64"]
-                            if "," in b64_data:
-                                b64_data = b64_data.split(",")[1]
-                            img_data = base64.b64decode(b64_data)
-                        elif watermark_img_data:
-                            img_data = watermark_img_data
-                        
-                        if img_data:
-                            el["stream"] = img_data
-                            el["opacity"] = el.get("opacity", 1.0)
-                            
-                            img = Image.open(io.BytesIO(img_data))
-                            w, h = img.size
-                            scale = el.get("scale", 1.0)
-                            rotate = el.get("angle", 0)
-                            el["rotate"] = rotate
-                            # 计算居中放置的 Rect
-                            # 注意：前端传来的 x, y 是中心点
-                            rect_w = w * scale
-                            rect_h = h * scale
-                            el["rect"] = fitz.Rect(
-                                el["x"] - rect_w / 2, 
-                                el["y"] - rect_h / 2, 
-                                el["x"] + rect_w / 2, 
-                                el["y"] + rect_h / 2
-                            )
-                            processed_elements.append(el)
-                except Exception as ee:
-                    print(f"Error processing element {el.get('type')}: {ee}")
-            
-            try:
-                page_modifiers[int(page_idx_str)] = processed_elements
-            except:
-                pass
+        remove_targets, page_modifiers_raw = parse_json_fields(remove_targets_json, page_modifiers_json)
+        asset_data, _ = await resolve_assets(page_modifiers_raw, assets)
 
-        engine = PDFEngine(content)
-        try:
-            if page_index < 0 or page_index >= len(engine.src_doc):
-                print(f"Invalid page index: {page_index}, doc length: {len(engine.src_doc)}")
-                return JSONResponse(status_code=400, content={"error": "Invalid page index"})
-                
-            # 预处理：补全目标元数据 (BBox 等)
-            engine._enrich_targets(remove_targets)
-            
-            src_page = engine.src_doc[page_index]
-            print(f"Rendering page {page_index} for preview...")
-            
-            add_els = page_modifiers.get(page_index, [])
-            # 直接在原文档的页面上进行擦除和添加（因为每次请求都是新的 engine 实例）
-            # 传入 page_index 参数，确保 render_to_page 只处理当前页面的目标
-            engine.render_to_page(src_page, None, remove_targets, add_els, page_index=page_index)
-            
-            # 提高预览分辨率，确保清晰，且禁用 alpha 通道防止透明背景导致显示不出
-            # 对于非常大的页面，限制缩放比例以防止内存溢出
-            scale = 1.5
-            if src_page.rect.width > 2000 or src_page.rect.height > 2000:
-                scale = 1.0
-            
-            print("Generating pixmap...")
-            pix = src_page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
-            img_bytes = pix.tobytes("png")
+        fmt = negotiate_format(format, accept)
+        if not 1 <= quality <= 100:
+            raise APIError(400, "quality must be in [1, 100]")
+        media_type = PREVIEW_FORMATS["jpeg" if first_paint else fmt]
+        encoding = {"fmt": fmt, "quality": quality, "first_paint": first_paint}
+
+        if zoom is None and clip is None and tile is None:
+            img_bytes = await run_in_lane(
+                interactive, tasks.render_preview, preview_cache, source.path, source.doc_id, page_index,
+                remove_targets, page_modifiers_raw, watermark_img_data, assets=asset_data, **encoding
+            )
             print(f"Generated preview image: {len(img_bytes)} bytes")
-            return StreamingResponse(io.BytesIO(img_bytes), media_type="image/png")
-        finally:
-            engine.close()
+            return StreamingResponse(io.BytesIO(img_bytes), media_type=media_type, headers={"Vary": "Accept"})
+
+        if not 0 < tile_size <= 4096:
+            raise APIError(400, "tile_size must be in (0, 4096]")
+        img_bytes, info = await run_in_lane(
+            interactive, tasks.render_preview_tile, preview_cache, source.path, source.doc_id, page_index,
+            remove_targets, page_modifiers_raw, watermark_img_data, assets=asset_data, zoom=zoom,
+            clip=parse_numbers(clip, 4, "clip") if clip else None,
+            tile=[int(v) for v in parse_numbers(tile, 2, "tile")] if tile else None,
+            tile_size=tile_size, **encoding
+        )
+        headers = {
+            "Vary": "Accept",
+            "X-Page-Width": f"{info['page_width']:g}",
+            "X-Page-Height": f"{info['page_height']:g}",
+            "X-Zoom": f"{info['zoom']:g}",
+            "X-Clip": ",".join(f"{v:g}" for v in info["clip"]),
+            "X-Tile-Size": str(info["tile_size"]),
+            "X-Tile-Cols": str(info["tile_cols"]),
+            "X-Tile-Rows": str(info["tile_rows"]),
+        }
+        return StreamingResponse(io.BytesIO(img_bytes), media_type=media_type, headers=headers)
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
     except Exception as e:
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
 
 @app.post("/api/reconstruct")
 async def reconstruct_pdf(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    doc_id: str = Form(None),
     watermark_image: UploadFile = File(None),
     remove_targets_json: str = Form("{}"),
-    page_modifiers_json: str = Form("{}")
+    page_modifiers_json: str = Form("{}"),
+    assets: list[UploadFile] = File(None)
 ):
+    source = None
     try:
-        await file.seek(0)
-        content = await file.read()
+        source = await open_pdf_source(file, doc_id)
         
         watermark_img_data = None
         if watermark_image:
             watermark_img_data = await watermark_image.read()
             
-        remove_targets = json.loads(remove_targets_json)
-        page_modifiers_raw = json.loads(page_modifiers_json)
-        
-        page_modifiers = {}
-        for page_idx_str, elements in page_modifiers_raw.items():
-            processed_elements = []
-            for el in elements:
-                if el["type"] == "text":
-                    el["point"] = fitz.Point(el["x"], el["y"])
-                    el["fontsize"] = el.get("fontsize", 12)
-                    el["rotate"] = el.get("angle", 0)
-                    el["opacity"] = el.get("opacity", 1.0)
-                    el["fontname"] = el.get("fontname", "helv")
-                    # 处理颜色
-                    if "color" in el and isinstance(el["color"], str):
-                        el["color"] = hex_to_rgb(el["color"])
-                elif el["type"] == "image":
-                    img_data = None
-                    if "base64" in el:
-                        # 移除 base64 头部
-                        b64_data = el["base64"]
-                        if "," in b64_data:
-                            b64_data = b64_data.split(",")[1]
-                        img_data = base64.b64decode(b64_data)
-                    elif watermark_img_data:
-                        img_data = watermark_img_data
-                    
-                    if img_data:
-                        el["stream"] = img_data
-                        el["opacity"] = el.get("opacity", 1.0)
-                        img = Image.open(io.BytesIO(img_data))
-                        w, h = img.size
-                        scale = el.get("scale", 1.0)
-                        rotate = el.get("angle", 0)
-                        el["rotate"] = rotate
-                        rect_w = w * scale
-                        rect_h = h * scale
-                        el["rect"] = fitz.Rect(
-                            el["x"] - rect_w / 2, 
-                            el["y"] - rect_h / 2, 
-                            el["x"] + rect_w / 2, 
-                            el["y"] + rect_h / 2
-                        )
-                processed_elements.append(el)
-            page_modifiers[int(page_idx_str)] = processed_elements
-        
-        engine = PDFEngine(content)
+        remove_targets, page_modifiers_raw = parse_json_fields(remove_targets_json, page_modifiers_json)
+        asset_data, asset_hashes = await resolve_assets(page_modifiers_raw, assets)
+
+        # 整份文档的重构在批量通道的独立进程中执行，结果直接写入临时文件，
+        # 再以文件响应分块发送 (支持 Content-Length 与 Range)，发送完毕后删除
+        fd, output_path = tempfile.mkstemp(prefix="hajihan-", suffix=".pdf")
+        os.close(fd)
+        key = reconstruct_key(source.doc_id, remove_targets, page_modifiers_raw, watermark_img_data, asset_hashes)
         try:
-            final_doc = engine.reconstruct(remove_targets=remove_targets, page_modifiers=page_modifiers)
-            
-            # 关键优化：字体子集化 (Font Subsetting)
-            # 这将极大减小包含中文字体的 PDF 体积，只保留用到的字符
+            # 相同输入与参数的结果直接从缓存取出 (checkout 需要目标路径不存在)
+            os.remove(output_path)
+            if not await asyncio.to_thread(result_cache.checkout, key, output_path):
+                await run_in_lane(
+                    bulk, tasks.reconstruct_document, source.path, source.doc_id, remove_targets,
+                    page_modifiers_raw, watermark_img_data, RECONSTRUCT_WORKERS, output_path=output_path,
+                    assets=asset_data
+                )
+                await asyncio.to_thread(result_cache.put_file, key, output_path)
+        except BaseException:
+            remove_file(output_path)
+            raise
+        return FileResponse(
+            output_path,
+            media_type="application/pdf",
+            filename="processed.pdf",
+            background=BackgroundTask(remove_file, output_path)
+        )
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
+
+async def run_batch_item(semaphore, source, key, remove_targets, page_modifiers):
+    """
+    批量重构中的单个文件：命中结果缓存则直接取出，否则在批量通道中处理。
+    队列满时稍后重试，超过 BATCH_BUSY_TIMEOUT 仍无空位则抛出 ExecutorBusy
+    """
+    fd, output_path = tempfile.mkstemp(prefix="hajihan-", suffix=".pdf")
+    os.close(fd)
+    os.remove(output_path)
+    try:
+        if await asyncio.to_thread(result_cache.checkout, key, output_path):
+            return output_path
+        async with semaphore:
+            deadline = time.monotonic() + BATCH_BUSY_TIMEOUT
+            while True:
+                try:
+                    await bulk.run(
+                        tasks.reconstruct_prepared, source.path, source.doc_id, remove_targets,
+                        page_modifiers, output_path=output_path
+                    )
+                    break
+                except ExecutorBusy:
+                    # 批量通道被其他请求占满，等待空位
+                    if time.monotonic() >= deadline:
+                        raise
+                    await asyncio.sleep(0.5)
+        await asyncio.to_thread(result_cache.put_file, key, output_path)
+        return output_path
+    except BaseException:
+        remove_file(output_path)
+        raise
+
+def unique_name(name, used):
+    """ZIP 内的结果文件名，去掉目录部分并避免重名"""
+    base, ext = os.path.splitext(os.path.basename(name) or "document.pdf")
+    candidate, n = base + (ext or ".pdf"), 1
+    while candidate in used:
+        n += 1
+        candidate = f"{base}_{n}{ext or '.pdf'}"
+    used.add(candidate)
+    return candidate
+
+@app.post("/api/batch/reconstruct")
+async def batch_reconstruct(
+    files: list[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    watermark_image: UploadFile = File(None),
+    remove_targets_json: str = Form("{}"),
+    page_modifiers_json: str = Form("{}"),
+    assets: list[UploadFile] = File(None)
+):
+    """
+    对多个 PDF 应用同一组去除目标与页面修饰 (可用键 "*" 作用于所有页面)。
+    输入为多个 files 或一个 ZIP (archive)；水印素材只预处理一次，各文件分散到批量通道并行处理，
+    返回 ZIP：处理结果与 manifest.json (每个文件的状态、错误信息与耗时)
+    """
+    items = []
+    zip_path = None
+    try:
+        for file in files or []:
+            items.append((file.filename or "document.pdf", await spool_upload(file)))
+        if archive is not None:
+            archive_source = await spool_upload(archive)
             try:
-                final_doc.subset_fonts()
+                items.extend(await asyncio.to_thread(
+                    extract_zip, archive_source.path, BATCH_MAX_FILES - len(items),
+                    BATCH_MAX_BYTES - sum(source.size for _, source in items)
+                ))
+            except zipfile.BadZipFile as e:
+                raise APIError(400, f"Invalid archive: {e}")
+            except ValueError as e:
+                raise APIError(413, str(e))
+            finally:
+                archive_source.release()
+        if not items:
+            raise APIError(400, "Either files or archive is required")
+        if len(items) > BATCH_MAX_FILES:
+            raise APIError(413, f"Too many files: {len(items)} > {BATCH_MAX_FILES}")
+        total_bytes = sum(source.size for _, source in items)
+        if total_bytes > BATCH_MAX_BYTES:
+            raise APIError(413, f"Files too large: {total_bytes} > {BATCH_MAX_BYTES} bytes")
+
+        watermark_img_data = None
+        if watermark_image:
+            watermark_img_data = await watermark_image.read()
+
+        remove_targets, page_modifiers_raw = parse_json_fields(remove_targets_json, page_modifiers_json)
+        asset_data, asset_hashes = await resolve_assets(page_modifiers_raw, assets)
+
+        # 缓存键与单文件重构一致
+        keys = [
+            reconstruct_key(source.doc_id, remove_targets, page_modifiers_raw, watermark_img_data, asset_hashes)
+            for _, source in items
+        ]
+        # 水印图片只解码一次，处理后的修饰参数传给所有文件
+        page_modifiers = await asyncio.to_thread(
+            tasks.prepare_page_modifiers, page_modifiers_raw, watermark_img_data, assets=asset_data
+        )
+
+        # 并行度以文件为单位，单个文件内不再拆分页面
+        semaphore = asyncio.Semaphore(bulk.max_workers)
+        started = time.monotonic()
+
+        async def run(index):
+            begin = time.monotonic()
+            try:
+                path = await run_batch_item(semaphore, items[index][1], keys[index], remove_targets, page_modifiers)
+                return index, path, None, time.monotonic() - begin
+            except ExecutorBusy:
+                print(f"Batch item {items[index][0]} failed: executor busy")
+                return index, None, "busy", time.monotonic() - begin
             except Exception as e:
-                print(f"Warning: subset_fonts failed: {e}")
-
-            out_pdf = io.BytesIO()
-            # 关键优化：garbage=4 (最高级别，包含去重)，deflate=True (压缩流)
-            final_doc.save(out_pdf, garbage=4, deflate=True) 
-            final_bytes = out_pdf.getvalue()
-            return StreamingResponse(
-                io.BytesIO(final_bytes),
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"attachment; filename=processed.pdf"}
+                print(f"Batch item {items[index][0]} failed: {e}")
+                return index, None, str(e), time.monotonic() - begin
+
+        fd, zip_path = tempfile.mkstemp(prefix="hajihan-batch-", suffix=".zip")
+        os.close(fd)
+        # 结果文件名按输入顺序预先分配，不受各文件完成先后的影响
+        used_names = {"manifest.json"}
+        output_names = [unique_name(name, used_names) for name, _ in items]
+        manifest = [None] * len(items)
+        # PDF 已经压缩过，ZIP 中直接存储
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as out:
+            for done in asyncio.as_completed([run(i) for i in range(len(items))]):
+                index, path, error, seconds = await done
+                entry = {"name": items[index][0], "status": "ok" if error is None else "failed", "error": error,
+                         "output": None, "size": None, "seconds": round(seconds, 3)}
+                if path:
+                    try:
+                        entry["output"] = output_names[index]
+                        entry["size"] = os.path.getsize(path)
+                        await asyncio.to_thread(out.write, path, entry["output"])
+                    finally:
+                        remove_file(path)
+                manifest[index] = entry
+            out.writestr("manifest.json", json.dumps({
+                "total": len(items),
+                "succeeded": sum(1 for entry in manifest if entry["status"] == "ok"),
+                "failed": sum(1 for entry in manifest if entry["status"] != "ok"),
+                "seconds": round(time.monotonic() - started, 3),
+                "files": manifest,
+            }, ensure_ascii=False, indent=2))
+
+        response = FileResponse(
+            zip_path,
+            media_type="application/zip",
+            filename="processed.zip",
+            background=BackgroundTask(remove_file, zip_path)
+        )
+        zip_path = None
+        return response
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        for _, source in items:
+            source.release()
+        if zip_path:
+            remove_file(zip_path)
+
+@app.post("/api/jobs/reconstruct")
+async def submit_reconstruct_job(
+    file: UploadFile = File(None),
+    doc_id: str = Form(None),
+    watermark_image: UploadFile = File(None),
+    remove_targets_json: str = Form("{}"),
+    page_modifiers_json: str = Form("{}"),
+    assets: list[UploadFile] = File(None)
+):
+    """提交异步重构任务，立即返回 job_id；通过状态接口或 SSE 查询进度，完成后下载结果"""
+    source = None
+    try:
+        source = await open_pdf_source(file, doc_id)
+
+        watermark_img_data = None
+        if watermark_image:
+            watermark_img_data = await watermark_image.read()
+
+        remove_targets, page_modifiers_raw = parse_json_fields(remove_targets_json, page_modifiers_json)
+        asset_data, _ = await resolve_assets(page_modifiers_raw, assets)
+
+        try:
+            job = await asyncio.to_thread(
+                job_manager.submit, "reconstruct", tasks.reconstruct_document, source.path, source.doc_id,
+                remove_targets, page_modifiers_raw, watermark_img_data, RECONSTRUCT_WORKERS, assets=asset_data
             )
-        finally:
-            engine.close()
+        except ExecutorBusy as e:
+            raise APIError(503, str(e))
+        # 文件在任务结束后删除
+        job.future.add_done_callback(lambda _, source=source: source.release())
+        source = None
+        return JSONResponse(status_code=202, content=job.to_dict())
+    except APIError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
     except Exception as e:
         import traceback
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if source:
+            source.release()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态与进度"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """以 Server-Sent Events 推送任务进度，任务结束后关闭连接"""
+    if job_manager.get(job_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+    return StreamingResponse(
+        job_manager.events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """下载已完成任务的结果文件"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+    if job.status != DONE:
+        return JSONResponse(status_code=409, content={"error": f"Job is {job.status}", "status": job.status})
+    fd, output_path = tempfile.mkstemp(prefix="hajihan-", suffix=".pdf")
+    os.close(fd)
+    # 硬链接需要目标路径不存在
+    os.remove(output_path)
+    if not await asyncio.to_thread(job_manager.checkout_result, job_id, output_path):
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+    return FileResponse(
+        output_path,
+        media_type="application/pdf",
+        filename="processed.pdf",
+        background=BackgroundTask(remove_file, output_path)
+    )
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消运行中的任务；已结束的任务则立即删除其结果文件"""
+    job = await asyncio.to_thread(job_manager.cancel, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+    return job.to_dict()
 
 if __name__ == "__main__":
     import uvicorn
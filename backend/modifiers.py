@@ -0,0 +1,175 @@
+"""
+页面修饰 (page_modifiers) 的预处理：补全默认值、转换颜色、解码图片并计算放置区域。
+图片按内容哈希去重：同一张水印无论放在多少个元素上、被多少次预览请求使用，
+只做一次 base64 解码和头部解析，解码结果在进程内缓存。
+
+图片元素有三种来源：
+- {"type": "image", "base64": "data:image/png;base64,..."}  内嵌在 JSON 中 (兼容旧前端)
+- {"type": "image", "asset": "<引用>"}  二进制素材，引用名为同一请求中 assets 文件部分的文件名，
+  或 /api/assets 返回的 asset_id；JSON 中只携带引用
+- {"type": "image"}  使用请求中单独上传的 watermark_image
+"""
+import base64
+import hashlib
+import io
+import json
+import fitz
+from PIL import Image
+from doc_store import LRUCache
+from utils import hex_to_rgb, ALL_PAGES
+
+# 解码后的图片缓存预算：64MB，30 分钟未访问即过期
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+IMAGE_CACHE_TTL = 30 * 60
+# MuPDF 可直接嵌入的格式；其他格式 (如 WebP) 统一转换为 PNG
+PASSTHROUGH_FORMATS = {"PNG", "JPEG", "GIF", "BMP", "TIFF", "JPEG2000", "PPM"}
+
+
+class ImageAsset:
+    """解码后的图片：key 为内容哈希，stream 为 MuPDF 可直接嵌入的图片数据"""
+
+    def __init__(self, key, stream, width, height):
+        self.key = key
+        self.stream = stream
+        self.width = width
+        self.height = height
+
+
+_IMAGE_CACHE = LRUCache(IMAGE_CACHE_MAX_BYTES, ttl=IMAGE_CACHE_TTL)
+
+try:
+    # 可选依赖：orjson 解析大段 JSON 比标准库快数倍
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(text):
+    """解析请求中的 JSON 字段 (安装了 orjson 时使用 orjson)，格式错误时抛出 ValueError"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def asset_refs(page_modifiers_raw):
+    """page_modifiers 中引用的全部二进制素材"""
+    refs = set()
+    for elements in page_modifiers_raw.values():
+        for el in elements:
+            if isinstance(el, dict) and el.get("type") == "image" and el.get("asset"):
+                refs.add(el["asset"])
+    return refs
+
+
+def _payload_key(payload):
+    if isinstance(payload, str):
+        payload = payload.encode("ascii", "ignore")
+    return hashlib.sha1(payload).hexdigest()
+
+
+def load_image(payload):
+    """
+    payload 为 base64 字符串 (可带 data URL 头部) 或图片字节。
+    只读取图片头部获得尺寸，不解码像素；仅当格式不能直接嵌入时才完整解码并转换为 PNG
+    """
+    key = _payload_key(payload)
+    asset = _IMAGE_CACHE.get(key)
+    if asset is not None:
+        return asset
+
+    if isinstance(payload, str):
+        # 移除 base64 头部
+        if "," in payload:
+            payload = payload.split(",")[1]
+        data = base64.b64decode(payload)
+    else:
+        data = payload
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        if img.format not in PASSTHROUGH_FORMATS:
+            out = io.BytesIO()
+            img.save(out, "PNG")
+            data = out.getvalue()
+    # 嵌入用的键取自最终数据，保证不同来源 (base64 / 上传文件) 的同一图片共用一个 xref
+    asset = ImageAsset(hashlib.sha1(data).hexdigest(), data, width, height)
+    _IMAGE_CACHE.put(key, asset, len(data))
+    return asset
+
+
+def prepare_page_modifiers(page_modifiers_raw, watermark_img_data=None, pages=None, assets=None):
+    """
+    预处理前端传来的 page_modifiers：补全默认值、转换颜色、解码图片并计算放置区域。
+    无法处理的元素打印日志后跳过，返回 {页码: [元素]}；键 "*" 表示应用于所有页面。
+    pages 不为空时 (如单页预览) 只处理这些页面及 "*" 的元素；assets 为 {引用: 图片字节}
+    """
+    watermark = None
+    # 本次请求内按素材引用 / base64 字符串本身去重 (各页元素常携带相同的数据)，省去重复计算内容哈希
+    loaded = {}
+    page_modifiers = {}
+    for page_idx_str, elements in page_modifiers_raw.items():
+        if page_idx_str == ALL_PAGES:
+            page_key = ALL_PAGES
+        else:
+            try:
+                page_key = int(page_idx_str)
+            except (TypeError, ValueError):
+                continue
+            if pages is not None and page_key not in pages:
+                continue
+
+        processed_elements = []
+        for el in elements:
+            try:
+                if el["type"] == "text":
+                    el["point"] = fitz.Point(el["x"], el["y"])
+                    el["fontsize"] = el.get("fontsize", 12)
+                    el["rotate"] = el.get("angle", 0)
+                    el["opacity"] = el.get("opacity", 1.0)
+                    el["fontname"] = el.get("fontname", "helv")
+
+                    # 处理颜色，从十六进制转换为 RGB 元组
+                    if "color" in el and isinstance(el["color"], str):
+                        el["color"] = hex_to_rgb(el["color"])
+                    processed_elements.append(el)
+                elif el["type"] == "image":
+                    asset = None
+                    if el.get("asset"):
+                        ref = ("asset", el["asset"])
+                        asset = loaded.get(ref)
+                        if asset is None:
+                            if not assets or el["asset"] not in assets:
+                                raise KeyError(f"unknown asset {el['asset']}")
+                            asset = loaded[ref] = load_image(assets[el["asset"]])
+                    elif "base64" in el:
+                        asset = loaded.get(el["base64"])
+                        if asset is None:
+                            asset = loaded[el["base64"]] = load_image(el["base64"])
+                    elif watermark_img_data:
+                        if watermark is None:
+                            watermark = load_image(watermark_img_data)
+                        asset = watermark
+
+                    if asset:
+                        el["stream"] = asset.stream
+                        el["image_key"] = asset.key
+                        el["opacity"] = el.get("opacity", 1.0)
+
+                        scale = el.get("scale", 1.0)
+                        rotate = el.get("angle", 0)
+                        el["rotate"] = rotate
+                        # 计算居中放置的 Rect
+                        # 注意：前端传来的 x, y 是中心点
+                        rect_w = asset.width * scale
+                        rect_h = asset.height * scale
+                        el["rect"] = fitz.Rect(
+                            el["x"] - rect_w / 2,
+                            el["y"] - rect_h / 2,
+                            el["x"] + rect_w / 2,
+                            el["y"] + rect_h / 2
+                        )
+                        processed_elements.append(el)
+            except Exception as ee:
+                print(f"Error processing element {el.get('type')}: {ee}")
+
+        page_modifiers[page_key] = processed_elements
+    return page_modifiers
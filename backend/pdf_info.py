@@ -0,0 +1,169 @@
+"""
+分级的 PDF 信息查询：
+- fast:    只读取目录/交叉引用级别的数据 (页数、元数据、权限、表单/签名标记、图层)，不解码任何页面内容
+- full:    在 fast 的基础上，单次遍历所有页面统计图片、注释、链接、字体
+- sampled: 与 full 相同，但只统计均匀抽样的若干页，并按页数外推总量 (适合超大文档)
+"""
+import os
+import fitz
+from utils import sample_pages
+from scan_detect import classify_document
+
+MODES = ("fast", "full", "sampled")
+DEFAULT_SAMPLE_SIZE = 20
+
+# AcroForm /SigFlags 第 1 位：文档包含签名
+SIG_FLAGS_SIGNATURES_EXIST = 1
+
+
+def _catalog_value(doc, key):
+    kind, value = doc.xref_get_key(doc.pdf_catalog(), key)
+    return None if kind == "null" else value
+
+
+def _inherited_rotation(doc, xref):
+    """/Rotate 可以从页面树的父节点继承"""
+    while xref:
+        kind, value = doc.xref_get_key(xref, "Rotate")
+        if kind == "int":
+            return int(value) % 360
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        xref = int(parent.split()[0]) if kind == "xref" else 0
+    return 0
+
+
+def page_sizes(doc):
+    """不加载页面对象，直接从页面字典读取显示尺寸 (与 page.rect 一致，已考虑旋转)"""
+    pages = []
+    for i in range(len(doc)):
+        box = doc.page_cropbox(i)
+        width, height = box.width, box.height
+        if _inherited_rotation(doc, doc.page_xref(i)) in (90, 270):
+            width, height = height, width
+        pages.append({"index": i, "width": width, "height": height})
+    return pages
+
+
+def _permissions(doc):
+    perm_flags = doc.permissions
+    return {
+        "print": bool(perm_flags & fitz.PDF_PERM_PRINT),
+        "modify": bool(perm_flags & fitz.PDF_PERM_MODIFY),
+        "copy": bool(perm_flags & fitz.PDF_PERM_COPY),
+        "annotate": bool(perm_flags & fitz.PDF_PERM_ANNOTATE),
+        "form": bool(perm_flags & fitz.PDF_PERM_FORM),
+    }
+
+
+def _has_signature_flag(doc):
+    sig_flags = _catalog_value(doc, "AcroForm/SigFlags")
+    try:
+        return bool(int(sig_flags or 0) & SIG_FLAGS_SIGNATURES_EXIST)
+    except ValueError:
+        return False
+
+
+def fast_info(doc, path):
+    """只读取文档级结构，耗时与页数基本无关 (页面尺寸除外，也只读取页面字典)"""
+    metadata = doc.metadata or {}
+    return {
+        "mode": "fast",
+        "page_count": len(doc),
+        "metadata": {
+            "title": metadata.get("title") or "",
+            "author": metadata.get("author") or "",
+            "subject": metadata.get("subject") or "",
+            "keywords": metadata.get("keywords") or "",
+            "creator": metadata.get("creator") or "",
+            "producer": metadata.get("producer") or "",
+            "creationDate": metadata.get("creationDate") or "",
+            "modDate": metadata.get("modDate") or "",
+        },
+        "file_size": os.path.getsize(path),
+        "version": doc.pdf_get_metadata().get("encryption") if doc.is_encrypted else "Standard",
+        "is_encrypted": doc.is_encrypted,
+        "permissions": _permissions(doc),
+        "has_ocg": _catalog_value(doc, "OCProperties") is not None,
+        "has_forms": doc.is_form_pdf,
+        "has_signatures": _has_signature_flag(doc),
+        # 以下统计需要遍历页面，fast 模式下不提供
+        "total_images": None,
+        "total_fonts": None,
+        "total_annots": None,
+        "total_links": None,
+        "is_scanned": None,
+        "has_ocr_layer": None,
+        "scan_confidence": None,
+        "pages": page_sizes(doc),
+    }
+
+
+def _is_signature_widget(doc, xref):
+    """签名域的 /FT 可能定义在父字段上"""
+    while xref:
+        kind, value = doc.xref_get_key(xref, "FT")
+        if kind == "name":
+            return value == "/Sig"
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        xref = int(parent.split()[0]) if kind == "xref" else 0
+    return False
+
+
+def collect_page_stats(doc, page_numbers, check_signatures=True):
+    """
+    单次遍历统计给定页面。注释/链接/表单域只读取页面的 /Annots 列表，不创建注释对象；
+    是否含签名一旦确定即不再检查后续页面
+    """
+    stats = {"images": 0, "annots": 0, "links": 0, "fonts": set(), "has_signatures": False}
+    for i in page_numbers:
+        page = doc[i]
+        stats["images"] += len(page.get_images())
+        for xref, annot_type, _ in page.annot_xrefs():
+            if annot_type == fitz.PDF_ANNOT_LINK:
+                stats["links"] += 1
+            elif annot_type == fitz.PDF_ANNOT_WIDGET:
+                if check_signatures and not stats["has_signatures"] and _is_signature_widget(doc, xref):
+                    stats["has_signatures"] = True
+            elif annot_type != fitz.PDF_ANNOT_POPUP:
+                # 与 page.annots() 一致：弹出窗口属于其父注释，不单独计数
+                stats["annots"] += 1
+        for f in page.get_fonts():
+            stats["fonts"].add(f[3]) # font name
+    return stats
+
+
+def pdf_info(path, mode="full", sample_size=DEFAULT_SAMPLE_SIZE):
+    if mode not in MODES:
+        raise ValueError(f"Unknown info mode: {mode}")
+    doc = fitz.open(path, filetype="pdf")
+    try:
+        info = fast_info(doc, path)
+        if mode == "fast":
+            return info
+
+        page_count = len(doc)
+        pages = list(range(page_count)) if mode == "full" else sample_pages(page_count, sample_size)
+        # 表单域标记说明有签名时无需再逐个检查签名域
+        check_signatures = info["has_forms"] and not info["has_signatures"]
+        stats = collect_page_stats(doc, pages, check_signatures)
+        # 扫描件识别只分析内容流操作符，不提取文本
+        scan = classify_document(doc)
+
+        # 抽样时按页数比例外推计数
+        factor = page_count / len(pages) if pages else 0
+        info.update({
+            "mode": mode,
+            "total_images": round(stats["images"] * factor),
+            "total_fonts": len(stats["fonts"]),
+            "total_annots": round(stats["annots"] * factor),
+            "total_links": round(stats["links"] * factor),
+            "has_signatures": info["has_signatures"] or stats["has_signatures"],
+            "is_scanned": scan["is_scanned"],
+            "has_ocr_layer": scan["has_ocr_layer"],
+            "scan_confidence": scan["confidence"],
+        })
+        if mode == "sampled":
+            info["sampled_pages"] = len(pages)
+        return info
+    finally:
+        doc.close()
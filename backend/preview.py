@@ -0,0 +1,215 @@
+import hashlib
+import json
+import fitz
+from PIL import Image
+from io import BytesIO
+from doc_store import LRUCache
+from utils import PDFEngine
+
+# 底图缓存预算：256MB，10 分钟未访问即过期
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 10 * 60
+
+# 分块预览：默认瓦片边长 (像素)、最大缩放倍数与单次渲染的最大边长
+DEFAULT_TILE_SIZE = 512
+MAX_ZOOM = 8.0
+MAX_TILE_PIXELS = 4096
+
+# 预览图片格式 -> MIME 类型
+PREVIEW_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+DEFAULT_QUALITY = 80
+# PNG 使用最低压缩级别：体积只比默认级别大一点，编码快数倍
+PNG_COMPRESS_LEVEL = 1
+# 首屏预览：缩小到最长边不超过该值的渐进式 JPEG
+FIRST_PAINT_MAX_SIZE = 512
+FIRST_PAINT_QUALITY = 50
+
+
+def targets_hash(remove_targets):
+    """对 remove_targets 做规范化哈希，作为"去除状态"的缓存键"""
+    canonical = json.dumps(remove_targets or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def preview_scale(page_rect):
+    # 对于非常大的页面，限制缩放比例以防止内存溢出
+    if page_rect.width > 2000 or page_rect.height > 2000:
+        return 1.0
+    return 1.5
+
+
+class BasePage:
+    """
+    已执行去除操作的页面底图，以及重建同尺寸叠加层所需的页面几何信息。
+    clip 不为空时为页面的一块区域 (页面坐标)，用于分块预览
+    """
+
+    def __init__(self, pixmap, scale, mediabox, cropbox, rotation, clip=None):
+        self.pixmap = pixmap
+        self.scale = scale
+        self.mediabox = mediabox
+        self.cropbox = cropbox
+        self.rotation = rotation
+        self.clip = clip
+
+    @property
+    def nbytes(self):
+        return len(self.pixmap.samples_mv)
+
+    def to_image(self):
+        # 直接引用 pixmap 的 samples 缓冲区，不额外复制
+        pix = self.pixmap
+        return Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1)
+
+
+class EditedPage:
+    """已执行去除操作的单页 PDF，分块预览时按需以任意缩放倍数渲染其中的区域"""
+
+    def __init__(self, pdf_bytes, rect, mediabox, cropbox, rotation):
+        self.pdf_bytes = pdf_bytes
+        self.rect = rect
+        self.mediabox = mediabox
+        self.cropbox = cropbox
+        self.rotation = rotation
+
+    @property
+    def nbytes(self):
+        return len(self.pdf_bytes)
+
+
+class PreviewCache:
+    """
+    按 (文档, 页码, 去除目标哈希) 缓存底图，滑块拖动时只需重绘叠加层。
+    分块预览另外缓存去除后的单页 PDF 与各瓦片 (键中再加上缩放倍数与区域)
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self._bases = LRUCache(max_bytes, ttl)
+
+    # state 为 targets_hash() 的结果；需在 _enrich_targets 原地补全目标之前计算
+    def get_base(self, doc_key, page_index, state):
+        return self._bases.get((doc_key, page_index, state))
+
+    def put_base(self, doc_key, page_index, state, base):
+        self._bases.put((doc_key, page_index, state), base, base.nbytes)
+
+    def get_page(self, doc_key, page_index, state):
+        return self._bases.get((doc_key, page_index, state, "page"))
+
+    def put_page(self, doc_key, page_index, state, page):
+        self._bases.put((doc_key, page_index, state, "page"), page, page.nbytes)
+
+    def get_tile(self, doc_key, page_index, state, zoom, clip):
+        return self._bases.get((doc_key, page_index, state, zoom, clip))
+
+    def put_tile(self, doc_key, page_index, state, zoom, clip, tile):
+        self._bases.put((doc_key, page_index, state, zoom, clip), tile, tile.nbytes)
+
+    def invalidate_document(self, doc_key, *_):
+        return self._bases.pop_where(lambda key: key[0] == doc_key)
+
+
+def render_base_page(engine, page_index, remove_targets):
+    """在源文档页面上执行全部去除逻辑，并渲染为底图"""
+    # 只需补全当前页的目标
+    engine._enrich_targets(remove_targets, pages={page_index})
+    page = engine.src_doc[page_index]
+    engine.render_to_page(page, None, remove_targets, None, page_index=page_index)
+    scale = preview_scale(page.rect)
+    # 禁用 alpha 通道防止透明背景导致显示不出
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    return BasePage(pix, scale, page.mediabox, page.cropbox, page.rotation)
+
+
+def render_edited_page(engine, page_index, remove_targets):
+    """在源文档页面上执行全部去除逻辑，并将该页单独保存为 PDF"""
+    engine._enrich_targets(remove_targets, pages={page_index})
+    page = engine.src_doc[page_index]
+    engine.render_to_page(page, None, remove_targets, None, page_index=page_index)
+    single = fitz.open()
+    try:
+        single.insert_pdf(engine.src_doc, from_page=page_index, to_page=page_index)
+        return EditedPage(single.tobytes(), page.rect, page.mediabox, page.cropbox, page.rotation)
+    finally:
+        single.close()
+
+
+def tile_clip(page_rect, zoom, col, row, tile_size=DEFAULT_TILE_SIZE):
+    """瓦片 (col, row) 对应的页面区域：瓦片按 zoom 下的像素网格从页面左上角排列"""
+    step = tile_size / zoom
+    x0 = page_rect.x0 + col * step
+    y0 = page_rect.y0 + row * step
+    return fitz.Rect(x0, y0, x0 + step, y0 + step) & page_rect
+
+
+def tile_grid(page_rect, zoom, tile_size=DEFAULT_TILE_SIZE):
+    """页面在 zoom 下的瓦片列数与行数"""
+    return (-(-round(page_rect.width * zoom) // tile_size), -(-round(page_rect.height * zoom) // tile_size))
+
+
+def render_tile(edited, zoom, clip):
+    """从去除后的单页 PDF 渲染一块区域"""
+    doc = fitz.open(stream=edited.pdf_bytes, filetype="pdf")
+    try:
+        pix = doc[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+    finally:
+        doc.close()
+    return BasePage(pix, zoom, edited.mediabox, edited.cropbox, edited.rotation, clip=clip)
+
+
+def render_overlay(base, add_elements):
+    """在与原页面几何一致的空白页上绘制新增元素，返回带 alpha 的叠加层"""
+    overlay_doc = fitz.open()
+    try:
+        page = overlay_doc.new_page(width=base.mediabox.width, height=base.mediabox.height)
+        page.set_mediabox(base.mediabox)
+        page.set_cropbox(base.cropbox)
+        page.set_rotation(base.rotation)
+        PDFEngine(doc=overlay_doc)._add_elements(page, add_elements)
+        return page.get_pixmap(matrix=fitz.Matrix(base.scale, base.scale), clip=base.clip, alpha=True)
+    finally:
+        overlay_doc.close()
+
+
+def compose_preview(base, add_elements):
+    """将叠加层合成到缓存的底图上，返回 PIL 图片 (无叠加层时直接引用底图像素，不复制)"""
+    if not add_elements:
+        return base.to_image()
+
+    overlay = render_overlay(base, add_elements)
+    if (overlay.width, overlay.height) != (base.pixmap.width, base.pixmap.height):
+        raise ValueError("Overlay size does not match base page")
+
+    # MuPDF 的带 alpha 像素为预乘格式 (RGBa)，转换后再按 alpha 合成
+    overlay_img = Image.frombuffer(
+        "RGBa", (overlay.width, overlay.height), overlay.samples_mv, "raw", "RGBa", overlay.stride, 1
+    ).convert("RGBA")
+    img = base.to_image().copy()
+    img.paste(overlay_img, (0, 0), overlay_img)
+    return img
+
+
+def encode_preview(img, fmt="png", quality=DEFAULT_QUALITY, first_paint=False):
+    """
+    编码预览图片。fmt 为 png / jpeg / webp，quality 只对有损格式有效。
+    first_paint 时输出缩小的渐进式 JPEG，供编辑器在完整预览返回前先行显示
+    """
+    buf = BytesIO()
+    if first_paint:
+        factor = -(-max(img.width, img.height) // FIRST_PAINT_MAX_SIZE)
+        if factor > 1:
+            img = img.reduce(factor)
+        img.save(buf, format="JPEG", quality=FIRST_PAINT_QUALITY, progressive=True)
+    elif fmt == "jpeg":
+        img.save(buf, format="JPEG", quality=quality)
+    elif fmt == "webp":
+        # method=0 编码最快，体积与默认方法相差不大
+        img.save(buf, format="WEBP", quality=quality, method=0)
+    else:
+        img.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
+def render_preview_image(base, add_elements, fmt="png", quality=DEFAULT_QUALITY, first_paint=False):
+    """合成叠加层并编码"""
+    return encode_preview(compose_preview(base, add_elements), fmt, quality, first_paint)
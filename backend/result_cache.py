@@ -0,0 +1,153 @@
+"""
+按内容寻址的持久化结果缓存。
+键为输入文件 SHA-256 与请求参数规范化 JSON 的哈希，结果以文件形式保存在磁盘目录中，
+超出容量时按 LRU 淘汰；写入先落到临时文件再原子替换，进程重启后已有结果仍可命中。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from doc_store import LRUCache
+
+# 默认缓存预算：1GB 磁盘空间
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# 结果格式或处理逻辑变化时递增，使旧结果全部失效
+CACHE_VERSION = 5
+
+
+class ResultCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "hajihan-results")
+        self._lock = threading.RLock()
+        self._entries = LRUCache(max_bytes, on_evict=self._remove_file, lock=self._lock)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(kind, *parts):
+        """kind 为结果类型，parts 为决定结果的全部输入 (须可 JSON 序列化)"""
+        canonical = json.dumps([CACHE_VERSION, kind, parts], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self):
+        """启动时登记目录中已有的结果，按最近访问时间 (命中时更新的 mtime) 恢复 LRU 顺序"""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if ".tmp-" in name:
+                    # 上次异常退出遗留的未完成写入
+                    self._remove_file(name, path)
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name, path, st.st_size))
+        for _, key, path, size in sorted(found):
+            self._entries.put(key, path, size)
+
+    def _lookup(self, key):
+        with self._lock:
+            path = self._entries.get(key)
+            if path is not None and not os.path.exists(path):
+                self._entries.pop(key)
+                path = None
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+            return path
+
+    def get_json(self, key):
+        path = self._lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Result cache read failed for {key}: {e}")
+            self._entries.pop(key)
+            return None
+
+    def put_json(self, key, value):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._write(key, lambda tmp: _write_bytes(tmp, data))
+
+    def checkout(self, key, dest):
+        """命中时在 dest 处创建结果文件的硬链接 (失败时复制)，之后即使被淘汰也可继续读取"""
+        with self._lock:
+            path = self._lookup(key)
+            if path is None:
+                return False
+            try:
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+            return True
+
+    def put_file(self, key, src):
+        """将已生成的结果文件加入缓存 (src 保持不变)"""
+        def write(tmp):
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+        self._write(key, write)
+
+    def _write(self, key, write):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+        try:
+            write(tmp)
+            size = os.path.getsize(tmp)
+            with self._lock:
+                # 先移除旧条目 (其淘汰回调会删除同名文件)，再替换为新文件
+                self._entries.pop(key)
+                os.replace(tmp, path)
+                if not self._entries.put(key, path, size):
+                    # 单个结果超过缓存容量
+                    self._remove_file(key, path)
+        except Exception as e:
+            print(f"Result cache write failed for {key}: {e}")
+            self._remove_file(key, tmp)
+
+    @staticmethod
+    def _remove_file(key, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to remove cached result {path}: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._entries.total_bytes,
+                "max_bytes": self._entries.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,168 @@
+"""
+扫描件识别：不提取文本，只扫描页面内容流的操作符。
+- 图片覆盖率：跟踪 q/Q/cm 得到每次绘制图片 (Do / 内联图片) 时的变换矩阵，计算其覆盖页面的比例
+- 文本：统计文本显示操作，按文本渲染模式区分可见文本与不可见文本 (3 Tr / 7 Tr，OCR 文本层)
+- 字体数量：直接读取页面资源
+抽样页面依次分类，结论足够确定时提前停止。
+"""
+import fitz
+import content_stream
+from utils import sample_pages
+
+# 图片覆盖页面比例达到该值即视为整页图片
+FULL_PAGE_COVERAGE = 0.75
+# 至少检查的页数；之后若各页结论一致且置信度足够则停止
+MIN_PAGES = 3
+CONFIDENT = 0.85
+DEFAULT_MAX_PAGES = 12
+# Form XObject 最大嵌套深度
+MAX_FORM_DEPTH = 5
+
+SCANNED_KINDS = {"scanned", "scanned_ocr"}
+
+
+class _PageScan:
+    def __init__(self, doc, page):
+        self.doc = doc
+        self.page_rect = page.mediabox
+        self.page_area = abs(self.page_rect)
+        self.image_area = 0.0
+        self.visible_text = 0
+        self.invisible_text = 0
+        self.images = 0
+        # (引用者 xref, 名称) -> 图片 / Form XObject 的 xref，引用者为 0 表示页面本身
+        self.image_names = {(ref, name): xref for xref, *_, name, _, ref in page.get_images(full=True)}
+        self.form_names = {(ref, name): xref for xref, name, ref, _ in page.get_xobjects()}
+
+    def _add_image(self, ctm):
+        # 图片绘制在单位正方形中，经 ctm 变换后的外接矩形即其在页面上的范围
+        rect = fitz.Rect(0, 0, 1, 1) * ctm
+        self.image_area += abs(rect & self.page_rect)
+        self.images += 1
+
+    def run(self, data, ctm, owner=0, depth=0, visited=()):
+        stack = []
+        tr = 0
+        for op, operands in content_stream.iter_operators(data):
+            if op == "q":
+                stack.append((ctm, tr))
+            elif op == "Q":
+                if stack:
+                    ctm, tr = stack.pop()
+            elif op == "cm":
+                if len(operands) >= 6:
+                    try:
+                        ctm = fitz.Matrix(*(float(v) for v in operands[-6:])) * ctm
+                    except (TypeError, ValueError):
+                        pass
+            elif op == "Tr":
+                if operands and operands[-1]:
+                    try:
+                        tr = int(float(operands[-1]))
+                    except ValueError:
+                        pass
+            elif op in content_stream.TEXT_SHOW_OPS:
+                # 3: 不填充不描边；7: 仅加入裁剪路径，两者都不可见
+                if tr in (3, 7):
+                    self.invisible_text += 1
+                else:
+                    self.visible_text += 1
+            elif op == "BI":
+                self._add_image(ctm)
+            elif op == "Do" and operands and operands[-1]:
+                name = operands[-1].lstrip("/")
+                if (owner, name) in self.image_names:
+                    self._add_image(ctm)
+                else:
+                    xref = self.form_names.get((owner, name))
+                    if xref and depth < MAX_FORM_DEPTH and xref not in visited:
+                        self._run_form(xref, ctm, depth, visited)
+
+    def _run_form(self, xref, ctm, depth, visited):
+        kind, value = self.doc.xref_get_key(xref, "Matrix")
+        if kind == "array":
+            try:
+                ctm = fitz.Matrix(*(float(v) for v in value.strip("[]").split())) * ctm
+            except (TypeError, ValueError):
+                pass
+        data = self.doc.xref_stream(xref)
+        if data:
+            self.run(data.decode("latin-1"), ctm, owner=xref, depth=depth + 1, visited=visited + (xref,))
+
+
+def classify_page(doc, page):
+    """对单页分类，返回 dict (kind, confidence 及各项指标)"""
+    scan = _PageScan(doc, page)
+    # 内容流使用 PDF 坐标系，与 mediabox 直接对应
+    scan.run(page.read_contents().decode("latin-1"), fitz.Identity)
+    coverage = min(1.0, scan.image_area / scan.page_area) if scan.page_area else 0.0
+    fonts = len(page.get_fonts())
+
+    if coverage >= FULL_PAGE_COVERAGE and not scan.visible_text:
+        # 整页图片；带不可见文本层的是 OCR 过的扫描件
+        kind = "scanned_ocr" if scan.invisible_text else "scanned"
+        confidence = 0.85 + 0.15 * (coverage - FULL_PAGE_COVERAGE) / (1 - FULL_PAGE_COVERAGE)
+    elif scan.visible_text and coverage < 0.3:
+        kind = "text"
+        confidence = 1.0 - coverage
+    elif scan.visible_text:
+        kind = "mixed"
+        confidence = 0.6
+    elif coverage >= 0.5:
+        # 大面积图片但未铺满，也没有文本，较可能是扫描件
+        kind = "scanned"
+        confidence = 0.6
+    elif scan.images or scan.invisible_text:
+        kind = "graphics"
+        confidence = 0.5
+    else:
+        kind = "blank" if not fonts else "graphics"
+        confidence = 0.5
+
+    return {
+        "index": page.number,
+        "kind": kind,
+        "confidence": round(confidence, 3),
+        "image_coverage": round(coverage, 3),
+        "images": scan.images,
+        "visible_text_ops": scan.visible_text,
+        "invisible_text_ops": scan.invisible_text,
+        "fonts": fonts,
+    }
+
+
+def classify_document(doc, max_pages=DEFAULT_MAX_PAGES):
+    """
+    抽样分类文档页面，返回：
+    is_scanned / has_ocr_layer / kind (多数页面的类别) / confidence / pages (已检查页面的明细)
+    """
+    candidates = sample_pages(len(doc), max_pages)
+    pages = []
+    for i in candidates:
+        pages.append(classify_page(doc, doc[i]))
+        if len(pages) >= MIN_PAGES:
+            scanned = {p["kind"] in SCANNED_KINDS for p in pages}
+            mean = sum(p["confidence"] for p in pages) / len(pages)
+            if len(scanned) == 1 and mean >= CONFIDENT:
+                break
+
+    if not pages:
+        return {"is_scanned": False, "has_ocr_layer": False, "kind": "blank", "confidence": 0.0,
+                "pages_examined": 0, "pages": []}
+
+    scanned_pages = [p for p in pages if p["kind"] in SCANNED_KINDS]
+    is_scanned = len(scanned_pages) * 2 > len(pages)
+    agreeing = scanned_pages if is_scanned else [p for p in pages if p["kind"] not in SCANNED_KINDS]
+    counts = {}
+    for p in pages:
+        counts[p["kind"]] = counts.get(p["kind"], 0) + 1
+    # 置信度 = 结论一致的页面比例 × 这些页面的平均置信度
+    confidence = len(agreeing) / len(pages) * sum(p["confidence"] for p in agreeing) / len(agreeing)
+    return {
+        "is_scanned": is_scanned,
+        "has_ocr_layer": any(p["kind"] == "scanned_ocr" for p in pages),
+        "kind": max(counts, key=counts.get),
+        "confidence": round(confidence, 3),
+        "pages_examined": len(pages),
+        "pages": pages,
+    }
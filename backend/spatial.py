@@ -0,0 +1,90 @@
+"""
+页面元素外接矩形的网格空间索引，以及删除区域 (redaction 矩形) 的安全合并。
+"""
+import fitz
+
+# 网格单元大小 (PDF 点)
+DEFAULT_CELL_SIZE = 64
+
+
+def touches(a, b):
+    """两个矩形相交或接触"""
+    return a.x0 <= b.x1 and b.x0 <= a.x1 and a.y0 <= b.y1 and b.y0 <= a.y1
+
+
+class RectGrid:
+    """均匀网格索引：每个矩形登记到它覆盖的所有单元，查询时只检查与查询矩形重叠的单元"""
+
+    def __init__(self, rects, cell_size=DEFAULT_CELL_SIZE):
+        self.rects = rects
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, rect in enumerate(rects):
+            for key in self._keys(rect):
+                self.cells.setdefault(key, []).append(i)
+
+    def _keys(self, rect):
+        size = self.cell_size
+        x0, x1 = int(rect.x0 // size), int(rect.x1 // size)
+        y0, y1 = int(rect.y0 // size), int(rect.y1 // size)
+        for gx in range(x0, x1 + 1):
+            for gy in range(y0, y1 + 1):
+                yield gx, gy
+
+    def query(self, rect):
+        """与 rect 相交或接触的矩形序号集合"""
+        found = set()
+        for key in self._keys(rect):
+            for i in self.cells.get(key, ()):
+                if i not in found and touches(self.rects[i], rect):
+                    found.add(i)
+        return found
+
+
+def merge_rects(rects, blockers=()):
+    """
+    将相交或接触的矩形合并为外接矩形，减少 redaction 注释的数量。
+    blockers 为不应被删除的元素：若合并后的外接矩形会触及某个原本未被任何成员触及的 blocker，
+    该组保持不合并 (redaction 会删除被触及的图形，不能因合并扩大删除范围)
+    """
+    rects = [fitz.Rect(r) for r in rects]
+    if len(rects) < 2:
+        return rects
+    grid = RectGrid(rects)
+    parent = list(range(len(rects)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, rect in enumerate(rects):
+        for j in grid.query(rect):
+            if j > i:
+                parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(rects)):
+        groups.setdefault(find(i), []).append(i)
+
+    blocker_grid = RectGrid([fitz.Rect(b) for b in blockers]) if blockers else None
+    merged = []
+    for members in groups.values():
+        if len(members) == 1:
+            merged.append(rects[members[0]])
+            continue
+        union = fitz.Rect(rects[members[0]])
+        for i in members[1:]:
+            union |= rects[i]
+        if blocker_grid is not None:
+            touched = blocker_grid.query(union)
+            if touched:
+                already = set()
+                for i in members:
+                    already |= blocker_grid.query(rects[i])
+                if not touched <= already:
+                    merged.extend(rects[i] for i in members)
+                    continue
+        merged.append(union)
+    return merged
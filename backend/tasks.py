@@ -0,0 +1,213 @@
+"""
+接口背后的同步 PyMuPDF 任务。
+这些函数不依赖 FastAPI，由 executor 中的执行通道在线程/进程中调用；
+运行在进程池中的函数及其参数、返回值都必须可以 pickle。
+"""
+import io
+import fitz
+from utils import PDFEngine, save_document, page_elements
+from modifiers import prepare_page_modifiers
+from preview import (
+    targets_hash, render_base_page, render_preview_image, render_edited_page, render_tile, tile_clip, tile_grid,
+    preview_scale, DEFAULT_TILE_SIZE, MAX_ZOOM, MAX_TILE_PIXELS, DEFAULT_QUALITY
+)
+from scan_detect import classify_document
+from detection import detect_watermarks as detect_document_watermarks, DEFAULT_MAX_PAGES as DETECT_MAX_PAGES
+
+
+class APIError(Exception):
+    """可直接转换为 JSON 错误响应的请求错误"""
+    def __init__(self, status_code, message):
+        # 两个参数都放入 args，保证跨进程传递 (pickle) 后可以重建
+        super().__init__(status_code, message)
+        self.status_code = status_code
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def validate_pdf(path):
+    """校验上传的 PDF，返回页数"""
+    try:
+        doc = fitz.open(path, filetype="pdf")
+    except Exception as e:
+        raise APIError(400, f"Invalid PDF: {e}")
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def detect_scanned(path, max_pages):
+    """扫描件识别 (见 scan_detect.classify_document)"""
+    doc = fitz.open(path, filetype="pdf")
+    try:
+        return classify_document(doc, max_pages)
+    finally:
+        doc.close()
+
+
+def detect_watermarks(path, max_pages=DETECT_MAX_PAGES):
+    """整份文档的水印检测 (见 detection.detect_watermarks)"""
+    doc = fitz.open(path, filetype="pdf")
+    try:
+        return detect_document_watermarks(doc, max_pages)
+    finally:
+        doc.close()
+
+
+def analyze_page(path, page_index=0, analyze_all=False):
+    """分析页面内容。如果 analyze_all 为 True，则分析所有页面并寻找共同模式"""
+    engine = PDFEngine(path)
+    try:
+        if page_index < 0 or page_index >= len(engine.src_doc):
+            raise APIError(400, f"Invalid page index: {page_index}")
+
+        suggested_watermarks = []
+        watermark_candidates = []
+        if analyze_all:
+            # 整份文档 (或抽样页面) 中在同一位置重复出现的元素 (疑似水印)
+            detection = detect_document_watermarks(engine.src_doc, DETECT_MAX_PAGES)
+            watermark_candidates = detection["candidates"]
+            suggested_watermarks = list(dict.fromkeys(
+                c["content"] for c in watermark_candidates if c["kind"] == "text"
+            ))
+
+        # 提取当前页的所有交互式元素 (用于点击去除)
+        src_page = engine.src_doc[page_index]
+        page_data = engine.extract_page_data(src_page, page_index=page_index)
+        interactive_elements = page_data["interactive_elements"]
+
+        # 提取文本供侧边栏使用
+        sidebar_texts = set()
+        for el in interactive_elements:
+            if el["type"] == "text":
+                sidebar_texts.add(el["content"])
+
+        # 汇总旧版兼容数据
+        image_ids = list(set(el["id"] for el in interactive_elements if el["type"] == "image"))
+        drawing_ids = [el["id"] for el in interactive_elements if el["type"] == "drawing"]
+
+        return {
+            "texts": sorted(list(sidebar_texts), key=len)[:300],
+            "suggested_watermarks": sorted(suggested_watermarks, key=len)[:100],
+            "watermark_candidates": watermark_candidates,
+            "image_ids": image_ids[:100],
+            "drawing_ids": drawing_ids[:100],
+            "interactive_elements": interactive_elements[:1000], # 限制数量防止响应过大
+            "page_width": src_page.rect.width,
+            "page_height": src_page.rect.height,
+            "page_rect": [src_page.rect.x0, src_page.rect.y0, src_page.rect.x1, src_page.rect.y1]
+        }
+    finally:
+        engine.close()
+
+
+def render_preview(preview_cache, path, doc_key, page_index, remove_targets, page_modifiers_raw, watermark_img_data=None,
+                   assets=None, fmt="png", quality=DEFAULT_QUALITY, first_paint=False):
+    """渲染单页预览图片 (格式见 preview.encode_preview)。去除状态相同时复用缓存的底图，只重绘叠加层"""
+    # 只预处理本页用到的元素
+    page_modifiers = prepare_page_modifiers(page_modifiers_raw, watermark_img_data, pages={page_index}, assets=assets)
+
+    # 去除状态相同时复用已渲染的底图，只重绘叠加层 (拖动水印滑块时无需重复执行去除逻辑)
+    state = targets_hash(remove_targets)
+    base = preview_cache.get_base(doc_key, page_index, state)
+    if base is None:
+        engine = PDFEngine(path, doc_key=doc_key)
+        try:
+            if page_index < 0 or page_index >= len(engine.src_doc):
+                print(f"Invalid page index: {page_index}, doc length: {len(engine.src_doc)}")
+                raise APIError(400, "Invalid page index")
+
+            print(f"Rendering base page {page_index} for preview...")
+            # 直接在原文档的页面上进行擦除（因为每次请求都是新的 engine 实例）
+            base = render_base_page(engine, page_index, remove_targets)
+            preview_cache.put_base(doc_key, page_index, state, base)
+        finally:
+            engine.close()
+
+    add_els = page_elements(page_modifiers, page_index)
+    return render_preview_image(base, add_els, fmt, quality, first_paint)
+
+
+def render_preview_tile(preview_cache, path, doc_key, page_index, remove_targets, page_modifiers_raw,
+                        watermark_img_data=None, assets=None, zoom=None, clip=None, tile=None,
+                        tile_size=DEFAULT_TILE_SIZE, fmt="png", quality=DEFAULT_QUALITY, first_paint=False):
+    """
+    渲染页面的一块区域 (适合平移/缩放查看器)，返回 (图片, 页面与瓦片信息)。
+    clip 为页面坐标中的区域 (x0, y0, x1, y1)；tile 为 (列, 行)，按 zoom 下 tile_size 像素的网格划分；
+    两者都未指定时渲染整页。去除后的页面与各瓦片底图分别缓存，耗时只与区域大小有关
+    """
+    if zoom is not None and not 0 < zoom <= MAX_ZOOM:
+        raise APIError(400, f"zoom must be in (0, {MAX_ZOOM}]")
+    page_modifiers = prepare_page_modifiers(page_modifiers_raw, watermark_img_data, pages={page_index}, assets=assets)
+
+    state = targets_hash(remove_targets)
+    edited = preview_cache.get_page(doc_key, page_index, state)
+    if edited is None:
+        engine = PDFEngine(path, doc_key=doc_key)
+        try:
+            if page_index < 0 or page_index >= len(engine.src_doc):
+                raise APIError(400, "Invalid page index")
+            edited = render_edited_page(engine, page_index, remove_targets)
+            preview_cache.put_page(doc_key, page_index, state, edited)
+        finally:
+            engine.close()
+
+    zoom = zoom or preview_scale(edited.rect)
+    if tile is not None:
+        region = tile_clip(edited.rect, zoom, tile[0], tile[1], tile_size)
+    elif clip is not None:
+        region = fitz.Rect(clip) & edited.rect
+    else:
+        region = fitz.Rect(edited.rect)
+    if region.is_empty:
+        raise APIError(400, "Region is outside the page")
+    if max(region.width, region.height) * zoom > MAX_TILE_PIXELS:
+        raise APIError(400, f"Region too large: at most {MAX_TILE_PIXELS} pixels per side")
+
+    key = tuple(round(v, 2) for v in region)
+    base = preview_cache.get_tile(doc_key, page_index, state, zoom, key)
+    if base is None:
+        base = render_tile(edited, zoom, region)
+        preview_cache.put_tile(doc_key, page_index, state, zoom, key, base)
+
+    cols, rows = tile_grid(edited.rect, zoom, tile_size)
+    info = {
+        "page_width": edited.rect.width,
+        "page_height": edited.rect.height,
+        "zoom": zoom,
+        "clip": key,
+        "tile_size": tile_size,
+        "tile_cols": cols,
+        "tile_rows": rows,
+    }
+    return render_preview_image(base, page_elements(page_modifiers, page_index), fmt, quality, first_paint), info
+
+
+def reconstruct_document(path, doc_key, remove_targets, page_modifiers_raw, watermark_img_data=None, workers=1,
+                         output_path=None, progress=None, assets=None):
+    """
+    重构整份文档并保存 (在批量通道的子进程中运行)。
+    指定 output_path 时直接写入该文件并返回 None，否则返回 PDF 字节
+    """
+    page_modifiers = prepare_page_modifiers(page_modifiers_raw, watermark_img_data, assets=assets)
+    return reconstruct_prepared(path, doc_key, remove_targets, page_modifiers, workers, output_path, progress)
+
+
+def reconstruct_prepared(path, doc_key, remove_targets, page_modifiers, workers=1, output_path=None, progress=None):
+    """与 reconstruct_document 相同，但 page_modifiers 已经过 prepare_page_modifiers 处理 (批量处理时共用)"""
+    engine = PDFEngine(path, doc_key=doc_key)
+    try:
+        final_doc = engine.reconstruct(
+            remove_targets=remove_targets, page_modifiers=page_modifiers, workers=workers, progress=progress
+        )
+        if output_path:
+            save_document(final_doc, output_path)
+            return None
+        out_pdf = io.BytesIO()
+        save_document(final_doc, out_pdf)
+        return out_pdf.getvalue()
+    finally:
+        engine.close()
@@ -1,7 +1,20 @@
 import fitz
 from PIL import Image
 from io import BytesIO
+from functools import cached_property
 import base64
+import hashlib
+import math
+import re
+import multiprocessing
+import multiprocessing.util
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import content_stream
+import fonts
+import spatial
+from doc_store import LRUCache
 
 def hex_to_rgb(hex_color):
     if not hex_color:
@@ -11,64 +24,146 @@ def hex_to_rgb(hex_color):
         hex_color = ''.join([c*2 for c in hex_color])
     return tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
 
-class PDFEngine:
-    def __init__(self, pdf_bytes):
-        self.pdf_bytes = pdf_bytes
-        self.src_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-    def close(self):
-        if self.src_doc and not self.src_doc.is_closed:
-            self.src_doc.close()
+# page_modifiers 中应用于所有页面的键
+ALL_PAGES = "*"
 
-    def extract_page_data(self, page, page_index=0):
-        """将页面解析为结构化数据 (包含源码级信息)"""
-        contents_xrefs = page.get_contents()
-        raw_streams = []
-        for xref in contents_xrefs:
-            try:
-                stream = self.src_doc.xref_stream(xref).decode('latin-1')
-                raw_streams.append({"xref": xref, "data": stream})
-            except: pass
+def page_elements(page_modifiers, page_index):
+    """取某页需要新增的元素：先是应用于所有页面的元素，再是该页单独指定的元素"""
+    if not page_modifiers:
+        return []
+    return page_modifiers.get(ALL_PAGES, []) + page_modifiers.get(page_index, [])
 
-        # 提取交互式元素
-        interactive_elements = []
-        
-        # 文本
-        for i, block in enumerate(page.get_text("dict").get("blocks", [])):
+def sample_pages(page_count, sample_size):
+    """均匀抽样页码 (包含首页和末页)"""
+    if sample_size <= 0 or page_count <= sample_size:
+        return list(range(page_count))
+    if sample_size == 1:
+        return [0]
+    step = (page_count - 1) / (sample_size - 1)
+    return sorted({round(k * step) for k in range(sample_size)})
+
+class PageIndex:
+    """
+    单页元素索引：每类页面数据 (文本、图片、矢量图形等) 只在首次访问时提取一次，
+    供 extract_page_data / _process_objects / _edit_stream_data / _enrich_targets 共用。
+    页面被修改后需要丢弃索引 (见 PDFEngine.invalidate_page_index)。
+    """
+
+    def __init__(self, page, page_index):
+        self.page = page
+        self.page_index = page_index
+        self._elements_by_id = {}
+
+    @cached_property
+    def content_xrefs(self):
+        return self.page.get_contents()
+
+    @cached_property
+    def text_blocks(self):
+        return self.page.get_text("dict").get("blocks", [])
+
+    @cached_property
+    def text_spans(self):
+        """[(span_id, span)]，span_id 与前端使用的 p{page}_b{i}_l{j}_s{k} 一致"""
+        spans = []
+        for i, block in enumerate(self.text_blocks):
             if block.get("type") == 0:
                 for j, line in enumerate(block.get("lines", [])):
                     for k, span in enumerate(line.get("spans", [])):
-                        # 增加颜色和字体信息作为唯一性的一部分
-                        interactive_elements.append({
-                            "type": "text",
-                            "id": f"p{page_index}_b{i}_l{j}_s{k}",
-                            "content": span.get("text", ""),
-                            "bbox": list(span.get("bbox", [0,0,0,0])),
-                            "color": span.get("color"),
-                            "font": span.get("font"),
-                            "size": span.get("size"),
-                            "page": page_index
-                        })
-        
-        # 图片
-        for img in page.get_image_info(xrefs=True):
-            interactive_elements.append({
-                "type": "image",
-                "id": f"p{page_index}_img_{img['xref']}",
-                "content": f"Image {img['xref']}",
-                "bbox": list(img.get("bbox", [0,0,0,0])),
-                "page": page_index
+                        spans.append((f"p{self.page_index}_b{i}_l{j}_s{k}", span))
+        return spans
+
+    @cached_property
+    def texttrace(self):
+        """
+        页面的 texttrace，附带每条 trace 的签名与排名：
+        _hex_seq/_str_content 为 glyph/字符签名，_hex_rank/_str_rank 为该签名在页面上第几次出现，
+        用于区分页面上多个相同的文本（如两个 "11.09"）。
+        """
+        try:
+            trace = self.page.get_texttrace()
+        except:
+            trace = []
+
+        hex_counts = {}
+        str_counts = {}
+        for t in trace:
+            # 计算 hex 签名
+            h_seq = "".join([f"{c[1]:04X}" for c in t['chars']])
+            hex_counts[h_seq] = hex_counts.get(h_seq, 0) + 1
+            t['_hex_rank'] = hex_counts[h_seq]
+            t['_hex_seq'] = h_seq
+
+            # 计算字符串签名
+            s_content = "".join([chr(c[0]) for c in t['chars']])
+            str_counts[s_content] = str_counts.get(s_content, 0) + 1
+            t['_str_rank'] = str_counts[s_content]
+            t['_str_content'] = s_content
+        return trace
+
+    @cached_property
+    def text_runs(self):
+        return text_runs(self.text_blocks)
+
+    @cached_property
+    def images(self):
+        # 包括 xref=0 的内联图片
+        return self.page.get_image_info(xrefs=True)
+
+    @cached_property
+    def drawings(self):
+        return self.page.get_drawings()
+
+    @cached_property
+    def widgets(self):
+        # 只保存控件的基本信息；Widget 对象与页面对象绑定，删除时按 xref 重新加载
+        return [
+            {"xref": w.xref, "field_name": w.field_name, "field_type": w.field_type, "rect": w.rect}
+            for w in self.page.widgets()
+        ]
+
+    @cached_property
+    def links(self):
+        return self.page.get_links()
+
+    # --- 交互式元素 (前端点击去除、目标补全使用的统一格式) ---
+
+    @cached_property
+    def text_elements(self):
+        elements = []
+        for span_id, span in self.text_spans:
+            # 增加颜色和字体信息作为唯一性的一部分
+            elements.append({
+                "type": "text",
+                "id": span_id,
+                "content": span.get("text", ""),
+                "bbox": list(span.get("bbox", [0,0,0,0])),
+                "color": span.get("color"),
+                "font": span.get("font"),
+                "size": span.get("size"),
+                "page": self.page_index
             })
+        return elements
 
-        # 矢量图形 (Drawings)
-        drawings = page.get_drawings()
-        for i, dw in enumerate(drawings):
+    @cached_property
+    def image_elements(self):
+        return [{
+            "type": "image",
+            "id": f"p{self.page_index}_img_{img['xref']}",
+            "content": f"Image {img['xref']}",
+            "bbox": list(img.get("bbox", [0,0,0,0])),
+            "page": self.page_index
+        } for img in self.images]
+
+    @cached_property
+    def drawing_elements(self):
+        elements = []
+        for i, dw in enumerate(self.drawings):
             bbox = dw.get("rect")
             if bbox and (bbox.width * bbox.height > 1):
-                did = f"p{page_index}_draw_{i}"
-                interactive_elements.append({
+                elements.append({
                     "type": "drawing",
-                    "id": did,
+                    "id": f"p{self.page_index}_draw_{i}",
                     "content": f"Drawing {i}",
                     "bbox": [bbox.x0, bbox.y0, bbox.x1, bbox.y1],
                     "metadata": {
@@ -77,30 +172,422 @@ class PDFEngine:
                         "fill": dw.get("fill") is not None,
                         "stroke": dw.get("color") is not None
                     },
-                    "page": page_index
+                    "page": self.page_index
                 })
+        return elements
 
-        # 4. 签名/控件 (Widgets)
-        for i, widget in enumerate(page.widgets()):
-            bbox = widget.rect
-            interactive_elements.append({
+    @cached_property
+    def widget_elements(self):
+        elements = []
+        for widget in self.widgets:
+            bbox = widget["rect"]
+            elements.append({
                 "type": "widget",
-                "id": f"p{page_index}_widget_{widget.xref}",
-                "content": f"Field: {widget.field_name or 'unnamed'}",
+                "id": f"p{self.page_index}_widget_{widget['xref']}",
+                "content": f"Field: {widget['field_name'] or 'unnamed'}",
                 "bbox": [bbox.x0, bbox.y0, bbox.x1, bbox.y1],
-                "page": page_index
+                "page": self.page_index
             })
+        return elements
 
-        # 5. 链接 (Links)
-        for i, link in enumerate(page.get_links()):
+    @cached_property
+    def link_elements(self):
+        elements = []
+        for i, link in enumerate(self.links):
             bbox = link.get("from")
-            interactive_elements.append({
+            elements.append({
                 "type": "link",
-                "id": f"p{page_index}_link_{i}",
+                "id": f"p{self.page_index}_link_{i}",
                 "content": f"Link: {link.get('uri', 'internal')}",
                 "bbox": [bbox.x0, bbox.y0, bbox.x1, bbox.y1],
-                "page": page_index
+                "page": self.page_index
             })
+        return elements
+
+    def elements_for(self, category):
+        """按 remove_targets 的分类名返回对应的交互式元素"""
+        return {
+            "text": lambda: self.text_elements,
+            "xobjects": lambda: self.image_elements,
+            "drawings": lambda: self.drawing_elements,
+            "widgets": lambda: self.widget_elements,
+            "links": lambda: self.link_elements,
+        }[category]()
+
+    def find_element(self, category, element_id):
+        """按 ID 查找交互式元素 (每类元素首次查找时建立 ID 索引)"""
+        by_id = self._elements_by_id.get(category)
+        if by_id is None:
+            by_id = self._elements_by_id[category] = {el["id"]: el for el in self.elements_for(category)}
+        return by_id.get(element_id)
+
+
+TARGET_CATEGORIES = ["text", "xobjects", "drawings", "widgets", "links"]
+
+
+def target_page(target_id):
+    """从 p{page}_... 格式的目标 ID 中解析页码"""
+    if not isinstance(target_id, str) or not target_id.startswith("p"):
+        return None
+    head = target_id[1:].split("_", 1)[0]
+    return int(head) if head.isdigit() else None
+
+
+def is_target_complete(category, target):
+    """目标已带有删除所需的全部信息 (页码、bbox，文本还需内容)，无需再补全"""
+    if "bbox" not in target or "page" not in target:
+        return False
+    return category != "text" or "content" in target
+
+
+def _rounded_color(color):
+    return tuple(round(c, 3) for c in color) if color else None
+
+
+# 文本/图片方向的量化步长 (度)
+ANGLE_STEP = 5
+
+
+def direction_angle(cos, sin):
+    """方向向量 -> 量化后的角度 (0-359)"""
+    degrees = math.degrees(math.atan2(sin, cos))
+    return int(round(degrees / ANGLE_STEP) * ANGLE_STEP) % 360
+
+
+def text_runs(blocks):
+    """
+    get_text("dict") 的文本行 -> [(内容, 字号, 角度, bbox)]。
+    水平的行各自为一条；旋转的文本 (斜向水印常被拆成逐字的行) 按角度和字号合并为一条
+    """
+    runs = []
+    rotated = {}
+    for block in blocks:
+        for line in block.get("lines", []):
+            spans = line.get("spans", [])
+            if not spans:
+                continue
+            text = "".join(span.get("text", "") for span in spans).strip()
+            if not text:
+                continue
+            size = round(max(span.get("size", 0) for span in spans))
+            angle = direction_angle(*line.get("dir", (1, 0)))
+            bbox = fitz.Rect(line["bbox"])
+            if angle:
+                group = rotated.setdefault((angle, size), [[], fitz.Rect(bbox)])
+                group[0].append(text)
+                group[1] |= bbox
+            else:
+                runs.append((text, size, 0, bbox))
+    for (angle, size), (texts, bbox) in rotated.items():
+        runs.append(("".join(texts), size, angle, bbox))
+    return runs
+
+
+def drawing_fingerprint(drawing):
+    """
+    矢量路径的形状签名：路径命令及其相对外接矩形左上角的坐标 (保留 1 位小数)、填充/描边颜色与线宽。
+    与位置无关，同一图形出现在不同页面 (或同一页的不同位置) 时签名相同
+    """
+    rect = drawing.get("rect") or fitz.Rect()
+    ox, oy = rect.x0, rect.y0
+    parts = [drawing.get("type"), _rounded_color(drawing.get("fill")), _rounded_color(drawing.get("color")),
+             round(drawing.get("width") or 0, 1)]
+    for item in drawing.get("items", []):
+        parts.append(item[0])
+        for value in item[1:]:
+            if isinstance(value, fitz.Point):
+                parts.extend((round(value.x - ox, 1), round(value.y - oy, 1)))
+            elif isinstance(value, fitz.Rect):
+                parts.extend((round(value.x0 - ox, 1), round(value.y0 - oy, 1),
+                              round(value.x1 - ox, 1), round(value.y1 - oy, 1)))
+            elif isinstance(value, fitz.Quad):
+                for point in value:
+                    parts.extend((round(point.x - ox, 1), round(point.y - oy, 1)))
+            else:
+                parts.append(value)
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def image_fingerprint(doc, info, digests=None):
+    """
+    图片的内容签名：有 xref 的图片取原始 (未解码) 流数据的哈希，digests 为按 xref 缓存的字典；
+    内联图片没有独立的流，以尺寸/位深/色彩空间近似
+    """
+    xref = info.get("xref", 0)
+    if not xref:
+        return f"inline:{info.get('width')}x{info.get('height')}:{info.get('bpc')}:{info.get('cs-name')}"
+    if digests is not None and xref in digests:
+        return digests[xref]
+    try:
+        digest = hashlib.sha1(doc.xref_stream_raw(xref) or b"").hexdigest()[:16]
+    except Exception:
+        digest = f"xref:{xref}"
+    if digests is not None:
+        digests[xref] = digest
+    return digest
+
+
+class TextLocationIndex:
+    """文本内容 -> 首次出现位置 的索引，按页增量构建，找到即停止扫描"""
+
+    def __init__(self):
+        self.locations = {}
+        self.scanned_pages = 0
+        self._lock = threading.Lock()
+
+    def locate(self, engine, content):
+        with self._lock:
+            page_count = len(engine.src_doc)
+            while content not in self.locations and self.scanned_pages < page_count:
+                for el in engine.get_page_index(self.scanned_pages).text_elements:
+                    self.locations.setdefault(el["content"], el)
+                self.scanned_pages += 1
+            return self.locations.get(content)
+
+
+# 按文档缓存文本位置索引，预览请求之间可以复用
+_TEXT_LOCATION_CACHE = LRUCache(max_bytes=64, ttl=30 * 60)
+
+
+class CompiledTargets:
+    """
+    remove_targets 编译后的查找表，同一份 remove_targets 只编译一次，逐页匹配时每个页面对象只做常数次查找。
+
+    除按页面 ID (p{page}_...) 指定的目标外，还支持对所有页面生效的特征目标 (不带 id 的字典，
+    即 /api/detect-watermarks 返回的 match)：
+    - xobjects: {"xref": 12} 或 {"digest": "..."} (见 image_fingerprint)
+    - drawings: {"path_hash": "..."} (见 drawing_fingerprint)
+    - text:     {"content": "..."} (不带 page；未能定位的纯字符串目标同样按内容匹配所有页面)
+    """
+
+    def __init__(self, doc, remove_targets):
+        self.doc = doc
+        self.ids = {category: set() for category in TARGET_CATEGORIES}
+        self.id_pages = {category: set() for category in TARGET_CATEGORIES}
+        self.image_xrefs = set()
+        self.image_digests = set()
+        self.path_hashes = set()
+        self.text_contents = set()
+        self.text_by_page = {}  # {页码: [(content, bbox)]}
+        self._digests = {}
+
+        for category in TARGET_CATEGORIES:
+            for t in (remove_targets or {}).get(category) or []:
+                if is_pattern_target(category, t):
+                    self._add_pattern(category, t)
+                elif category == "text":
+                    if isinstance(t, str):
+                        if t:
+                            self.text_contents.add(t)
+                    elif isinstance(t, dict) and "page" in t and (t.get("content") or t.get("bbox")):
+                        self.text_by_page.setdefault(t["page"], []).append((t.get("content", ""), t.get("bbox")))
+                else:
+                    tid = t.get("id") if isinstance(t, dict) else t
+                    self.ids[category].add(tid)
+                    self.id_pages[category].add(target_page(tid))
+
+    def _add_pattern(self, category, t):
+        if category == "text":
+            self.text_contents.add(t["content"])
+        elif category == "xobjects":
+            if t.get("xref"):
+                self.image_xrefs.add(t["xref"])
+            if t.get("digest"):
+                self.image_digests.add(t["digest"])
+        elif category == "drawings":
+            self.path_hashes.add(t["path_hash"])
+
+    def wants(self, category, page_index):
+        """该页是否可能有 category 类对象需要删除 (否则无需提取该类页面数据)"""
+        if page_index in self.id_pages[category]:
+            return True
+        if category == "xobjects":
+            return bool(self.image_xrefs or self.image_digests)
+        if category == "drawings":
+            return bool(self.path_hashes)
+        return False
+
+    def match_image(self, info, page_index):
+        xref = info.get("xref", 0)
+        if f"p{page_index}_img_{xref}" in self.ids["xobjects"] or (xref and xref in self.image_xrefs):
+            return True
+        return bool(self.image_digests) and image_fingerprint(self.doc, info, self._digests) in self.image_digests
+
+    def match_drawing(self, drawing, i, page_index):
+        if f"p{page_index}_draw_{i}" in self.ids["drawings"]:
+            return True
+        return bool(self.path_hashes) and drawing_fingerprint(drawing) in self.path_hashes
+
+
+def is_pattern_target(category, target):
+    """不带 id、按特征匹配所有页面的目标 (见 CompiledTargets)"""
+    if not isinstance(target, dict) or "id" in target:
+        return False
+    if category == "text":
+        return bool(target.get("content")) and "page" not in target
+    if category == "xobjects":
+        return bool(target.get("xref") or target.get("digest"))
+    if category == "drawings":
+        return bool(target.get("path_hash"))
+    return False
+
+
+class RemovalPlan:
+    """单页内容流的删除计划"""
+
+    def __init__(self):
+        self.inline_images = 0   # 需要删除的内联图片数量
+        self.hex_to_remove = {}  # {glyph 十六进制签名: set(rank)}
+        self.str_to_remove = {}  # {文本签名: set(rank)}
+
+    @property
+    def is_empty(self):
+        return not (self.inline_images or self.hex_to_remove or self.str_to_remove)
+
+    @property
+    def key(self):
+        """计划的可哈希表示，相同的计划对同一个流只需执行一次"""
+        return (
+            self.inline_images,
+            frozenset((sig, frozenset(ranks)) for sig, ranks in self.hex_to_remove.items()),
+            frozenset((sig, frozenset(ranks)) for sig, ranks in self.str_to_remove.items()),
+        )
+
+
+# 资源字典中的间接引用 "12 0 R"
+_REF_RE = re.compile(r"(\d+)\s+\d+\s+R\b")
+
+
+class XObjectGraph:
+    """
+    文档的 Form XObject 引用图：页面 -> 资源中的 Form XObject -> 其资源中嵌套的 Form XObject。
+    每个节点的子节点只解析一次，多个页面共享的 XObject 在图中只是一个节点
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._children = {}
+
+    def _xobject_refs(self, xref):
+        """xref 资源字典 (页面的资源可继承自父节点) 中 /XObject 引用的对象"""
+        doc = self.doc
+        node = xref
+        for _ in range(32):
+            if doc.xref_get_key(node, "Resources")[0] != "null":
+                break
+            kind, value = doc.xref_get_key(node, "Parent")
+            if kind != "xref":
+                return []
+            node = int(value.split()[0])
+        kind, value = doc.xref_get_key(node, "Resources/XObject")
+        if kind == "xref":
+            value = doc.xref_object(int(value.split()[0]), compressed=True)
+        elif kind != "dict":
+            return []
+        return [int(ref) for ref in _REF_RE.findall(value)]
+
+    def children(self, xref):
+        """xref 直接引用的 Form XObject"""
+        found = self._children.get(xref)
+        if found is None:
+            found = []
+            try:
+                for ref in self._xobject_refs(xref):
+                    if ref not in found and self.doc.xref_get_key(ref, "Subtype") == ("name", "/Form"):
+                        found.append(ref)
+            except Exception as e:
+                print(f"Error reading XObject resources of {xref}: {e}")
+            self._children[xref] = found
+        return found
+
+    def reachable(self, xref, seen=None):
+        """xref 直接或间接引用的全部 Form XObject，返回的集合中包含 xref 自身"""
+        if seen is None:
+            seen = set()
+        stack = [xref]
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.extend(self.children(node))
+        return seen
+
+
+class PDFEngine:
+    def __init__(self, source=None, doc=None, doc_key=None):
+        """
+        source 可以是 PDF 文件路径或字节。优先使用路径：MuPDF 按需从磁盘读取，
+        引擎也不会在内存中保留整份文件
+        """
+        self.path = source if isinstance(source, str) else None
+        # 文档标识 (doc_id 或内容哈希)，用于跨请求复用按文档缓存的索引
+        self.doc_key = doc_key
+        # 也可以直接包装一个已打开的文档 (例如预览叠加层使用的空白文档)
+        if doc is not None:
+            self.src_doc = doc
+        elif self.path:
+            self.src_doc = fitz.open(self.path, filetype="pdf")
+        else:
+            self.src_doc = fitz.open(stream=source, filetype="pdf")
+        self._page_indexes = {}
+        # 文档内共享的水印：文本印章文档与已嵌入图片的 xref (见 _add_elements)
+        self._stamps = {}
+        self._image_xrefs = {}
+        # (remove_targets, CompiledTargets)：逐页处理同一份 remove_targets 时复用
+        self._compiled = None
+        # 已被替换为空图片的图片 xref
+        self._deleted_images = set()
+        # 共享内容流的编辑记录 (见 _edit_streams)：Form XObject 引用图、流内容概要、已执行过的删除计划
+        self._xobject_graph = None
+        self._stream_summaries = {}
+        self._stream_plans = {}
+
+    def close(self):
+        for stamp in self._stamps.values():
+            stamp.close()
+        self._stamps = {}
+        self._image_xrefs = {}
+        if self.src_doc and not self.src_doc.is_closed:
+            self.src_doc.close()
+
+    def get_page_index(self, page_index, page=None):
+        """获取 (并缓存) 页面元素索引"""
+        if page_index is None:
+            return PageIndex(page, page_index)
+        index = self._page_indexes.get(page_index)
+        if index is None:
+            index = PageIndex(page if page is not None else self.src_doc[page_index], page_index)
+            self._page_indexes[page_index] = index
+        return index
+
+    def invalidate_page_index(self, page_index):
+        self._page_indexes.pop(page_index, None)
+
+    def compile_targets(self, remove_targets):
+        """编译 remove_targets (已补全)，同一对象只编译一次"""
+        if self._compiled is None or self._compiled[0] is not remove_targets:
+            self._compiled = (remove_targets, CompiledTargets(self.src_doc, remove_targets))
+        return self._compiled[1]
+
+    def extract_page_data(self, page, page_index=0):
+        """将页面解析为结构化数据 (包含源码级信息)"""
+        index = self.get_page_index(page_index, page)
+        raw_streams = []
+        for xref in index.content_xrefs:
+            try:
+                stream = self.src_doc.xref_stream(xref).decode('latin-1')
+                raw_streams.append({"xref": xref, "data": stream})
+            except: pass
+
+        # 提取交互式元素
+        interactive_elements = (
+            index.text_elements
+            + index.image_elements
+            + index.drawing_elements
+            + index.widget_elements
+            + index.link_elements
+        )
 
         return {
             "rect": {
@@ -116,30 +603,34 @@ class PDFEngine:
         }
 
     def _process_objects(self, page, remove_targets, page_index):
-        """处理非内容流对象的物理删除 (Widgets, Links, XObjects)"""
+        """
+        处理非内容流对象的物理删除 (Widgets, Links, XObjects)。
+        返回需要删除的矢量图形 (页面全部图形, 命中的序号)，没有时返回 None
+        """
         if not remove_targets:
-            return
+            return None
+
+        index = self.get_page_index(page_index, page)
+        targets = self.compile_targets(remove_targets)
 
         # 1. 处理 Widgets (表单控件)
-        if remove_targets.get("widgets"):
-            for widget in page.widgets():
-                target_id = f"p{page_index}_widget_{widget.xref}"
-                if any((t.get("id") == target_id if isinstance(t, dict) else t == target_id) for t in remove_targets["widgets"]):
-                    try: page.delete_widget(widget)
+        if targets.wants("widgets", page_index):
+            for widget in index.widgets:
+                if f"p{page_index}_widget_{widget['xref']}" in targets.ids["widgets"]:
+                    try: page.delete_widget(page.load_widget(widget["xref"]))
                     except: pass
 
         # 2. 处理 Links (链接)
-        if remove_targets.get("links"):
-            for i, link in enumerate(page.get_links()):
-                target_id = f"p{page_index}_link_{i}"
-                if any((t.get("id") == target_id if isinstance(t, dict) else t == target_id) for t in remove_targets["links"]):
+        if targets.wants("links", page_index):
+            for i, link in enumerate(index.links):
+                if f"p{page_index}_link_{i}" in targets.ids["links"]:
                     try: page.delete_link(link)
                     except: pass
 
         # 3. 处理图片 (XObjects, Inline Images, Annotations) 的物理剔除
-        if remove_targets.get("xobjects"):
+        if targets.wants("xobjects", page_index):
             # 使用 get_image_info 获取所有图片，包括 xref=0 的内联图片
-            image_info_list = page.get_image_info(xrefs=True)
+            image_info_list = list(index.images)
             
             # 获取所有注释，以便后续匹配 (针对 xref=0 的情况)
             annots = list(page.annots())
@@ -148,12 +639,15 @@ class PDFEngine:
                 xref_img = img_info.get("xref")
                 target_id = f"p{page_index}_img_{xref_img}"
                 
-                if any((t.get("id") == target_id if isinstance(t, dict) else t == target_id) for t in remove_targets["xobjects"]):
+                if targets.match_image(img_info, page_index):
                     try:
                         if xref_img > 0:
-                            print(f"Deleting XObject image reference: xref {xref_img}")
-                            # 这种方式是源码级的，它移除页面对该 XObject 的引用
-                            page.delete_image(xref_img)
+                            # delete_image 替换的是图片对象本身 (对引用它的所有页面生效)，每个 xref 只需处理一次
+                            if xref_img not in self._deleted_images:
+                                print(f"Deleting XObject image reference: xref {xref_img}")
+                                # 这种方式是源码级的，它移除页面对该 XObject 的引用
+                                page.delete_image(xref_img)
+                                self._deleted_images.add(xref_img)
                         else:
                             # xref 为 0 可能是不在资源表中的内联图片，或者是注释（Annot）中的图片
                             bbox = img_info.get("bbox")
@@ -168,6 +662,8 @@ class PDFEngine:
                                 if intersect_area > img_area * 0.9:
                                     print(f"Deleting matching annotation: {annot.type} at {annot.rect}")
                                     page.delete_annot(annot)
+                                    # 该图片已随注释删除，后续的内联图片匹配不应再计入它
+                                    index.images.remove(img_info)
                                     annot_deleted = True
                                     break
                             
@@ -179,147 +675,148 @@ class PDFEngine:
                     except Exception as e:
                         print(f"Error removing image {target_id}: {e}")
 
-        # 4. 处理矢量图形 (Drawings)
-        if remove_targets.get("drawings"):
-            print(f"DEBUG: remove_targets['drawings'] = {remove_targets['drawings']}")
-            drawings = page.get_drawings()
-            for i, dw in enumerate(drawings):
-                target_id = f"p{page_index}_draw_{i}"
-                match = False
-                for t in remove_targets["drawings"]:
-                    tid = t.get("id") if isinstance(t, dict) else t
-                    if tid == target_id:
-                        match = True
-                        break
-                
-                if match:
-                    try:
-                        bbox = dw.get("rect")
-                        if bbox:
-                            redact_rect = fitz.Rect(bbox) + (-2.0, -2.0, 2.0, 2.0)
-                            annot = page.add_redact_annot(redact_rect)
-                            annot.set_colors(fill=None)
-                            annot.update()
-                    except Exception as e:
-                        print(f"Error marking drawing {target_id} for redaction: {e}")
+        # 4. 处理矢量图形 (Drawings)：只确定需要删除的图形，删除在内容流编辑之后进行 (见 _remove_drawings)
+        if targets.wants("drawings", page_index):
+            matched = [i for i, dw in enumerate(index.drawings) if targets.match_drawing(dw, i, page_index)]
+            if matched:
+                return index.drawings, matched
+        return None
 
-    def _edit_stream_data(self, stream_data, remove_targets, add_elements, page, page_index):
-        """核心流编辑器：执行源码级增删"""
-        modified = False
-        import re
+    # 内容流编辑实现："tokenizer" (默认，单次线性扫描 Tj/TJ/'/" 与 BI...EI)
+    # 或 "regex" (旧版逐签名正则替换，保留用于对比基准)
+    stream_editor = "tokenizer"
+    # 矢量图形删除方式："path" (默认，直接删除路径操作符，无法对应时回退到 redaction)
+    # 或 "redact" (总是使用 redaction)
+    drawing_editor = "path"
 
-        # --- [删除逻辑：增强版] ---
-        # 1. 处理内联图片 (Inline Images BI...EI)
-        if remove_targets and remove_targets.get("xobjects"):
-            image_info_list = page.get_image_info(xrefs=True)
-            for img_info in image_info_list:
-                if img_info.get("xref") == 0:
-                    target_id = f"p{page_index}_img_0"
-                    if any((t.get("id") == target_id if isinstance(t, dict) else t == target_id) for t in remove_targets["xobjects"]):
-                        # 尝试在流中寻找 BI...EI 块
-                        # 确保 BI...EI 块内部不含其他的 BI，防止跨块匹配
-                        bi_pattern = r'BI(?:(?!BI).)*?ID.*?EI'
-                        regex = re.compile(bi_pattern, re.IGNORECASE | re.DOTALL)
-                        if regex.search(stream_data):
-                            print(f"Matched inline image BI...EI for {target_id}")
-                            stream_data = regex.sub('', stream_data, count=1)
-                            modified = True
+    def _plan_stream_removal(self, remove_targets, page, page_index):
+        """根据删除目标计算该页面内容流的删除计划 (与具体的流无关，每页计算一次即可)"""
+        plan = RemovalPlan()
+        if not remove_targets:
+            return plan
+
+        index = self.get_page_index(page_index, page)
+        targets = self.compile_targets(remove_targets)
+
+        # 1. 内联图片 (Inline Images BI...EI)：每个命中的 xref=0 图片删除一个 BI...EI 块
+        if targets.wants("xobjects", page_index):
+            plan.inline_images = sum(
+                1 for img_info in index.images
+                if img_info.get("xref") == 0 and targets.match_image(img_info, page_index)
+            )
 
         # 2. 处理文本删除
-        if remove_targets and remove_targets.get("text"):
+        page_targets = targets.text_by_page.get(page_index, [])
+        if page_targets or targets.text_contents:
             # 获取页面的 texttrace 以提取 glyph ID (用于处理复杂编码)
-            try:
-                trace = page.get_texttrace()
-            except:
-                trace = []
-
-            # 预处理 trace，计算每个 trace 在相同内容中的排名 (rank)
-            # 这对于区分页面上多个相同的文本（如两个 "11.09"）至关重要
-            hex_counts = {}
-            str_counts = {}
-            for t in trace:
-                # 计算 hex 签名
-                h_seq = "".join([f"{c[1]:04X}" for c in t['chars']])
-                hex_counts[h_seq] = hex_counts.get(h_seq, 0) + 1
-                t['_hex_rank'] = hex_counts[h_seq]
-                t['_hex_seq'] = h_seq
-                
-                # 计算字符串签名
-                s_content = "".join([chr(c[0]) for c in t['chars']])
-                str_counts[s_content] = str_counts.get(s_content, 0) + 1
-                t['_str_rank'] = str_counts[s_content]
-                t['_str_content'] = s_content
+            # 索引中已为每条 trace 计算好签名及其在页面中的排名 (rank)
+            trace = index.texttrace
 
             # 收集所有需要删除的 (signature, rank)
-            # signature 可以是 hex_seq 或 str_content
-            hex_to_remove = {} # {hex_seq: set(ranks)}
-            str_to_remove = {} # {str_content: set(ranks)}
+            matching_traces = []
+            for content, target_bbox in page_targets:
+                matching_traces.extend(self._match_traces(trace, content, target_bbox))
 
-            for target in remove_targets["text"]:
-                content = ""
-                target_bbox = None
-                should_remove = False
-                
-                if isinstance(target, dict):
-                    if target.get("page") == page_index:
-                        content = target.get("content", "")
-                        target_bbox = target.get("bbox")
-                        should_remove = True
-                elif isinstance(target, str):
-                    content = target
-                    should_remove = True
-                
-                if should_remove and (content or target_bbox):
-                    current_target_bbox = target_bbox
-                    
-                    # 筛选匹配的 traces
-                    matching_traces = []
-                    for t in trace:
-                        trace_text = t['_str_content']
-                        trace_bbox = t.get("bbox", [0,0,0,0])
-                        
-                        is_match = False
-                        if current_target_bbox:
-                            tx = (trace_bbox[0] + trace_bbox[2]) / 2
-                            ty = (trace_bbox[1] + trace_bbox[3]) / 2
-                            if (current_target_bbox[0] - 0.5 <= tx <= current_target_bbox[2] + 0.5 and 
-                                current_target_bbox[1] - 0.5 <= ty <= current_target_bbox[3] + 0.5):
-                                inter_x0 = max(current_target_bbox[0], trace_bbox[0])
-                                inter_y0 = max(current_target_bbox[1], trace_bbox[1])
-                                inter_x1 = min(current_target_bbox[2], trace_bbox[2])
-                                inter_y1 = min(current_target_bbox[3], trace_bbox[3])
-                                if inter_x1 > inter_x0 and inter_y1 > inter_y0:
-                                    inter_area = (inter_x1 - inter_x0) * (inter_y1 - inter_y0)
-                                    trace_area = (trace_bbox[2] - trace_bbox[0]) * (trace_bbox[3] - trace_bbox[1])
-                                    if inter_area > trace_area * 0.8:
-                                        # BBox 匹配成功。
-                                        # 如果 target 有 content，必须进一步校验内容匹配
-                                        # 以防止大范围 BBox 误删内部的其他文字
-                                        if content and str(content).strip():
-                                            t_text = trace_text.strip()
-                                            c_text = str(content).strip()
-                                            # 宽松匹配：trace 是 content 的一部分，或 content 是 trace 的一部分
-                                            if t_text and (t_text in c_text or c_text in t_text):
-                                                is_match = True
-                                        else:
-                                            # 没有 content 限制，则认为是纯区域删除
-                                            is_match = True
-                        elif content and (content == trace_text):
-                            is_match = True
-                        
-                        if is_match:
+            if targets.text_contents:
+                # 按内容匹配所有页面：整条 trace 与内容相同，或位于内容相同的文本行 (含合并后的旋转文本) 之内
+                runs = [(text, bbox) for text, _, _, bbox in index.text_runs if text in targets.text_contents]
+                for t in trace:
+                    if t['_str_content'] in targets.text_contents:
+                        matching_traces.append(t)
+                        continue
+                    for text, bbox in runs:
+                        if self._trace_in_region(t, text, bbox):
                             matching_traces.append(t)
+                            break
 
-                    for t in matching_traces:
-                        h_seq = t['_hex_seq']
-                        h_rank = t['_hex_rank']
-                        if h_seq not in hex_to_remove: hex_to_remove[h_seq] = set()
-                        hex_to_remove[h_seq].add(h_rank)
-                        
-                        s_text = t['_str_content']
-                        s_rank = t['_str_rank']
-                        if s_text not in str_to_remove: str_to_remove[s_text] = set()
-                        str_to_remove[s_text].add(s_rank)
+            # signature 可以是 hex_seq 或 str_content
+            hex_to_remove = plan.hex_to_remove # {hex_seq: set(ranks)}
+            str_to_remove = plan.str_to_remove # {str_content: set(ranks)}
+            for t in matching_traces:
+                h_seq = t['_hex_seq']
+                h_rank = t['_hex_rank']
+                if h_seq not in hex_to_remove: hex_to_remove[h_seq] = set()
+                hex_to_remove[h_seq].add(h_rank)
+
+                s_text = t['_str_content']
+                s_rank = t['_str_rank']
+                if s_text not in str_to_remove: str_to_remove[s_text] = set()
+                str_to_remove[s_text].add(s_rank)
+
+        return plan
+
+    @classmethod
+    def _match_traces(cls, trace, content, target_bbox):
+        """筛选与单个文本目标匹配的 traces：有 bbox 时按区域 (及内容) 匹配，否则按内容完全匹配"""
+        matching_traces = []
+        for t in trace:
+            if target_bbox:
+                is_match = cls._trace_in_region(t, content, target_bbox)
+            else:
+                is_match = bool(content) and content == t['_str_content']
+            if is_match:
+                matching_traces.append(t)
+        return matching_traces
+
+    @staticmethod
+    def _trace_in_region(t, content, target_bbox):
+        trace_text = t['_str_content']
+        trace_bbox = t.get("bbox", [0,0,0,0])
+        tx = (trace_bbox[0] + trace_bbox[2]) / 2
+        ty = (trace_bbox[1] + trace_bbox[3]) / 2
+        if not (target_bbox[0] - 0.5 <= tx <= target_bbox[2] + 0.5 and
+                target_bbox[1] - 0.5 <= ty <= target_bbox[3] + 0.5):
+            return False
+        inter_x0 = max(target_bbox[0], trace_bbox[0])
+        inter_y0 = max(target_bbox[1], trace_bbox[1])
+        inter_x1 = min(target_bbox[2], trace_bbox[2])
+        inter_y1 = min(target_bbox[3], trace_bbox[3])
+        if not (inter_x1 > inter_x0 and inter_y1 > inter_y0):
+            return False
+        inter_area = (inter_x1 - inter_x0) * (inter_y1 - inter_y0)
+        trace_area = (trace_bbox[2] - trace_bbox[0]) * (trace_bbox[3] - trace_bbox[1])
+        if inter_area <= trace_area * 0.8:
+            return False
+        # BBox 匹配成功。
+        # 如果 target 有 content，必须进一步校验内容匹配
+        # 以防止大范围 BBox 误删内部的其他文字
+        if content and str(content).strip():
+            t_text = trace_text.strip()
+            c_text = str(content).strip()
+            # 宽松匹配：trace 是 content 的一部分，或 content 是 trace 的一部分
+            return bool(t_text) and (t_text in c_text or c_text in t_text)
+        # 没有 content 限制，则认为是纯区域删除
+        return True
+
+    def _edit_stream_data(self, stream_data, remove_targets, add_elements, page, page_index, plan=None):
+        """核心流编辑器：执行源码级增删"""
+        if plan is None:
+            plan = self._plan_stream_removal(remove_targets, page, page_index)
+        if plan.is_empty:
+            return stream_data, False
+        if self.stream_editor == "regex":
+            return self._apply_removal_regex(stream_data, plan)
+        return content_stream.remove_content(
+            stream_data, plan.hex_to_remove, plan.str_to_remove, plan.inline_images
+        )
+
+    def _apply_removal_regex(self, stream_data, plan):
+        """旧版实现：为每个签名编译组合正则并对整个流执行替换"""
+        modified = False
+
+        # 1. 处理内联图片 (Inline Images BI...EI)
+        # 确保 BI...EI 块内部不含其他的 BI，防止跨块匹配
+        bi_pattern = r'BI(?:(?!BI).)*?ID.*?EI'
+        regex = re.compile(bi_pattern, re.IGNORECASE | re.DOTALL)
+        for _ in range(plan.inline_images):
+            if regex.search(stream_data):
+                stream_data = regex.sub('', stream_data, count=1)
+                modified = True
+
+        # 2. 处理文本删除
+        if plan.hex_to_remove or plan.str_to_remove:
+            hex_to_remove = plan.hex_to_remove
+            str_to_remove = plan.str_to_remove
 
             # 1. 执行 Hex 级删除
             for h_seq, ranks in hex_to_remove.items():
@@ -389,32 +886,49 @@ class PDFEngine:
         return stream_data, modified
 
     def _get_all_xobject_xrefs(self, xref, seen=None):
-        """递归获取所有嵌套的 XObject xrefs"""
-        if seen is None:
-            seen = set()
-        
-        if xref in seen:
-            return seen
-        
-        seen.add(xref)
-        
-        # 检查该对象是否包含其他 XObjects
-        try:
-            xobject_list = self.src_doc.get_page_xobjects(xref) if hasattr(self.src_doc, 'get_page_xobjects') else []
-            # 注意：PyMuPDF 中没有直接获取 XObject 内部引用的简单方法，
-            # 通常需要解析 /Resources 字典。这里使用 get_xobjects 的变体或解析。
-            # 实际上，page.get_xobjects() 已经能覆盖大部分情况。
-            # 这里的递归主要针对 Form XObject 内部可能引用的其他 Form XObject。
-        except:
-            pass
-            
-        return seen
+        """递归获取所有嵌套的 XObject xrefs (包含 xref 自身)"""
+        if self._xobject_graph is None:
+            self._xobject_graph = XObjectGraph(self.src_doc)
+        return self._xobject_graph.reachable(xref, seen)
+
+    def _edit_streams(self, page, plan):
+        """
+        按删除计划编辑页面的内容流及其 (嵌套) 引用的 Form XObject。
+        被多个页面共享的 Form XObject 只解析一次：首次读取时记录其文本概要，之后的页面先用概要判断
+        计划能否命中，不能命中则无需解码；同一个计划对同一个流也只执行一次
+        """
+        # 注意：clean_contents 可能合并内容流，这里需要读取最新的 xref 列表
+        content_xrefs = page.get_contents()
+        form_xrefs = self._get_all_xobject_xrefs(page.xref) - {page.xref}
+        plan_key = plan.key
+        for xref in list(content_xrefs) + sorted(form_xrefs):
+            applied = self._stream_plans.setdefault(xref, set())
+            if plan_key in applied:
+                continue
+            try:
+                summary = self._stream_summaries.get(xref)
+                if summary is not None and not summary.may_match(
+                        plan.hex_to_remove, plan.str_to_remove, plan.inline_images):
+                    applied.add(plan_key)
+                    continue
+                # 使用 latin-1 以保持二进制数据的完整性
+                stream_data = self.src_doc.xref_stream(xref).decode('latin-1')
+                # 注意：这里只处理删除逻辑
+                new_data, modified = self._edit_stream_data(stream_data, None, None, page, None, plan=plan)
+                if modified:
+                    self.src_doc.update_stream(xref, new_data.encode('latin-1'))
+                if xref in form_xrefs:
+                    summary_data = new_data if modified else stream_data
+                    self._stream_summaries[xref] = content_stream.summarize(summary_data)
+                applied.add(plan_key)
+            except Exception as e:
+                print(f"Error editing stream {xref}: {e}")
 
     def render_to_page(self, page, data, remove_targets=None, add_elements=None, page_index=None):
         """模块化重构后的页面渲染逻辑"""
         # 1. 处理对象级物理删除 (Widgets, Links, XObjects, Drawings)
         # 注意：先执行物理删除，再执行内容流编辑
-        self._process_objects(page, remove_targets, page_index)
+        drawings = self._process_objects(page, remove_targets, page_index)
 
         # 2. 清理页面内容流 (放在物理删除之后)
         try:
@@ -424,204 +938,402 @@ class PDFEngine:
             pass
 
         # 3. 处理内容流级源码编辑 (Text, Inline Images)
-        # 收集所有相关的 stream xrefs (包括内容流和引用的 XObjects)
-        all_stream_xrefs = set(page.get_contents())
-        
-        # 递归获取页面直接引用的所有 XObjects
-        xobject_list = page.get_xobjects()
-        for x in xobject_list:
-            xref = x[0]
-            all_stream_xrefs.add(xref)
+        # 删除计划只与页面有关，每页计算一次；没有需要删除的内容时无需读取任何流
+        plan = self._plan_stream_removal(remove_targets, page, page_index)
+        if not plan.is_empty:
+            # 页面内容流及其引用的 (嵌套) Form XObject，共享的 XObject 在整个文档中只编辑一次
+            self._edit_streams(page, plan)
 
-        for xref in all_stream_xrefs:
-            try:
-                # 使用 latin-1 以保持二进制数据的完整性
-                stream_data = self.src_doc.xref_stream(xref).decode('latin-1')
-                # 注意：这里只处理删除逻辑
-                new_data, modified = self._edit_stream_data(
-                    stream_data, remove_targets, None, page, page_index
-                )
-                if modified:
-                    self.src_doc.update_stream(xref, new_data.encode('latin-1'))
-            except Exception as e:
-                print(f"Error editing stream {xref}: {e}")
+        # 矢量图形优先直接从内容流中删除路径，不能对应时再使用 redaction
+        if drawings and self.drawing_editor == "path" and self._remove_paths(page, *drawings):
+            drawings = None
 
         # 4. 处理新增元素 (Watermarks/Elements)
         # 放在所有删除和流更新之后，确保新元素在最上层
-        if add_elements:
-            for el in add_elements:
-                try:
-                    if el.get("type") == "text":
-                        text = el.get("text", "")
-                        point = el.get("point", fitz.Point(0, 0))
-                        fontsize = el.get("fontsize", 12)
-                        color = el.get("color", (0, 0, 0))
-                        rotate = el.get("rotate", 0)
-                        opacity = el.get("opacity", 1.0)
-                        fontname = el.get("fontname", "helv")
-                        
-                        # 为了实现中心对齐，我们需要计算文本宽度
-                        # 字体映射表
-                        font_map = {
-                            "song": "/usr/share/fonts/truetype/arphic/uming.ttc",
-                            "kai": "/usr/share/fonts/truetype/arphic/ukai.ttc",
-                            "xingkai": "/usr/share/fonts/truetype/arphic/ukai.ttc", # 暂用楷体代替行楷
-                            "yahei": "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-                            "times-roman": "tiro"
-                        }
-
-                        # 确定最终使用的 fontname 和 font 对象
-                        final_fontname = fontname
-                        try:
-                            if fontname in font_map:
-                                f_path = font_map[fontname]
-                                if f_path.startswith("/"):
-                                    # 自定义字体：需要先注册到页面
-                                    # 使用 fontname 作为引用名，必须确保整个文档一致
-                                    # 注意：insert_font 的 fontname 参数是 PDF 内部使用的资源名
-                                    page.insert_font(fontname=fontname, fontfile=f_path)
-                                    # 创建 font 对象用于计算宽度
-                                    font = fitz.Font(fontfile=f_path)
-                                    final_fontname = fontname
-                                else:
-                                    # 内置字体
-                                    font = fitz.Font(f_path)
-                                    final_fontname = f_path
-                            else:
-                                # 尝试直接加载 (如果不是 helv 等标准名，可能会失败)
-                                font = fitz.Font(fontname)
-                                final_fontname = fontname
-                        except Exception as e:
-                            # 如果加载失败，回退到 Helvetica
-                            print(f"Font loading failed for {fontname}: {e}, falling back to helv")
-                            font = fitz.Font("helv")
-                            final_fontname = "helv"
-                            
-                        text_width = font.text_length(text, fontsize=fontsize)
-                        
-                        # 计算偏移量：水平居中 (width/2)，垂直居中 (约 fontsize/3)
-                        # 注意：insert_text 的 point 是基线左侧点
-                        # 我们先计算相对于中心点的原始偏移
-                        origin_x = point.x - text_width / 2
-                        origin_y = point.y + fontsize / 3
-                        
-                        # 为了支持旋转，我们使用 Matrix
-                        # morph 参数 (fixed_point, matrix) 表示以 fixed_point 为中心应用 matrix
-                        matrix = fitz.Matrix(rotate)
-                        
-                        page.insert_text(
-                            fitz.Point(origin_x, origin_y), 
-                            text, 
-                            fontsize=fontsize, 
-                            color=color, 
-                            morph=(point, matrix),
-                            fill_opacity=opacity,
-                            stroke_opacity=opacity,
-                            fontname=final_fontname
-                        )
-                    elif el.get("type") == "image" and "stream" in el:
-                        rect = el.get("rect")
-                        rotate = el.get("rotate", 0)
-                        if rect:
-                            page.insert_image(
-                                rect, 
-                                stream=el["stream"], 
-                                overlay=True,
-                                rotate=rotate
-                            )
-                except Exception as e:
-                    print(f"Error adding element to page: {e}")
+        self._add_elements(page, add_elements, shared=True)
 
         # 5. 最后执行 apply_redactions
         # 这一步必须放在所有 update_stream 之后，因为它会重新生成内容流并移除被遮盖的指令
-        if remove_targets and remove_targets.get("drawings"):
+        if drawings:
+            self._redact_drawings(page, *drawings)
+
+        # 页面已被修改，之前提取的索引不再有效
+        self.invalidate_page_index(page_index)
+
+    # 路径绘制操作符 -> get_drawings 中的图形类型
+    PAINT_TYPES = {"S": "s", "s": "s", "f": "f", "F": "f", "f*": "f", "B": "fs", "B*": "fs", "b": "fs", "b*": "fs"}
+
+    def _remove_paths(self, page, all_drawings, matched):
+        """
+        直接从内容流中删除命中图形的路径构造与绘制操作符，不影响与其重叠的其他图形。
+        要求页面只有一个内容流、不引用 Form XObject，且流中绘制的路径与 get_drawings 的结果逐一对应
+        (数量与类型一致)；命中的路径带有裁剪时也不处理。不满足时返回 False，由调用方回退到 redaction
+        """
+        contents = page.get_contents()
+        if len(contents) != 1 or self._get_all_xobject_xrefs(page.xref) != {page.xref}:
+            return False
+        try:
+            data = self.src_doc.xref_stream(contents[0]).decode('latin-1')
+            paths = [p for p in content_stream.iter_paths(data) if p.paint != "n"]
+            if len(paths) != len(all_drawings):
+                return False
+            for path, dw in zip(paths, all_drawings):
+                if self.PAINT_TYPES[path.paint] != dw.get("type"):
+                    return False
+            removed = [paths[i] for i in matched]
+            if any(p.clip for p in removed):
+                return False
+            new_data = content_stream.remove_ranges(data, [(p.start, p.end) for p in removed])
+            self.src_doc.update_stream(contents[0], new_data.encode('latin-1'))
+            return True
+        except Exception as e:
+            print(f"Path-level drawing removal failed, falling back to redaction: {e}")
+            return False
+
+    @staticmethod
+    def _redact_drawings(page, all_drawings, matched):
+        """
+        用 redaction 删除命中的图形：相交或相邻的区域合并为一个 redaction 矩形
+        (不会因此触及其他图形，见 spatial.merge_rects)，整页只执行一次 apply_redactions
+        """
+        matched_set = set(matched)
+        rects = []
+        blockers = []
+        for i, dw in enumerate(all_drawings):
+            bbox = dw.get("rect")
+            if not bbox:
+                continue
+            if i in matched_set:
+                rects.append(fitz.Rect(bbox) + (-2.0, -2.0, 2.0, 2.0))
+            else:
+                blockers.append(fitz.Rect(bbox))
+        try:
+            if len(rects) > 1:
+                # redaction 同时删除与之重叠的文字 (text=False)，合并后的区域同样不能触及新的文字
+                blockers.extend(fitz.Rect(w[:4]) for w in page.get_text("words"))
+            for rect in spatial.merge_rects(rects, blockers):
+                page.add_redact_annot(rect, fill=False)
+            # graphics=2: 只删除红框内的矢量指令片段。配合微小边距，可精准移除水印源码。
+            page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE, graphics=2, text=False)
+        except Exception as e:
+            print(f"Error applying final redactions: {e}")
+
+    def _add_elements(self, page, add_elements, shared=False):
+        """
+        在页面最上层绘制新增元素 (文本/图片水印)。
+        shared=True 时 (整份文档重构) 相同的元素只生成一次：图片复用首次插入的图片对象，
+        文本绘制到一个 Form XObject 中，各页只引用它，不再逐页插入字体和文本
+        """
+        if not add_elements:
+            return
+        for el in add_elements:
             try:
-                # graphics=2: 只删除红框内的矢量指令片段。配合微小边距，可精准移除水印源码。
-                page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE, graphics=2, text=False)
+                if el.get("type") == "text":
+                    if shared:
+                        self._stamp_text(page, el)
+                    else:
+                        self._draw_text(page, el)
+                elif el.get("type") == "image" and "stream" in el:
+                    rect = el.get("rect")
+                    if rect:
+                        self._insert_image(page, el, rect, shared)
             except Exception as e:
-                print(f"Error applying final redactions: {e}")
+                print(f"Error adding element to page: {e}")
+
+    @staticmethod
+    def _draw_text(page, el):
+        text = el.get("text", "")
+        point = el.get("point", fitz.Point(0, 0))
+        fontsize = el.get("fontsize", 12)
+        color = el.get("color", (0, 0, 0))
+        rotate = el.get("rotate", 0)
+        opacity = el.get("opacity", 1.0)
+        fontname = el.get("fontname", "helv")
+        
+        # 为了实现中心对齐，我们需要计算文本宽度 (字体对象由字体注册表缓存)
+        resolved = fonts.resolve(fontname)
+        try:
+            # 自定义字体需要先注册到页面
+            resolved.register(page)
+        except Exception as e:
+            print(f"Font registration failed for {fontname}: {e}, falling back to {fonts.FALLBACK_FONT}")
+            resolved = fonts.resolve(fonts.FALLBACK_FONT)
+        font = resolved.font
 
-    def _enrich_targets(self, remove_targets):
+        text_width = font.text_length(text, fontsize=fontsize)
+        
+        # 计算偏移量：水平居中 (width/2)，垂直居中 (约 fontsize/3)
+        # 注意：insert_text 的 point 是基线左侧点
+        # 我们先计算相对于中心点的原始偏移
+        origin_x = point.x - text_width / 2
+        origin_y = point.y + fontsize / 3
+        
+        # 为了支持旋转，我们使用 Matrix
+        # morph 参数 (fixed_point, matrix) 表示以 fixed_point 为中心应用 matrix
+        matrix = fitz.Matrix(rotate)
+        
+        page.insert_text(
+            fitz.Point(origin_x, origin_y), 
+            text, 
+            fontsize=fontsize, 
+            color=color, 
+            morph=(point, matrix),
+            fill_opacity=opacity,
+            stroke_opacity=opacity,
+            fontname=resolved.name
+        )
+
+    def _stamp_text(self, page, el):
+        """
+        文本水印的印章：在与目标页面尺寸、裁剪框和旋转相同的空白页上绘制一次，
+        再用 show_pdf_page 引用 (同一源页面在同一文档中只复制一次，各页仅增加一个很小的引用对象)
+        """
+        if page.rotation and page.cropbox != page.mediabox:
+            # show_pdf_page 对同时旋转且裁剪的页面定位有偏差，直接绘制
+            self._draw_text(page, el)
+            return
+        color = el.get("color", (0, 0, 0))
+        key = (
+            id(page.parent), el.get("text", ""), el.get("fontsize", 12), tuple(color) if color else None,
+            el.get("rotate", 0), el.get("opacity", 1.0), el.get("fontname", "helv"), tuple(el.get("point", (0, 0))),
+            tuple(page.mediabox), tuple(page.cropbox), page.rotation
+        )
+        stamp = self._stamps.get(key)
+        if stamp is None:
+            stamp = fitz.open()
+            stamp_page = stamp.new_page(width=page.mediabox.width, height=page.mediabox.height)
+            stamp_page.set_mediabox(page.mediabox)
+            stamp_page.set_cropbox(page.cropbox)
+            stamp_page.set_rotation(page.rotation)
+            self._draw_text(stamp_page, el)
+            self._stamps[key] = stamp
+        page.show_pdf_page(page.rect, stamp, 0, overlay=True)
+
+    def _insert_image(self, page, el, rect, shared):
+        """shared 时同一图片数据在文档中只嵌入一次，之后的页面按 xref 引用"""
+        rotate = el.get("rotate", 0)
+        stream = el["stream"]
+        # 按内容区分图片：各页分别以 base64 传入的同一张图片也只嵌入一次 (image_key 由预处理时计算)
+        key = (id(page.parent), el.get("image_key") or hashlib.sha1(stream).hexdigest()) if shared else None
+        xref = self._image_xrefs.get(key) if shared else None
+        if xref:
+            page.insert_image(rect, xref=xref, overlay=True, rotate=rotate)
+            return
+        xref = page.insert_image(rect, stream=stream, overlay=True, rotate=rotate)
+        if shared:
+            self._image_xrefs[key] = xref
+
+    def _enrich_targets(self, remove_targets, pages=None):
         """
         补全 remove_targets 中的缺失信息 (如根据 id 补全 bbox, 根据 content 补全 metadata)
         确保传入后端的哪怕只有简单信息，也能在后端被补全为高精度信息。
+        只解析目标 ID (p{page}_...) 实际引用到的页面，已带有完整信息的目标直接跳过；
+        pages 不为空时 (如单页预览)，只补全这些页面上的目标。
         """
         if not remove_targets:
             return
 
-        # 建立一个全局映射表
-        lookup_map = {
-            "text": {},
-            "xobjects": {},
-            "drawings": {},
-            "widgets": {},
-            "links": {}
-        }
-
-        # 扫描所有页面提取全量元数据
-        for i in range(len(self.src_doc)):
-            page = self.src_doc[i]
-            # 临时重用提取逻辑
-            page_data = self.extract_page_data(page, page_index=i)
-            for el in page_data["interactive_elements"]:
-                el_type = el["type"]
-                # 转换类型名称以匹配 remove_targets 的 key
-                if el_type == "text": map_key = "text"
-                elif el_type == "image": map_key = "xobjects"
-                else: map_key = f"{el_type}s"
-                
-                if map_key in lookup_map:
-                    lookup_map[map_key][el["id"]] = el
-                    # 同时支持通过内容搜索（仅限文本）
-                    if el_type == "text":
-                        content = el["content"]
-                        if content not in lookup_map["text"]:
-                            lookup_map["text"][content] = el
-
-        # 执行补全
-        for category in ["text", "xobjects", "drawings", "widgets", "links"]:
+        for category in TARGET_CATEGORIES:
             if category not in remove_targets: continue
-            
+
             targets = remove_targets[category]
             new_targets = []
             for t in targets:
                 if isinstance(t, str):
                     # 如果是纯字符串且是文本类，尝试寻找匹配的对象补全坐标
-                    if category == "text" and t in lookup_map["text"]:
-                        new_targets.append(lookup_map["text"][t])
-                    else:
-                        new_targets.append(t)
+                    location = self._locate_text(t) if category == "text" else None
+                    new_targets.append(location.copy() if location else t)
                 elif isinstance(t, dict):
                     tid = t.get("id")
-                    if tid and tid in lookup_map[category]:
+                    page_no = target_page(tid)
+                    if (is_target_complete(category, t) or page_no is None
+                            or (pages is not None and page_no not in pages)
+                            or not 0 <= page_no < len(self.src_doc)):
+                        new_targets.append(t)
+                        continue
+                    found = self.get_page_index(page_no).find_element(category, tid)
+                    if found:
                         # 合并信息：用查找到的完整信息作为基础，保留传入的特定覆盖
-                        enriched = lookup_map[category][tid].copy()
+                        enriched = found.copy()
                         enriched.update(t)
                         new_targets.append(enriched)
                     else:
                         new_targets.append(t)
+                else:
+                    new_targets.append(t)
             remove_targets[category] = new_targets
 
-    def reconstruct(self, remove_targets=None, page_modifiers=None):
+    def _locate_text(self, content):
+        """通过按文档缓存的 内容->位置 索引查找文本首次出现的位置"""
+        index = None
+        if self.doc_key:
+            index = _TEXT_LOCATION_CACHE.get(self.doc_key)
+        if index is None:
+            index = TextLocationIndex()
+            if self.doc_key:
+                # 每个文档计为 1，预算即缓存的文档数量
+                _TEXT_LOCATION_CACHE.put(self.doc_key, index, 1)
+        return index.locate(self, content)
+
+    def reconstruct(self, remove_targets=None, page_modifiers=None, workers=1, progress=None):
         """
         通过直接修改原文档来重构 PDF
+        workers > 1 且文档满足条件时，按页段分发到多个进程并行处理 (见 reconstruct_parallel)
+        progress(done, total) 在每处理完一页 (并行模式下为一个页段) 后调用，抛出异常即中止重构
         """
+        if progress:
+            progress(0, len(self.src_doc))
+
         # 0. 自动补全目标信息 (后端补全，确保精度)
         self._enrich_targets(remove_targets)
 
+        if workers > 1 and self._can_parallelize(remove_targets):
+            return self.reconstruct_parallel(remove_targets, page_modifiers, workers, progress)
+
         # 1. 处理 OCG 图层
         if remove_targets and remove_targets.get("layers"):
             for xref in remove_targets["layers"]:
                 self.src_doc.set_ocg(xref, on=False)
 
-        for i in range(len(self.src_doc)):
+        page_count = len(self.src_doc)
+        for i in range(page_count):
             page = self.src_doc[i]
-            add_els = page_modifiers.get(i, []) if page_modifiers else []
+            add_els = page_elements(page_modifiers, i)
             # 在原页面上应用修改，传入当前页面索引 i
             self.render_to_page(page, None, remove_targets, add_els, page_index=i)
+            if progress:
+                progress(i + 1, page_count)
             
         return self.src_doc
 
+    def _can_parallelize(self, remove_targets):
+        """
+        并行模式按页拆分再用 insert_pdf 合并，只能保留页面内容及元数据/目录/页码标签。
+        含图层、表单、附件、页内跳转的文档依赖跨页结构，保持串行以保证输出一致。
+        """
+        # 工作进程按路径各自打开文档，避免在进程间传输整份文件
+        if self.path is None or len(self.src_doc) < PARALLEL_MIN_PAGES:
+            return False
+        if remove_targets and remove_targets.get("layers"):
+            return False
+        doc = self.src_doc
+        if doc.is_encrypted or doc.is_form_pdf or doc.get_ocgs() or doc.embfile_count():
+            return False
+        # 页内跳转链接在拆分后会丢失目标页
+        for page in doc:
+            if any(link["kind"] in (fitz.LINK_GOTO, fitz.LINK_NAMED) for link in page.get_links()):
+                return False
+        return True
+
+    def reconstruct_parallel(self, remove_targets, page_modifiers, workers, progress=None):
+        """
+        将文档拆分为 workers 个连续页段，每个工作进程从相同的文件独立打开文档并处理自己的页段，
+        最后按顺序用 insert_pdf 合并。remove_targets 需已补全 (工作进程中不再跨页查找)。
+        """
+        page_count = len(self.src_doc)
+        chunk = -(-page_count // workers)
+        ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+        pool = get_process_pool(workers)
+        futures = [
+            pool.submit(
+                _reconstruct_range, self.path, remove_targets,
+                {i: els for i, els in (page_modifiers or {}).items() if i == ALL_PAGES or start <= i < end},
+                start, end
+            )
+            for start, end in ranges
+        ]
+
+        merged = fitz.open()
+        try:
+            for (start, end), future in zip(ranges, futures):
+                part = fitz.open(stream=future.result(), filetype="pdf")
+                try:
+                    merged.insert_pdf(part)
+                finally:
+                    part.close()
+                if progress:
+                    progress(end, page_count)
+        except BaseException as e:
+            # 中止时取消尚未开始的页段
+            for future in futures:
+                future.cancel()
+            merged.close()
+            if isinstance(e, BrokenProcessPool):
+                discard_process_pool(workers, pool)
+            raise
+
+        # 补回文档级信息
+        merged.set_metadata(self.src_doc.metadata)
+        toc = self.src_doc.get_toc(simple=False)
+        if toc:
+            merged.set_toc(toc)
+        labels = self.src_doc.get_page_labels()
+        if labels:
+            merged.set_page_labels(labels)
+
+        # 结果文档替换源文档，close() 时一并释放
+        self.src_doc.close()
+        self.src_doc = merged
+        self._page_indexes = {}
+        return merged
+
+
+def save_document(doc, output):
+    """
+    保存重构结果。output 可以是文件路径或可写的文件对象
+    """
+    # 关键优化：字体子集化 (Font Subsetting)
+    # 这将极大减小包含中文字体的 PDF 体积，只保留用到的字符
+    try:
+        doc.subset_fonts()
+    except Exception as e:
+        print(f"Warning: subset_fonts failed: {e}")
+    # 关键优化：garbage=4 (最高级别，包含去重)，deflate=True (压缩流)
+    doc.save(output, garbage=4, deflate=True)
+
+
+# 少于该页数的文档并行收益不足以抵消进程间传输和重复解析的开销
+PARALLEL_MIN_PAGES = 64
+
+_process_pools = {}
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    """获取 (惰性创建) 共享的进程池。使用 spawn，避免在多线程服务进程中 fork"""
+    with _process_pool_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            # 在批量通道的子进程中创建时，进程退出会先 join 所有子进程，而进程池的退出钩子在那之后才通知
+            # 工作进程结束，两者互相等待。注册终结器在 join 之前关闭进程池；
+            # 优先级须高于任务队列自身的关闭终结器 (exitpriority=10)，否则结束信号发不出去
+            multiprocessing.util.Finalize(pool, pool.shutdown, exitpriority=20)
+            _process_pools[workers] = pool
+        return pool
+
+
+def discard_process_pool(workers, pool):
+    """丢弃已损坏的进程池 (如工作进程被杀)，下次使用时重建"""
+    with _process_pool_lock:
+        if _process_pools.get(workers) is pool:
+            del _process_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _reconstruct_range(path, remove_targets, page_modifiers, start, end):
+    """工作进程：处理 [start, end) 页，返回仅包含这些页面的 PDF 字节"""
+    engine = PDFEngine(path)
+    try:
+        doc = engine.src_doc
+        for i in range(start, end):
+            engine.render_to_page(doc[i], None, remove_targets, page_elements(page_modifiers, i), page_index=i)
+        doc.select(list(range(start, end)))
+        return doc.tobytes()
+    finally:
+        engine.close()
+
+
 def get_signature_preview(pdf_bytes, sig_image_bytes, x_pos, y_pos, scale, page_index=0):
     """
     生成带有签名的预览图 (保留用于兼容性，但内部实现已优化)